@@ -0,0 +1,384 @@
+# audio_capture.py
+# 常开麦克风采集：只打开一次输入设备，回调模式把数据写入预分配的环形缓冲区，
+# 唤醒词监听和指令监听各自用游标(cursor)读取，不再各自开关设备。
+import io
+import json
+import os
+import socket
+import threading
+import time
+import wave
+import zipfile
+
+import numpy as np
+
+MIC_SAMPLE_RATE = 16000
+# 指令监听开始时向前回溯的音频长度，避免唤醒后紧接着说的话被截掉开头
+MIC_PREROLL_MS = int(os.environ.get("MIC_PREROLL_MS", "300"))
+# 输入设备："pyaudio" 为真实麦克风；"null" 不打开声卡，按实时速率产生低电平噪声（基准测试、无声卡调试用）；
+# "wav:路径" 回放 WAV 文件或会话录制的 zip（session_recorder.py，取其中的 mic.wav）代替麦克风
+MIC_SOURCE = os.environ.get("MIC_SOURCE", "pyaudio")
+# null 输入的控制端口：本机 UDP 收到 {"speech_ms": N} 后接下来 N 毫秒产生语音电平的噪声，0 表示不监听
+MIC_NULL_CONTROL_PORT = int(os.environ.get("MIC_NULL_CONTROL_PORT", "0"))
+# wav 输入的回放速度：1 为实时，2 为两倍速；0 表示尽快，但只在有监听器把数据读完时才继续写，不会被环形缓冲区覆盖
+MIC_REPLAY_SPEED = float(os.environ.get("MIC_REPLAY_SPEED", "1"))
+
+
+def load_wav(path, rate=MIC_SAMPLE_RATE):
+    """读取 16bit WAV（或会话 zip 里的 mic.wav），混成单声道并重采样到 rate，返回 int16 数组"""
+    if path.lower().endswith(".zip"):
+        with zipfile.ZipFile(path) as z:
+            data = z.read("mic.wav")
+        reader = wave.open(io.BytesIO(data), "rb")
+    else:
+        reader = wave.open(path, "rb")
+    with reader:
+        if reader.getsampwidth() != 2:
+            raise ValueError(f"{path}: 只支持 16bit PCM WAV")
+        channels, src_rate = reader.getnchannels(), reader.getframerate()
+        samples = np.frombuffer(reader.readframes(reader.getnframes()), dtype=np.int16)
+    if channels > 1:
+        samples = samples.reshape(-1, channels).mean(axis=1)
+    if src_rate != rate and samples.size:
+        positions = np.arange(int(samples.size * rate / src_rate)) * (src_rate / rate)
+        samples = np.interp(positions, np.arange(samples.size), samples)
+    return samples.astype(np.int16)
+
+
+class CaptureCursor:
+    """环形缓冲区上的一个读取位置，每个监听器一个"""
+    def __init__(self, capture, position):
+        self._capture = capture
+        self.position = position # 以采样点计的绝对位置
+        self.dropped_samples = 0 # 读得太慢被覆盖掉的采样点数
+        self.underruns = 0 # 等待数据超时的次数
+
+    def read(self, nbytes, timeout=1.0):
+        """读取 nbytes 字节 16bit PCM，超时返回 None，采集已停止返回 b"""""
+        return self._capture._read(self, nbytes // 2, timeout)
+
+    def available(self):
+        return self._capture.total_samples - self.position
+
+    def close(self):
+        self._capture._unsubscribe(self)
+
+
+class NullMicrophoneSource:
+    """
+    不接声卡的输入设备替身：后台线程按实时速率把低电平噪声写入采集缓冲区，
+    接口与 PyAudio 流的 start_stream/stop_stream/close 一致。
+    speak(ms) 让接下来 ms 毫秒变成语音电平，VAD、上行门控和端点检测会像听到有人说话一样工作。
+    """
+    def __init__(self, capture, noise_level=30, speech_level=3000, control_port=0):
+        self._capture = capture
+        self.noise_level = noise_level
+        self.speech_level = speech_level
+        self.control_port = control_port
+        self._speech_samples = 0 # 还要产生多少个语音电平的采样点
+        self._lock = threading.Lock()
+        self._running = threading.Event()
+        self._sock = None
+        self._rng = np.random.default_rng()
+
+    def speak(self, ms):
+        with self._lock:
+            self._speech_samples = max(self._speech_samples, int(self._capture.rate * ms / 1000))
+
+    def start_stream(self):
+        if self.control_port > 0:
+            self._sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            self._sock.bind(("127.0.0.1", self.control_port))
+            threading.Thread(target=self._control_loop, name="mic-null-control", daemon=True).start()
+        self._running.set()
+        threading.Thread(target=self._clock_loop, name="mic-null", daemon=True).start()
+
+    def _clock_loop(self):
+        n = self._capture.frames_per_buffer
+        period = n / self._capture.rate
+        next_tick = time.monotonic()
+        while self._running.is_set():
+            with self._lock:
+                speech = min(n, self._speech_samples)
+                self._speech_samples -= speech
+            block = self._rng.normal(0, self.noise_level, n)
+            block[:speech] = self._rng.normal(0, self.speech_level, speech)
+            self._capture.write(np.clip(block, -32768, 32767).astype(np.int16).tobytes())
+            next_tick += period
+            time.sleep(max(0.0, next_tick - time.monotonic()))
+
+    def _control_loop(self):
+        while True:
+            try:
+                data, _ = self._sock.recvfrom(1024)
+                self.speak(float(json.loads(data.decode("utf-8")).get("speech_ms", 0)))
+            except (OSError, ValueError, TypeError, AttributeError):
+                if self._sock.fileno() < 0: # 已关闭
+                    return
+
+    def stop_stream(self):
+        self._running.clear()
+
+    def close(self):
+        self._running.clear()
+        if self._sock is not None:
+            self._sock.close()
+
+
+class WavMicrophoneSource:
+    """
+    用录好的音频代替麦克风，接口与 NullMicrophoneSource 相同。文件放完后改为写入静音，监听器按各自的超时退出。
+
+    speed > 0 时按 speed 倍实时速率写入。speed == 0 时尽快写入，但要等所有监听器读完上一块才写下一块；
+    回放会话 zip 时还按录制时每个监听器的起止位置（events.jsonl 的 listen_start/listen_stop）对齐：
+    新的监听器开始时跳过录音里两次监听之间的空档（当时在播 TTS、等 LLM），写到录制时该监听器结束的位置后暂停，
+    等现在的监听器也结束；超过 hold_seconds 还没结束（例如这次的识别结果来得更慢）就按实时速率继续往下写。
+    """
+    hold_seconds = 2.0
+
+    def __init__(self, capture, path, speed=MIC_REPLAY_SPEED):
+        self._capture = capture
+        self.path = path
+        self.speed = speed
+        self.samples = load_wav(path, capture.rate)
+        self.position = 0 # 已写入（或跳过）的采样点数
+        self.segments = [] # 录制时各监听器读取的 (起点, 终点) 采样点位置
+        if path.lower().endswith(".zip"):
+            from session_recorder import listen_segments
+            self.segments = listen_segments(path, capture.rate)
+        self._segment = -1
+        self._segment_stop = None
+        self._held_since = None
+        self._realtime = False # 停顿超时后改按实时速率写，直到下一个监听器
+        self._subscriptions = 0 # 已经对齐过的监听器个数
+        self._running = threading.Event()
+
+    @property
+    def finished(self):
+        return self.position >= self.samples.size
+
+    def start_stream(self):
+        self._running.set()
+        threading.Thread(target=self._clock_loop, name="mic-wav", daemon=True).start()
+
+    def _clock_loop(self):
+        n = self._capture.frames_per_buffer
+        silence = np.zeros(n, dtype=np.int16)
+        next_tick = time.monotonic()
+        while self._running.is_set():
+            if self.finished:
+                self._capture.write(silence.tobytes())
+                period = n / self._capture.rate
+            elif self.speed > 0:
+                period = self._write_block(n, self.samples.size) / self._capture.rate / self.speed
+            else:
+                limit = self._fast_limit(n)
+                if limit is None:
+                    time.sleep(0.002)
+                    next_tick = time.monotonic()
+                    continue
+                written = self._write_block(n, limit)
+                period = written / self._capture.rate if self._realtime else 0.0
+            next_tick += period
+            time.sleep(max(0.0, next_tick - time.monotonic()))
+
+    def _write_block(self, n, limit):
+        block = self.samples[self.position:min(self.position + n, limit)]
+        self._capture.write(block.tobytes())
+        self.position += block.size
+        if self.finished:
+            print(f"麦克风回放结束: {self.path} ({self.samples.size / self._capture.rate:.1f} 秒)")
+        return block.size
+
+    def _fast_limit(self, n):
+        """尽快模式下这次最多能写到的位置，现在不该写时返回 None"""
+        backlog = self._capture.backlog()
+        if backlog is None: # 没有监听器：暂停，等下一个监听器
+            return None
+        while self._subscriptions < self._capture.subscriptions: # 每个新监听器对齐到录制中的下一段
+            self._subscriptions += 1
+            self._next_segment()
+        if backlog >= n:
+            return None
+        limit = self.samples.size if self._segment_stop is None else self._segment_stop
+        if self.position >= limit:
+            if self._held_since is None:
+                self._held_since = time.monotonic()
+            if time.monotonic() - self._held_since < self.hold_seconds:
+                return None
+            self._segment_stop = None
+            self._realtime = True
+            limit = self.samples.size
+        return limit
+
+    def _next_segment(self):
+        self._held_since = None
+        self._realtime = False
+        self._segment += 1
+        if not self.segments:
+            return
+        if self._segment >= len(self.segments):
+            self._segment_stop = None
+            return
+        start, stop = self.segments[self._segment]
+        self.position = max(self.position, min(start, self.samples.size))
+        self._segment_stop = stop
+
+    def stop_stream(self):
+        self._running.clear()
+
+    def close(self):
+        self._running.clear()
+
+
+class MicrophoneCapture:
+    """
+    单一的回调模式采集线程。
+
+    total_samples 是自启动以来写入的采样点总数，游标的 position 也用这个计数，
+    落后超过缓冲区容量时游标会被拉到最旧的可用数据并记入 dropped_samples。
+    """
+    def __init__(self, rate=MIC_SAMPLE_RATE, frames_per_buffer=1600, buffer_seconds=30):
+        self.rate = rate
+        self.frames_per_buffer = frames_per_buffer
+        self.capacity = int(rate * buffer_seconds)
+        self._ring = np.zeros(self.capacity, dtype=np.int16)
+        self.total_samples = 0
+        self._cond = threading.Condition()
+        self._cursors = set()
+        self.subscriptions = 0 # 累计创建过的游标数（回放源据此识别新的监听器）
+        self._pa = None
+        self._stream = None
+        self.overruns = 0 # 设备报告的输入溢出次数
+        self.tap = None # 每块写入的 PCM 再交给它一份（会话录制用），在采集线程里调用，不能阻塞
+
+    @property
+    def running(self):
+        return self._stream is not None
+
+    def start(self):
+        if self._stream is not None:
+            return
+        if MIC_SOURCE == "null":
+            self._stream = NullMicrophoneSource(self, control_port=MIC_NULL_CONTROL_PORT)
+            self._stream.start_stream()
+            print(f"麦克风采集已启动 (null 输入，{self.rate} Hz)")
+            return
+        if MIC_SOURCE.startswith("wav:"):
+            self._stream = WavMicrophoneSource(self, MIC_SOURCE[4:])
+            self._stream.start_stream()
+            speed = f"{MIC_REPLAY_SPEED:g} 倍速" if MIC_REPLAY_SPEED > 0 else "尽快"
+            print(f"麦克风采集已启动 (回放 {MIC_SOURCE[4:]}，{self._stream.samples.size / self.rate:.1f} 秒，{speed})")
+            return
+        import pyaudio
+        self._pa = pyaudio.PyAudio()
+        self._stream = self._pa.open(
+            format=pyaudio.paInt16, channels=1, rate=self.rate, input=True,
+            frames_per_buffer=self.frames_per_buffer, stream_callback=self._callback
+        )
+        self._stream.start_stream()
+        print(f"麦克风采集已启动 ({self.rate} Hz)")
+
+    def _callback(self, in_data, frame_count, time_info, status):
+        import pyaudio
+        if status & pyaudio.paInputOverflow:
+            self.overruns += 1
+        self.write(in_data)
+        return (None, pyaudio.paContinue)
+
+    def write(self, data):
+        """写入一块 16bit PCM（采集回调调用）"""
+        samples = np.frombuffer(data, dtype=np.int16)
+        total = samples.size
+        if samples.size > self.capacity:
+            samples = samples[-self.capacity:]
+        with self._cond:
+            start = (self.total_samples + total - samples.size) % self.capacity
+            first = min(samples.size, self.capacity - start)
+            self._ring[start:start + first] = samples[:first]
+            self._ring[:samples.size - first] = samples[first:]
+            self.total_samples += total
+            self._cond.notify_all()
+        tap = self.tap
+        if tap is not None:
+            tap(data)
+
+    def subscribe(self, preroll_ms=0):
+        """创建一个游标，从 preroll_ms 毫秒之前的位置开始读"""
+        preroll = min(int(self.rate * preroll_ms / 1000), self.capacity, self.total_samples)
+        with self._cond:
+            cursor = CaptureCursor(self, self.total_samples - preroll)
+            self._cursors.add(cursor)
+            self.subscriptions += 1
+        return cursor
+
+    def backlog(self):
+        """最慢的监听器还有多少个采样点没读，没有监听器时返回 None"""
+        with self._cond:
+            if not self._cursors:
+                return None
+            return max(self.total_samples - c.position for c in self._cursors)
+
+    def _unsubscribe(self, cursor):
+        with self._cond:
+            self._cursors.discard(cursor)
+
+    def _read(self, cursor, nsamples, timeout):
+        deadline = time.time() + timeout
+        with self._cond:
+            while self.total_samples - cursor.position < nsamples:
+                if self._stream is None:
+                    return b"" # 采集已停止，不会再有数据
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    cursor.underruns += 1
+                    return None
+                self._cond.wait(remaining)
+            oldest = self.total_samples - self.capacity
+            if cursor.position < oldest:
+                cursor.dropped_samples += oldest - cursor.position
+                cursor.position = oldest
+            start = cursor.position % self.capacity
+            first = min(nsamples, self.capacity - start)
+            out = np.empty(nsamples, dtype=np.int16)
+            out[:first] = self._ring[start:start + first]
+            out[first:] = self._ring[:nsamples - first]
+            cursor.position += nsamples
+        return out.tobytes()
+
+    def stop(self):
+        if self._stream is not None:
+            try:
+                self._stream.stop_stream()
+                self._stream.close()
+            except Exception:
+                pass
+            self._stream = None
+        if self._pa is not None:
+            try:
+                self._pa.terminate()
+            except Exception:
+                pass
+            self._pa = None
+        with self._cond:
+            self._cond.notify_all()
+
+    def stats(self):
+        return {
+            "overruns": self.overruns,
+            "seconds_captured": round(self.total_samples / self.rate, 1),
+            "listeners": len(self._cursors),
+        }
+
+
+_capture = None
+_capture_lock = threading.Lock()
+
+def get_capture():
+    """进程内共享的麦克风采集单例（首次调用时打开设备）"""
+    global _capture
+    with _capture_lock:
+        if _capture is None:
+            _capture = MicrophoneCapture()
+        _capture.start()
+        return _capture
@@ -0,0 +1,289 @@
+# audio_output.py
+# 常驻音频输出引擎：整个进程只打开一次输出设备，固定一个设备采样率，
+# TTS 和音乐等各路 PCM 先重采样到设备采样率，再在回调里混音输出。
+import os
+import threading
+import time
+import wave
+
+import numpy as np
+
+# 所有播放端（TTS、音乐播放器的 mixer）统一使用的设备采样率，避免 ALSA 反复切换采样率
+AUDIO_DEVICE_RATE = int(os.environ.get("AUDIO_DEVICE_RATE", "44100"))
+# 输出设备："pyaudio" 为真实声卡；"null" 不打开声卡，按实时速率消费并丢弃混音结果（基准测试、无声卡调试用）；
+# "wav:路径" 同样不开声卡，把混音结果写进 WAV 文件
+AUDIO_SINK = os.environ.get("AUDIO_SINK", "pyaudio")
+
+
+class _LinearResampler:
+    """有状态的线性插值重采样器，跨块保持相位，整块向量化计算"""
+    def __init__(self, src_rate, dst_rate):
+        self.src_rate = src_rate
+        self.dst_rate = dst_rate
+        self.step = src_rate / dst_rate
+        self._phase = 0.0 # 下一个输出点相对于本块起点(含上一块末样本)的位置
+        self._last = None # 上一块的最后一个样本，用于块间插值
+
+    def process(self, x):
+        if self.src_rate == self.dst_rate or x.size == 0:
+            return x
+        if self._last is not None:
+            x = np.concatenate((np.array([self._last], dtype=np.float32), x))
+        n = x.size
+        count = int(np.floor((n - 1 - self._phase) / self.step)) + 1 if n - 1 >= self._phase else 0
+        if count <= 0:
+            self._phase -= n - 1
+            self._last = x[-1]
+            return np.zeros(0, dtype=np.float32)
+        positions = self._phase + np.arange(count) * self.step
+        out = np.interp(positions, np.arange(n), x).astype(np.float32)
+        self._phase = positions[-1] + self.step - (n - 1)
+        self._last = x[-1]
+        return out
+
+
+class _RingBuffer:
+    """预分配的 float32 环形缓冲区"""
+    def __init__(self, capacity):
+        self.data = np.zeros(capacity, dtype=np.float32)
+        self.capacity = capacity
+        self.read_pos = 0
+        self.count = 0
+
+    def free(self):
+        return self.capacity - self.count
+
+    def write(self, x):
+        n = min(x.size, self.free())
+        start = (self.read_pos + self.count) % self.capacity
+        first = min(n, self.capacity - start)
+        self.data[start:start + first] = x[:first]
+        self.data[:n - first] = x[first:n]
+        self.count += n
+        return n
+
+    def read_into(self, out):
+        n = min(out.size, self.count)
+        first = min(n, self.capacity - self.read_pos)
+        out[:first] = self.data[self.read_pos:self.read_pos + first]
+        out[first:n] = self.data[:n - first]
+        self.read_pos = (self.read_pos + n) % self.capacity
+        self.count -= n
+        return n
+
+    def clear(self):
+        self.read_pos = 0
+        self.count = 0
+
+
+class NullAudioSink:
+    """
+    不接声卡的输出设备替身：后台线程每个回调周期调用一次引擎的混音，结果直接丢弃，
+    缓冲区的消耗速度、drain 的等待时间和真实设备一致。接口与 PyAudio 流的 start_stream/stop_stream/close 一致。
+    """
+    def __init__(self, engine):
+        self._engine = engine
+        self._running = threading.Event()
+
+    def start_stream(self):
+        self._running.set()
+        threading.Thread(target=self._clock_loop, name="audio-null", daemon=True).start()
+
+    def _clock_loop(self):
+        n = self._engine.frames_per_buffer
+        period = n / self._engine.rate
+        next_tick = time.monotonic()
+        while self._running.is_set():
+            self._write(self._engine._render(n))
+            next_tick += period
+            time.sleep(max(0.0, next_tick - time.monotonic()))
+
+    def _write(self, pcm):
+        pass
+
+    def stop_stream(self):
+        self._running.clear()
+
+    def close(self):
+        self._running.clear()
+
+
+class WavAudioSink(NullAudioSink):
+    """按实时速率消费混音结果并写入 WAV 文件，close() 时补全文件头"""
+    def __init__(self, engine, path):
+        super().__init__(engine)
+        self.path = path
+        self._writer = wave.open(path, "wb")
+        self._writer.setnchannels(1)
+        self._writer.setsampwidth(2)
+        self._writer.setframerate(engine.rate)
+        self._lock = threading.Lock()
+
+    def _write(self, pcm):
+        with self._lock:
+            if self._writer is not None:
+                self._writer.writeframes(pcm)
+
+    def close(self):
+        super().close()
+        with self._lock:
+            if self._writer is not None:
+                self._writer.close()
+                self._writer = None
+
+
+class AudioOutputEngine:
+    """
+    长驻输出引擎。
+
+    enqueue(pcm, sample_rate, channel) 把 16bit 单声道 PCM 放入某一路缓冲（缓冲满时阻塞，
+    起到背压作用）；flush(channel) 丢弃尚未播放的数据；drain(channel) 等待该路播放完毕。
+    "music" 通道在 "tts" 通道有声音时按 duck_gain 自动压低音量。
+    """
+    CHANNELS = ("tts", "music")
+
+    def __init__(self, rate=AUDIO_DEVICE_RATE, frames_per_buffer=1024, buffer_seconds=10, duck_gain=0.3):
+        self.rate = rate
+        self.frames_per_buffer = frames_per_buffer
+        self.duck_gain = duck_gain
+        self._buffers = {name: _RingBuffer(int(rate * buffer_seconds)) for name in self.CHANNELS}
+        self._resamplers = {}
+        self._gains = {name: 1.0 for name in self.CHANNELS}
+        self._cond = threading.Condition()
+        self._mix = np.zeros(frames_per_buffer, dtype=np.float32)
+        self._tmp = np.zeros(frames_per_buffer, dtype=np.float32)
+        self._pa = None
+        self._stream = None
+        self.underruns = 0 # 有数据待播但一次回调没能填满的次数
+        self.tap = None # 每次混音的结果再交给它一份（会话录制用），在输出回调里调用，不能阻塞
+
+    def start(self):
+        """打开输出设备（只在第一次调用时真正打开）"""
+        if self._stream is not None:
+            return
+        if AUDIO_SINK == "null":
+            self._stream = NullAudioSink(self)
+            self._stream.start_stream()
+            print(f"音频输出引擎已启动 (null 输出，{self.rate} Hz)")
+            return
+        if AUDIO_SINK.startswith("wav:"):
+            self._stream = WavAudioSink(self, AUDIO_SINK[4:])
+            self._stream.start_stream()
+            print(f"音频输出引擎已启动 (写入 {AUDIO_SINK[4:]}，{self.rate} Hz)")
+            return
+        import pyaudio
+        self._pa = pyaudio.PyAudio()
+        self._stream = self._pa.open(
+            format=pyaudio.paInt16, channels=1, rate=self.rate, output=True,
+            frames_per_buffer=self.frames_per_buffer, stream_callback=self._callback
+        )
+        self._stream.start_stream()
+        print(f"音频输出引擎已启动 ({self.rate} Hz)")
+
+    def _callback(self, in_data, frame_count, time_info, status):
+        import pyaudio
+        return (self._render(frame_count), pyaudio.paContinue)
+
+    def _render(self, frame_count):
+        """混合各通道的下一段音频，返回 16bit PCM"""
+        if self._mix.size < frame_count:
+            self._mix = np.zeros(frame_count, dtype=np.float32)
+            self._tmp = np.zeros(frame_count, dtype=np.float32)
+        mix = self._mix[:frame_count]
+        tmp = self._tmp[:frame_count]
+        mix.fill(0.0)
+        with self._cond:
+            tts_active = self._buffers["tts"].count > 0
+            for name, buf in self._buffers.items():
+                if buf.count == 0:
+                    continue
+                tmp.fill(0.0)
+                n = buf.read_into(tmp)
+                if n < frame_count and name == "tts":
+                    self.underruns += 1
+                gain = self._gains[name]
+                if name == "music" and tts_active:
+                    gain *= self.duck_gain
+                mix += tmp * gain
+            self._cond.notify_all()
+        np.clip(mix, -1.0, 1.0, out=mix)
+        pcm = (mix * 32767.0).astype(np.int16).tobytes()
+        tap = self.tap
+        if tap is not None:
+            tap(pcm)
+        return pcm
+
+    def enqueue(self, pcm, sample_rate, channel="tts"):
+        """放入 16bit 单声道 PCM，按需重采样到设备采样率"""
+        if not pcm:
+            return
+        self.start()
+        x = np.frombuffer(pcm, dtype=np.int16).astype(np.float32) / 32768.0
+        key = (channel, sample_rate)
+        resampler = self._resamplers.get(key)
+        if resampler is None:
+            resampler = self._resamplers[key] = _LinearResampler(sample_rate, self.rate)
+        x = resampler.process(x)
+        buf = self._buffers[channel]
+        with self._cond:
+            while x.size:
+                n = buf.write(x)
+                x = x[n:]
+                if x.size:
+                    self._cond.wait(0.5)
+
+    def flush(self, channel=None):
+        """丢弃尚未播放的数据（channel 为 None 时清空所有通道）"""
+        names = self.CHANNELS if channel is None else (channel,)
+        with self._cond:
+            for name in names:
+                self._buffers[name].clear()
+            for key in [k for k in self._resamplers if k[0] in names]:
+                del self._resamplers[key]
+            self._cond.notify_all()
+
+    def drain(self, channel="tts", timeout=None):
+        """等待某一通道的数据全部播放完毕，超时返回 False"""
+        if self._stream is None:
+            return True
+        deadline = None if timeout is None else time.time() + timeout
+        with self._cond:
+            while self._buffers[channel].count > 0:
+                remaining = None if deadline is None else deadline - time.time()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._cond.wait(remaining if remaining is not None else 0.5)
+        # 设备自身还缓存着最后一个回调周期的数据
+        time.sleep(self.frames_per_buffer / self.rate)
+        return True
+
+    def set_gain(self, channel, gain):
+        with self._cond:
+            self._gains[channel] = gain
+
+    def close(self):
+        if self._stream is not None:
+            try:
+                self._stream.stop_stream()
+                self._stream.close()
+            except Exception:
+                pass
+            self._stream = None
+        if self._pa is not None:
+            try:
+                self._pa.terminate()
+            except Exception:
+                pass
+            self._pa = None
+
+
+_engine = None
+_engine_lock = threading.Lock()
+
+def get_output_engine():
+    """进程内共享的输出引擎单例"""
+    global _engine
+    with _engine_lock:
+        if _engine is None:
+            _engine = AudioOutputEngine()
+        return _engine
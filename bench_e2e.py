@@ -0,0 +1,282 @@
+# bench_e2e.py
+# 离线端到端延迟基准：启动真实的 voice-qwen3-mcp.py（start_recognition 主循环、DashScope SDK、qwen_agent、
+# 音乐 MCP 服务都是真的），把云端服务和音频设备换成本地替身：
+#   - fake_services.py 提供 websocket ASR（按脚本回放识别结果）、TTS（按固定速率发 PCM）和 OpenAI 兼容的 LLM
+#   - MIC_SOURCE=null / AUDIO_SINK=null：不开声卡，麦克风由 ASR 替身通过 UDP 控制何时"说话"
+# 每个场景一个进程，跑 --warmup + --turns 轮"唤醒 → 指令 → 回复"，从进程写出的 turn_metrics JSONL 里取各轮打点：
+#   wake_to_first_audio — 唤醒到听到回复的第一个字（含"请讲"和说指令的时间，这两段由脚本固定）
+#   response            — 用户说完到听到第一个字，即体感延迟
+#   llm_first_token     — LLM 首字（只有走 LLM 的场景有）
+# 同时按 /proc 采样语音进程（不含 MCP 子进程）的 CPU 占用和 RSS。
+# 计时之前先检查送去合成的文本：工具调用标记被朗读、或脚本里的回复没有完整念出来时，场景算失败，
+# 否则"首个音频"可能是错误内容的音频，测出来的延迟没有意义。
+# 给了 --baseline 时与基线比较，任何指标超过 基线 * (1 + --tolerance) + 余量 即视为退化，退出码为 1；
+# --save-baseline 把本次结果写成新的基线。
+#
+# 基线与机器相关（树莓派和开发机差很多），先在目标设备上用 --save-baseline 生成，之后每次改动用 --baseline 比较。
+#
+# 用法: python bench_e2e.py [--scenarios chat,intent,tool] [--turns 5] [--baseline bench_e2e_baseline.json]
+import argparse
+import json
+import os
+import shutil
+import signal
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from fake_services import FakeServices
+
+SCRIPT = "voice-qwen3-mcp.py"
+SCENARIOS = {
+    # 闲聊：LLM 流式回复多句，流式 TTS 逐句合成
+    "chat": {"command_text": "给我讲一个简短的笑话",
+             "reply": "好的，给你讲一个。小明上课睡觉，老师问他为什么，他说梦里在复习功课。"},
+    # 本地意图快速通道：整句匹配"问时间"，不走 LLM
+    "intent": {"command_text": "现在几点了"},
+    # 工具调用：LLM 先调用音乐服务的 getPlaybackStatus，拿到结果后再回复
+    "tool": {"command_text": "现在在放什么歌", "tool": "music_player-getPlaybackStatus",
+             "reply": "现在没有在播放音乐，要我给你放一首吗？"},
+}
+RESPONSE_OUTCOMES = ("llm",) # 以及 intent_* 结局；no_command、asr_error 没有回复，不计
+LATENCY_METRICS = ("wake_to_first_audio_ms", "response_ms", "llm_first_token_ms")
+# 每项指标判定退化时在相对容差之外再允许的绝对余量
+SLACK = {"wake_to_first_audio_ms": 150, "response_ms": 150, "llm_first_token_ms": 100,
+         "cpu_percent": 5, "rss_peak_mb": 20}
+
+
+def free_port(kind=socket.SOCK_DGRAM):
+    with socket.socket(socket.AF_INET, kind) as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def proc_sample(pid):
+    """返回 (CPU 秒数, RSS MB, 峰值 RSS MB)，进程已退出时返回 None"""
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+        cpu = (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK") # utime + stime
+        rss = hwm = 0.0
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    rss = int(line.split()[1]) / 1024
+                elif line.startswith("VmHWM:"):
+                    hwm = int(line.split()[1]) / 1024
+        return cpu, rss, hwm
+    except (OSError, IndexError, ValueError):
+        return None
+
+
+def read_turns(path):
+    turns = []
+    try:
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                if record["outcome"] in RESPONSE_OUTCOMES or record["outcome"].startswith("intent_"):
+                    turns.append(record)
+    except OSError:
+        pass
+    return turns
+
+
+def turn_latencies(record):
+    stamps, stages = record["stamps_ms"], record["stages_ms"]
+    out = {}
+    if "wake" in stamps and "tts_first_audio" in stamps:
+        out["wake_to_first_audio_ms"] = stamps["tts_first_audio"] - stamps["wake"]
+    if "response" in stages:
+        out["response_ms"] = stages["response"]
+    if "llm_first_token" in stages:
+        out["llm_first_token_ms"] = stages["llm_first_token"]
+    return out
+
+
+def check_spoken_texts(spec, texts):
+    """检查送去合成的文本，有问题时返回描述"""
+    leaked = [t for t in texts if "tool_call" in t]
+    if leaked:
+        return f"工具调用标记被送去合成: {leaked[0]!r}"
+    if "reply" in spec and spec["reply"] not in "".join(texts):
+        return f"脚本里的回复没有完整送去合成: {spec['reply']!r}"
+    return None
+
+
+def run_scenario(name, spec, turns, warmup, timeout, keep_logs):
+    workdir = tempfile.mkdtemp(prefix=f"bench_e2e_{name}_")
+    mic_port, state_port = free_port(), free_port()
+    services = FakeServices(mic_control_port=mic_port, **spec)
+    services.start()
+    metrics_file = os.path.join(workdir, "turn_metrics.jsonl")
+    mcp_config = os.path.join(workdir, "mcp_server_config.json")
+    repo = os.path.dirname(os.path.abspath(__file__))
+    with open(mcp_config, "w", encoding="utf-8") as f:
+        json.dump({"mcpServers": {"music_player": {
+            "command": sys.executable, "args": [os.path.join(repo, "mcp_server_onlinemusic_player.py")],
+            "env": {"PLAYER_STATE_PORT": str(state_port), "SDL_AUDIODRIVER": "dummy"}}}}, f)
+    env = dict(os.environ,
+               PYTHONUNBUFFERED="1",
+               DASHSCOPE_WEBSOCKET_BASE_URL=services.ws_url,
+               DASHSCOPE_SPEECH_API_KEY="sk-bench", key="bench", model="bench-model",
+               LLM_MODEL_SERVER=services.llm_url,
+               MIC_SOURCE="null", MIC_NULL_CONTROL_PORT=str(mic_port), AUDIO_SINK="null",
+               WakeupWords=services.wake_text, WakeupModelFile="",
+               MCP_SERVER_CONFIG=mcp_config, MCP_TOOLS_CACHE=os.path.join(workdir, "mcp_tools_cache.json"),
+               TTS_CACHE_DIR=os.path.join(workdir, "tts_cache"), TURN_METRICS_FILE=metrics_file,
+               METRICS_PORT="0", PLAYER_STATE_PORT=str(state_port),
+               COMMAND_NO_SPEECH_TIMEOUT="1.5") # 每轮回复后静音退下，下一轮重新唤醒
+    log_path = os.path.join(workdir, "voice.log")
+    log = open(log_path, "w", encoding="utf-8")
+    proc = subprocess.Popen([sys.executable, "-u", SCRIPT], cwd=repo, env=env, stdout=log, stderr=subprocess.STDOUT,
+                            stdin=subprocess.DEVNULL, start_new_session=True)
+    samples = [] # (时间, CPU 秒, RSS MB, 峰值 RSS MB)
+    deadline = time.time() + timeout
+    records = []
+    try:
+        while time.time() < deadline and proc.poll() is None:
+            sample = proc_sample(proc.pid)
+            if sample:
+                samples.append((time.time(), *sample))
+            records = read_turns(metrics_file)
+            if len(records) >= warmup + turns:
+                break
+            time.sleep(0.2)
+    finally:
+        if proc.poll() is None:
+            proc.send_signal(signal.SIGINT) # 走正常退出流程，打印各项统计
+            try:
+                proc.wait(10)
+            except subprocess.TimeoutExpired:
+                pass
+        try:
+            os.killpg(proc.pid, signal.SIGKILL) # 连同 MCP 子进程
+        except OSError:
+            pass
+        proc.wait()
+        log.close()
+        services.stop()
+
+    measured = records[warmup:warmup + turns]
+    result = {"turns": len(measured), "workdir": workdir, "log": log_path, "service_counts": dict(services.counts)}
+    if len(measured) < turns:
+        result["error"] = f"只完成了 {len(records)} 轮（需要 {warmup + turns}），见 {log_path}"
+        return result
+    problem = check_spoken_texts(spec, services.tts_texts)
+    if problem:
+        result["error"] = f"{problem}，见 {log_path}"
+        return result
+    for key in LATENCY_METRICS:
+        values = [v[key] for v in map(turn_latencies, measured) if key in v]
+        if values:
+            result[key] = {"p50": statistics.median(values), "max": max(values)}
+    # CPU 和 RSS 只算正式计时的这几轮（从第一轮唤醒开始到最后一轮结束）
+    window_start = measured[0]["ts"]
+    window_end = measured[-1]["ts"] + max(measured[-1]["stamps_ms"].values(), default=0) / 1000
+    window = [s for s in samples if window_start <= s[0] <= window_end + 0.2]
+    if len(window) >= 2:
+        (t0, cpu0, _, _), (t1, cpu1, _, _) = window[0], window[-1]
+        result["cpu_percent"] = round((cpu1 - cpu0) / (t1 - t0) * 100, 1) if t1 > t0 else None
+        result["rss_mb"] = round(statistics.mean(s[2] for s in window), 1)
+    if samples:
+        result["rss_peak_mb"] = round(max(s[3] for s in samples), 1)
+    if not keep_logs:
+        shutil.rmtree(workdir, ignore_errors=True)
+        result.pop("workdir")
+        result.pop("log")
+    return result
+
+
+def flat_metrics(result):
+    """{指标: 数值}，延迟取中位数"""
+    out = {}
+    for key in LATENCY_METRICS:
+        if key in result:
+            out[key] = result[key]["p50"]
+    for key in ("cpu_percent", "rss_peak_mb"):
+        if result.get(key) is not None:
+            out[key] = result[key]
+    return out
+
+
+def compare(name, current, baseline, tolerance):
+    """返回退化的指标说明列表"""
+    regressions = []
+    for key, base in baseline.items():
+        value = current.get(key)
+        if value is None:
+            continue
+        limit = base * (1 + tolerance) + SLACK.get(key, 0)
+        if value > limit:
+            regressions.append(f"{name}.{key}: {value:.0f}，基线 {base:.0f}，上限 {limit:.0f}")
+    return regressions
+
+
+def print_result(name, result):
+    print(f"\n== {name}（{result['turns']} 轮）==")
+    if "error" in result:
+        print(f"  失败: {result['error']}")
+        return
+    labels = {"wake_to_first_audio_ms": "唤醒到首个音频", "response_ms": "说完到首个音频", "llm_first_token_ms": "LLM 首字"}
+    for key, label in labels.items():
+        if key in result:
+            print(f"  {label}: 中位数 {result[key]['p50']:6.0f} ms   最大 {result[key]['max']:6.0f} ms")
+    print(f"  CPU: {result.get('cpu_percent')}%   RSS: 平均 {result.get('rss_mb')} MB，峰值 {result.get('rss_peak_mb')} MB")
+    print(f"  替身服务调用: {result['service_counts']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="本地替身服务下的端到端延迟、CPU 和内存基准")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help="逗号分隔，可选: " + ", ".join(SCENARIOS))
+    parser.add_argument("--turns", type=int, default=5, help="每个场景正式计时的轮数")
+    parser.add_argument("--warmup", type=int, default=1, help="先跑几轮不计时（等助手初始化、TTS 缓存预热）")
+    parser.add_argument("--timeout", type=float, default=180, help="每个场景最长运行秒数")
+    parser.add_argument("--baseline", help="基线 JSON 文件，给出时比较并在退化时以退出码 1 结束")
+    parser.add_argument("--save-baseline", metavar="PATH", help="把本次结果写成基线")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="相对基线允许的变慢比例")
+    parser.add_argument("--keep-logs", action="store_true", help="保留每个场景的临时目录（语音进程日志、JSONL）")
+    args = parser.parse_args()
+
+    names = [n.strip() for n in args.scenarios.split(",") if n.strip()]
+    unknown = [n for n in names if n not in SCENARIOS]
+    if unknown:
+        parser.error(f"未知场景: {', '.join(unknown)}")
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+
+    results, failed, regressions = {}, [], []
+    for name in names:
+        result = run_scenario(name, SCENARIOS[name], args.turns, args.warmup, args.timeout, args.keep_logs)
+        print_result(name, result)
+        if "error" in result:
+            failed.append(name)
+            continue
+        results[name] = flat_metrics(result)
+        if baseline and name in baseline:
+            regressions += compare(name, results[name], baseline[name], args.tolerance)
+
+    if args.save_baseline and results:
+        with open(args.save_baseline, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        print(f"\n基线已写入 {args.save_baseline}")
+    if regressions:
+        print("\n性能退化:")
+        for line in regressions:
+            print(f"  {line}")
+    if failed or regressions:
+        sys.exit(1)
+    if baseline:
+        print("\n与基线相比没有退化")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+# bench_gapless.py
+# 切歌间隙基准：用 SDL 的 disk 音频驱动把 pygame mixer 的实际输出写成原始 PCM 文件，
+# 再统计两首歌之间连续静音的时长。对比两种切歌方式：
+#   queue  — 播放队列的做法：当前歌播放时就 pygame.mixer.music.queue(下一首)，由 SDL 直接接上
+#   reload — 以前的做法：轮询到 get_busy() 变为 False 后再 load + play 下一首（不含下载时间）
+# reload 的间隙取决于歌曲结束时落在轮询周期的哪个位置：歌曲时长和轮询间隔固定时每次都落在同一相位，
+# 可能恰好在结束后立刻轮询到，测不出轮询带来的间隙。所以每次运行把轮询的起点错开一段，
+# 第 i 次错开 (i + 0.5) / runs 个轮询间隔，多次运行的平均值就是均匀分布的相位下的期望间隙。
+#
+# 用法: python bench_gapless.py [--poll-ms 200] [--files a.mp3 b.mp3]
+#   不给 --files 时生成两段 2 秒的正弦波 WAV；真实歌曲首尾本身可能带静音，测出来的是总间隙。
+import argparse
+import os
+import tempfile
+import time
+import wave
+
+import numpy as np
+
+SAMPLE_RATE = 44100
+CHANNELS = 2
+
+
+def make_tone(path, freq, seconds=2.0):
+    t = np.arange(int(SAMPLE_RATE * seconds)) / SAMPLE_RATE
+    tone = (np.sin(2 * np.pi * freq * t) * 12000).astype(np.int16)
+    with wave.open(path, "wb") as wf:
+        wf.setnchannels(1)
+        wf.setsampwidth(2)
+        wf.setframerate(SAMPLE_RATE)
+        wf.writeframes(tone.tobytes())
+
+
+def record(mode, first, second, poll_ms, phase_ms=0.0):
+    """在单独的子进程里跑，保证每次都有干净的 disk 驱动输出文件"""
+    out = tempfile.NamedTemporaryFile(suffix=".raw", delete=False).name
+    os.environ["SDL_AUDIODRIVER"] = "disk"
+    os.environ["SDL_DISKAUDIOFILE"] = out
+    os.environ["PYGAME_HIDE_SUPPORT_PROMPT"] = "1"
+    pid = os.fork()
+    if pid == 0:
+        try:
+            import pygame
+            pygame.mixer.init(frequency=SAMPLE_RATE, size=-16, channels=CHANNELS, buffer=1024)
+            music = pygame.mixer.music
+            music.load(first)
+            music.play()
+            if mode == "queue":
+                music.queue(second)
+            else:
+                time.sleep(phase_ms / 1000)
+                while music.get_busy():
+                    time.sleep(poll_ms / 1000)
+                music.load(second)
+                music.play()
+            while music.get_busy():
+                time.sleep(0.05)
+            time.sleep(0.2)
+            pygame.mixer.quit()
+        finally:
+            os._exit(0)
+    os.waitpid(pid, 0)
+    with open(out, "rb") as f:
+        data = np.frombuffer(f.read(), dtype=np.int16)
+    os.remove(out)
+    return data.reshape(-1, CHANNELS)
+
+
+def longest_gap_ms(samples, threshold=200):
+    """第一个和最后一个有声样本之间，最长的一段连续静音（毫秒）"""
+    loud = np.abs(samples.astype(np.int32)).max(axis=1) >= threshold
+    idx = np.flatnonzero(loud)
+    if idx.size < 2:
+        return None
+    steps = np.diff(idx) # 相邻有声样本的间距
+    return float((steps.max() - 1) / SAMPLE_RATE * 1000)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="pygame 切歌间隙测量")
+    parser.add_argument("--poll-ms", type=float, default=200, help="reload 方式轮询 get_busy 的间隔")
+    parser.add_argument("--files", nargs=2, metavar=("FIRST", "SECOND"), help="用真实音频文件代替生成的正弦波")
+    parser.add_argument("--runs", type=int, default=8, help="每种方式运行几次，reload 的轮询相位在各次之间均匀错开")
+    args = parser.parse_args()
+
+    tmpdir = None
+    if args.files:
+        first, second = args.files
+    else:
+        tmpdir = tempfile.mkdtemp()
+        first, second = os.path.join(tmpdir, "a.wav"), os.path.join(tmpdir, "b.wav")
+        make_tone(first, 440)
+        make_tone(second, 660)
+
+    for mode in ("queue", "reload"):
+        gaps = []
+        for i in range(args.runs):
+            phase_ms = (i + 0.5) / args.runs * args.poll_ms
+            gap = longest_gap_ms(record(mode, first, second, args.poll_ms, phase_ms))
+            if gap is not None:
+                gaps.append(gap)
+        if gaps:
+            print(f"{mode:<8} 切歌静音: 平均 {sum(gaps) / len(gaps):7.1f} ms   最小 {min(gaps):7.1f} ms   "
+                  f"最大 {max(gaps):7.1f} ms  ({len(gaps)} 次)")
+        else:
+            print(f"{mode:<8} 没有录到声音，检查 SDL disk 音频驱动是否可用")
+
+    if tmpdir:
+        for name in os.listdir(tmpdir):
+            os.remove(os.path.join(tmpdir, name))
+        os.rmdir(tmpdir)
+
+
+if __name__ == "__main__":
+    main()
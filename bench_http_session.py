@@ -0,0 +1,86 @@
+# bench_http_session.py
+# HTTP 连接复用基准：对本地 HTTP 桩（或 --url 指定的地址）分别用"每次新建连接"的 requests.get
+# 和 http_session.make_session() 的连接池各发 N 次请求，比较延迟。
+#
+# 用法: python bench_http_session.py [-n 200] [--size 2048] [--latency-ms 0] [--url URL]
+#   --latency-ms 让桩服务器在每个新连接建立时额外等待，模拟公网上的握手往返；
+#   连接池只在第一次付出这部分开销。
+import argparse
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+from http_session import make_session
+
+
+def make_handler(body, connect_delay):
+    class StubHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1" # 支持 keep-alive
+        disable_nagle_algorithm = True # 头和体分两次写，不关 Nagle 时 keep-alive 连接上会叠加 40ms 延迟确认
+
+        def setup(self):
+            super().setup()
+            if connect_delay > 0:
+                time.sleep(connect_delay)
+
+        def do_GET(self):
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+    return StubHandler
+
+
+def percentile(values, p):
+    values = sorted(values)
+    k = min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))
+    return values[k]
+
+
+def run(label, get, url, n):
+    get(url) # 预热（DNS 等）
+    times = []
+    for _ in range(n):
+        start = time.perf_counter()
+        r = get(url)
+        r.raise_for_status()
+        r.content
+        times.append((time.perf_counter() - start) * 1000)
+    print(f"{label:<10} 平均 {sum(times) / n:7.2f} ms   p50 {percentile(times, 50):7.2f} ms   "
+          f"p95 {percentile(times, 95):7.2f} ms")
+    return sum(times) / n
+
+
+def main():
+    parser = argparse.ArgumentParser(description="requests 冷连接 vs 连接池 延迟对比")
+    parser.add_argument("-n", type=int, default=200, help="每种方式的请求次数")
+    parser.add_argument("--size", type=int, default=2048, help="桩服务器响应体大小(字节)")
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="桩服务器每个新连接的额外延迟")
+    parser.add_argument("--url", help="不启动桩服务器，直接测这个地址")
+    args = parser.parse_args()
+
+    server = None
+    url = args.url
+    if not url:
+        handler = make_handler(b"x" * args.size, args.latency_ms / 1000)
+        server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        url = f"http://127.0.0.1:{server.server_address[1]}/api/search/get/web"
+    print(f"目标: {url}，每种方式 {args.n} 次")
+
+    cold = run("冷连接", lambda u: requests.get(u, timeout=10), url, args.n)
+    session = make_session()
+    pooled = run("连接池", lambda u: session.get(u, timeout=10), url, args.n)
+    print(f"\n连接池平均每次节省 {cold - pooled:.2f} ms ({(1 - pooled / cold) * 100:.1f}%)")
+
+    if server:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
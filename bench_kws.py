@@ -0,0 +1,109 @@
+# bench_kws.py
+# 本地唤醒词检测基准：对一个目录下录好的 WAV 片段逐个跑 LocalKeywordSpotter，
+# 统计检出率、检测延迟和 CPU 占用。
+#
+# 用法: python bench_kws.py <wav目录> [--model wakeword.table] [--fast]
+#   WAV 需为 16kHz 16bit 单声道；文件名以 neg 开头的片段视为不含唤醒词（统计误唤醒）。
+#   默认按 1 倍实时速度推送音频（延迟数字才有意义），--fast 则尽快推送只看 CPU 开销。
+import argparse
+import os
+import sys
+import time
+import wave
+
+from dotenv import load_dotenv
+from keyword_spotter import LocalKeywordSpotter, KWS_SAMPLE_RATE
+
+
+class WavCursor:
+    """把 WAV 文件伪装成采集游标，供 wait_for_keyword 读取"""
+    def __init__(self, path, realtime=True):
+        with wave.open(path, "rb") as wf:
+            if wf.getframerate() != KWS_SAMPLE_RATE or wf.getnchannels() != 1 or wf.getsampwidth() != 2:
+                raise ValueError("需要 16kHz 16bit 单声道 WAV")
+            self.data = wf.readframes(wf.getnframes())
+        self.pos = 0
+        self.realtime = realtime
+        self.start = None
+
+    @property
+    def duration(self):
+        return len(self.data) / 2 / KWS_SAMPLE_RATE
+
+    def read(self, nbytes, timeout=1.0):
+        if self.start is None:
+            self.start = time.time()
+        if self.pos >= len(self.data):
+            return b""
+        if self.realtime: # 按实时速度放音，还没"录到"的数据要等
+            due = self.start + (self.pos + nbytes) / 2 / KWS_SAMPLE_RATE
+            delay = due - time.time()
+            if delay > 0:
+                time.sleep(delay)
+        chunk = self.data[self.pos:self.pos + nbytes]
+        self.pos += nbytes
+        return chunk
+
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    k = min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))
+    return values[k]
+
+
+def main():
+    load_dotenv(dotenv_path='qwen3-235b-a22b.env')
+    parser = argparse.ArgumentParser(description="本地唤醒词检测延迟/CPU 基准")
+    parser.add_argument("clips", help="存放 WAV 片段的目录")
+    parser.add_argument("--model", default=os.environ.get("WakeupModelFile", "wakeword.table"))
+    parser.add_argument("--fast", action="store_true", help="不按实时速度推送")
+    args = parser.parse_args()
+
+    spotter = LocalKeywordSpotter(args.model)
+    files = sorted(f for f in os.listdir(args.clips) if f.lower().endswith(".wav"))
+    if not files:
+        print(f"{args.clips} 下没有 WAV 文件")
+        sys.exit(1)
+
+    latencies, cpu_ratios = [], []
+    positives = detected = false_alarms = negatives = 0
+    print(f"{'文件':<32}{'时长(s)':>8}{'结果':>10}{'延迟(ms)':>10}{'CPU%':>8}")
+    for name in files:
+        try:
+            cursor = WavCursor(os.path.join(args.clips, name), realtime=not args.fast)
+        except (ValueError, wave.Error) as e:
+            print(f"{name:<32} 跳过: {e}")
+            continue
+        is_negative = name.lower().startswith("neg")
+        cpu_start, wall_start = time.process_time(), time.time()
+        hit = spotter.wait_for_keyword(cursor)
+        cpu, wall = time.process_time() - cpu_start, time.time() - wall_start
+        cpu_ratio = cpu / wall * 100 if wall > 0 else 0.0
+        cpu_ratios.append(cpu_ratio)
+        if is_negative:
+            negatives += 1
+            false_alarms += hit is not None
+        else:
+            positives += 1
+            if hit is not None:
+                detected += 1
+                latencies.append(hit.latency * 1000)
+        result = "命中" if hit else "未命中"
+        latency = f"{hit.latency * 1000:.0f}" if hit else "-"
+        print(f"{name:<32}{cursor.duration:>8.1f}{result:>10}{latency:>10}{cpu_ratio:>8.1f}")
+
+    print("\n=== 汇总 ===")
+    if positives:
+        print(f"检出率: {detected}/{positives} ({detected / positives * 100:.1f}%)")
+    if negatives:
+        print(f"误唤醒: {false_alarms}/{negatives}")
+    if latencies:
+        print(f"检测延迟: p50 {percentile(latencies, 50):.0f} ms, p95 {percentile(latencies, 95):.0f} ms, 最大 {max(latencies):.0f} ms")
+    if cpu_ratios:
+        print(f"CPU 占用: 平均 {sum(cpu_ratios) / len(cpu_ratios):.1f}% (单核)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+# bench_playback_load.py
+# 对比音乐服务两种"下载完成后开始播放"的方式：
+#   tempfile — 以前的做法：写 NamedTemporaryFile，再 pygame.mixer.music.load(路径)，播完/停止后删除
+#   memory   — 现在的做法：pygame.mixer.music.load(BytesIO(数据), "mp3")，不落盘
+# 统计从拿到完整数据到 get_busy() 为真的耗时，以及期间本进程写入的字节数（/proc/self/io：
+# wchar 是传给 write() 的字节数，write_bytes 是实际提交到块设备的字节数；临时目录在 tmpfs 上时后者为 0）。
+#
+# 用法: python bench_playback_load.py [--file song.mp3] [--runs 20] [--tmpdir /var/tmp]
+#   不给 --file 时使用 pygame 自带的示例 MP3。默认用 SDL 的 dummy 音频驱动，--real-audio 使用真实声卡。
+import argparse
+import io
+import os
+import statistics
+import tempfile
+import time
+
+
+def proc_io():
+    """读取 /proc/self/io，非 Linux 返回空 dict"""
+    try:
+        with open("/proc/self/io") as f:
+            return {k: int(v) for k, v in (line.split(": ") for line in f)}
+    except OSError:
+        return {}
+
+
+def wait_busy(music, timeout=1.0):
+    deadline = time.perf_counter() + timeout
+    while not music.get_busy():
+        if time.perf_counter() > deadline:
+            return False
+        time.sleep(0.001)
+    return True
+
+
+def load_tempfile(music, data, tmpdir):
+    temp_file = tempfile.NamedTemporaryFile(suffix=".mp3", delete=False, dir=tmpdir)
+    temp_file.write(data)
+    temp_file.close()
+    music.load(temp_file.name)
+    music.play()
+    return temp_file.name
+
+
+def load_memory(music, data, tmpdir):
+    music.load(io.BytesIO(data), "mp3")
+    music.play()
+    return None
+
+
+def run(mode, music, data, runs, tmpdir):
+    loader = load_tempfile if mode == "tempfile" else load_memory
+    latencies, wchar, write_bytes = [], 0, 0
+    for _ in range(runs):
+        before = proc_io()
+        start = time.perf_counter()
+        path = loader(music, data, tmpdir)
+        if wait_busy(music):
+            latencies.append((time.perf_counter() - start) * 1000)
+        music.stop()
+        music.unload()
+        if path:
+            os.remove(path)
+        after = proc_io()
+        if before:
+            wchar += after["wchar"] - before["wchar"]
+            write_bytes += after["write_bytes"] - before["write_bytes"]
+    return latencies, wchar, write_bytes
+
+
+def main():
+    parser = argparse.ArgumentParser(description="临时文件与内存两种加载方式的开播耗时和写盘量")
+    parser.add_argument("--file", help="MP3 文件，默认使用 pygame 自带的示例")
+    parser.add_argument("--runs", type=int, default=20)
+    parser.add_argument("--tmpdir", default=None, help="临时文件目录，默认 tempfile.gettempdir()")
+    parser.add_argument("--real-audio", action="store_true", help="使用真实声卡而不是 SDL dummy 驱动")
+    args = parser.parse_args()
+
+    if not args.real_audio:
+        os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+    os.environ["PYGAME_HIDE_SUPPORT_PROMPT"] = "1"
+    import pygame
+    path = args.file or os.path.join(os.path.dirname(pygame.__file__), "examples", "data", "house_lo.mp3")
+    with open(path, "rb") as f:
+        data = f.read()
+    tmpdir = args.tmpdir or tempfile.gettempdir()
+    pygame.mixer.init()
+    music = pygame.mixer.music
+    print(f"文件 {path}（{len(data) / 1024:.0f} KB），临时目录 {tmpdir}，每种方式 {args.runs} 次")
+
+    run("memory", music, data, 2, tmpdir) # 预热解码器
+    for mode in ("tempfile", "memory"):
+        latencies, wchar, write_bytes = run(mode, music, data, args.runs, tmpdir)
+        if not latencies:
+            print(f"{mode:<9} 没有开始播放，检查音频驱动")
+            continue
+        print(f"{mode:<9} 开播耗时: 中位数 {statistics.median(latencies):6.2f} ms  最大 {max(latencies):6.2f} ms   "
+              f"每首写入: wchar {wchar / args.runs / 1024:7.1f} KB  write_bytes {write_bytes / args.runs / 1024:7.1f} KB")
+    pygame.mixer.quit()
+
+
+if __name__ == "__main__":
+    main()
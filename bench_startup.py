@@ -0,0 +1,133 @@
+# bench_startup.py
+# 冷启动基准：
+#   music — 用 MCP stdio 客户端启动 mcp_server_onlinemusic_player.py，测从启动进程到 initialize 完成、
+#           再到第一次工具调用（getPlaybackStatus）返回的时间
+#   voice — 启动 voice-qwen3-mcp.py，测到打印 "=== 开始监听唤醒词 ===" 的时间（需要 .env、麦克风等真实环境），
+#           以及后台助手初始化完成的时间
+# 两个进程都带 -X importtime 运行，按顶层模块汇总导入耗时（与 python -X importtime 的累计列一致）。
+#
+# 用法: python bench_startup.py [--runs 3] [--only music|voice] [--top 12]
+import argparse
+import asyncio
+import os
+import re
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+LISTEN_MARKER = "=== 开始监听唤醒词 ==="
+AGENT_READY_MARKER = "助手初始化完成"
+_IMPORTTIME_LINE = re.compile(r"^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|( *)(\S+)")
+
+
+def parse_importtime(stderr_text):
+    """返回 {顶层导入的模块: 累计微秒}；只统计缩进为 0 的行，即进程自己直接触发的导入"""
+    totals = {}
+    for line in stderr_text.splitlines():
+        m = _IMPORTTIME_LINE.match(line)
+        if not m or len(m.group(3)) > 1: # 格式是 "| " 后接按层级缩进的模块名
+            continue
+        name = m.group(4).split(".")[0]
+        totals[name] = totals.get(name, 0) + int(m.group(2))
+    return totals
+
+
+def bench_music(script="mcp_server_onlinemusic_player.py"):
+    from mcp import ClientSession, StdioServerParameters
+    from mcp.client.stdio import stdio_client
+
+    async def run():
+        params = StdioServerParameters(command=sys.executable, args=["-X", "importtime", script],
+                                       env=dict(os.environ, PYTHONUNBUFFERED="1"))
+        with tempfile.TemporaryFile("w+", encoding="utf-8") as errlog:
+            start = time.perf_counter()
+            async with stdio_client(params, errlog=errlog) as (read, write):
+                async with ClientSession(read, write) as session:
+                    await session.initialize()
+                    initialized = time.perf_counter()
+                    await session.call_tool("getPlaybackStatus", {})
+                    first_tool = time.perf_counter()
+            errlog.seek(0)
+            imports = parse_importtime(errlog.read())
+        return {"initialize_ms": (initialized - start) * 1000,
+                "first_tool_ms": (first_tool - start) * 1000, "imports": imports}
+
+    return asyncio.run(run())
+
+
+def bench_voice(script="voice-qwen3-mcp.py", timeout=120):
+    with tempfile.TemporaryFile("w+", encoding="utf-8") as errlog:
+        start = time.perf_counter()
+        proc = subprocess.Popen([sys.executable, "-u", "-X", "importtime", script], stdout=subprocess.PIPE,
+                                stderr=errlog, stdin=subprocess.DEVNULL, text=True, encoding="utf-8",
+                                errors="replace")
+        marks = {}
+        done = threading.Event()
+
+        def reader():
+            for line in proc.stdout:
+                if LISTEN_MARKER in line and "listen_ms" not in marks:
+                    marks["listen_ms"] = (time.perf_counter() - start) * 1000
+                if AGENT_READY_MARKER in line and "agent_ready_ms" not in marks:
+                    marks["agent_ready_ms"] = (time.perf_counter() - start) * 1000
+                if "listen_ms" in marks and "agent_ready_ms" in marks:
+                    break
+            done.set()
+
+        threading.Thread(target=reader, daemon=True).start()
+        done.wait(timeout)
+        proc.terminate()
+        try:
+            proc.wait(5)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+            proc.wait()
+        errlog.seek(0)
+        marks["imports"] = parse_importtime(errlog.read())
+    return marks
+
+
+def summarize(name, runs, keys, top):
+    print(f"\n== {name}（{len(runs)} 次）==")
+    for key, label in keys:
+        values = [r[key] for r in runs if key in r]
+        if values:
+            print(f"  {label}: 中位数 {statistics.median(values):8.0f} ms   最小 {min(values):8.0f} ms")
+        else:
+            print(f"  {label}: 未测到")
+    merged = {}
+    for r in runs:
+        for mod, us in r["imports"].items():
+            merged.setdefault(mod, []).append(us)
+    if not merged:
+        return
+    print("  导入耗时（顶层模块，累计，中位数）:")
+    rows = sorted(((statistics.median(v) / 1000, mod) for mod, v in merged.items()), reverse=True)
+    for ms, mod in rows[:top]:
+        print(f"    {ms:8.1f} ms  {mod}")
+    print(f"    {sum(ms for ms, _ in rows):8.1f} ms  合计")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="音乐服务和语音助手的冷启动耗时")
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--only", choices=("music", "voice"))
+    parser.add_argument("--top", type=int, default=12, help="导入耗时只列出最慢的前几个模块")
+    parser.add_argument("--voice-timeout", type=float, default=120)
+    args = parser.parse_args()
+
+    if args.only != "voice":
+        runs = [bench_music() for _ in range(args.runs)]
+        summarize("音乐服务 mcp_server_onlinemusic_player.py", runs,
+                  [("initialize_ms", "initialize 完成"), ("first_tool_ms", "首次工具调用返回")], args.top)
+    if args.only != "music":
+        runs = [bench_voice(timeout=args.voice_timeout) for _ in range(args.runs)]
+        summarize("语音助手 voice-qwen3-mcp.py", runs,
+                  [("listen_ms", "开始监听唤醒词"), ("agent_ready_ms", "助手初始化完成")], args.top)
+
+
+if __name__ == "__main__":
+    main()
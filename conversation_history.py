@@ -0,0 +1,172 @@
+# conversation_history.py
+# 有 token 预算的对话历史。最近 keep_turns 轮原文保留，更早的轮次在后台交给 LLM 压缩成一段滚动摘要，
+# 长时间没人说话就清空。每轮记录发给 LLM 的提示大小和延迟，用来确认历史不再随运行时间增长。
+import threading
+import time
+from collections import deque
+
+_qwen_count_tokens = None
+_tokenizer_loaded = False # qwen 分词器首次计数时才加载（导入 qwen_agent 较慢）
+
+
+def count_tokens(text):
+    global _qwen_count_tokens, _tokenizer_loaded
+    if not text:
+        return 0
+    if not _tokenizer_loaded:
+        try:
+            from qwen_agent.utils.tokenization_qwen import count_tokens as _qwen_count_tokens
+        except ImportError: # 没有 tiktoken 时用粗略估计
+            _qwen_count_tokens = None
+        _tokenizer_loaded = True
+    if _qwen_count_tokens is not None:
+        return _qwen_count_tokens(text)
+    # 汉字大约 1 token/字，其余大约 4 字符/token
+    cjk = sum(1 for ch in text if "一" <= ch <= "鿿")
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+def _turn_text(turn):
+    return "\n".join(f"{'用户' if m['role'] == 'user' else '助手'}: {m['content']}" for m in turn)
+
+
+class ConversationHistory:
+    """
+    begin_turn(用户输入) 返回本轮要发给 LLM 的 messages，end_turn(回复) 结束本轮。
+
+    超出 keep_turns 或 token_budget 的旧轮次移入待摘要列表，由 summarizer(旧摘要, 对话文本) 在后台线程
+    生成新摘要；摘要还没生成好时，待摘要的轮次在预算允许的范围内仍按原文发送。
+    fixed_tokens 是系统提示等每轮固定开销，只用于统计和预算计算。
+    """
+    def __init__(self, keep_turns=6, token_budget=3000, idle_reset_seconds=1800,
+                 summarizer=None, fixed_tokens=0):
+        self.keep_turns = keep_turns
+        self.token_budget = token_budget
+        self.idle_reset_seconds = idle_reset_seconds
+        self.summarizer = summarizer
+        self.fixed_tokens = fixed_tokens
+        self._lock = threading.Lock()
+        self.turns = [] # 每轮是 [用户消息, 助手消息] 两个 dict
+        self.pending = [] # 已移出窗口、还没并入摘要的轮次
+        self.summary = ""
+        self._summarizing = False
+        self._generation = 0 # 每次清空历史加一，丢弃清空前发起的摘要结果
+        self.last_active = time.time()
+        self.turn_count = 0
+        self.turn_log = deque(maxlen=200) # (时间, 提示 tokens, 首字延迟ms, 总耗时ms)
+        self._turn_started = None
+        self._prompt_tokens = 0
+
+    # ---- 对外接口 ----
+    def begin_turn(self, user_text):
+        with self._lock:
+            if self.turns and time.time() - self.last_active > self.idle_reset_seconds:
+                print(f"[历史] 空闲超过 {self.idle_reset_seconds / 60:.0f} 分钟，清空对话历史")
+                self._reset()
+            self.turns.append([{"role": "user", "content": user_text}])
+            self._fold()
+            messages = self._build()
+            self._prompt_tokens = self.fixed_tokens + sum(count_tokens(m["content"]) for m in messages)
+            self._turn_started = time.time()
+            self.turn_count += 1
+            return messages
+
+    def end_turn(self, assistant_text, first_token_latency=None):
+        """assistant_text 为空表示本轮没有回复；first_token_latency 为 LLM 首字延迟（秒）"""
+        with self._lock:
+            if not self.turns or len(self.turns[-1]) != 1:
+                return
+            if assistant_text:
+                self.turns[-1].append({"role": "assistant", "content": assistant_text})
+            else: # 没有回复就不留这一轮，避免出现连续两条用户消息
+                self.turns.pop()
+            self.last_active = time.time()
+            total_ms = (self.last_active - self._turn_started) * 1000 if self._turn_started else None
+            ttft_ms = first_token_latency * 1000 if first_token_latency is not None else None
+            self.turn_log.append((self.last_active, self._prompt_tokens, ttft_ms, total_ms))
+            print(f"[历史] 第 {self.turn_count} 轮: 提示 {self._prompt_tokens} tokens"
+                  f"（原文 {len(self.turns)} 轮，待摘要 {len(self.pending)} 轮，摘要 {len(self.summary)} 字）"
+                  + (f"，首字延迟 {ttft_ms:.0f} ms" if ttft_ms is not None else ""))
+            self._start_summary()
+
+    def reset(self):
+        with self._lock:
+            self._reset()
+
+    def stats(self):
+        with self._lock:
+            prompts = [entry[1] for entry in self.turn_log]
+            return {
+                "turns": self.turn_count,
+                "verbatim_turns": len(self.turns),
+                "pending_turns": len(self.pending),
+                "summary_chars": len(self.summary),
+                "last_prompt_tokens": prompts[-1] if prompts else 0,
+                "max_prompt_tokens": max(prompts) if prompts else 0,
+            }
+
+    # ---- 内部实现（调用方持有 _lock）----
+    def _reset(self):
+        self.turns = []
+        self.pending = []
+        self.summary = ""
+        self._generation += 1
+
+    def _fold(self):
+        """超出轮数或预算时把最旧的完整轮次移入待摘要列表（当前这一轮始终保留）"""
+        while len(self.turns) > self.keep_turns + 1 or (len(self.turns) > 1 and self._tokens(self.turns) > self._window_budget()):
+            self.pending.append(self.turns.pop(0))
+
+    def _window_budget(self):
+        return self.token_budget - self.fixed_tokens - count_tokens(self.summary)
+
+    @staticmethod
+    def _tokens(turns):
+        return sum(count_tokens(m["content"]) for turn in turns for m in turn)
+
+    def _build(self):
+        messages = []
+        context = []
+        if self.summary:
+            context.append(f"之前对话的摘要：{self.summary}")
+        # 还没并入摘要的轮次：从新到旧在剩余预算内尽量保留原文
+        room = self._window_budget() - self._tokens(self.turns)
+        kept = []
+        for turn in reversed(self.pending):
+            cost = count_tokens(_turn_text(turn))
+            if cost > room:
+                break
+            kept.insert(0, turn)
+            room -= cost
+        if kept:
+            context.append("更早的对话：\n" + "\n".join(_turn_text(turn) for turn in kept))
+        if context:
+            messages.append({"role": "system", "content": "\n\n".join(context)})
+        for turn in self.turns:
+            messages.extend(dict(m) for m in turn)
+        return messages
+
+    def _start_summary(self):
+        if self._summarizing or not self.pending or self.summarizer is None:
+            return
+        self._summarizing = True
+        batch = list(self.pending)
+        threading.Thread(target=self._summarize, args=(self.summary, batch, self._generation), daemon=True).start()
+
+    def _summarize(self, previous, batch, generation):
+        start = time.time()
+        try:
+            new_summary = self.summarizer(previous, "\n".join(_turn_text(turn) for turn in batch))
+        except Exception as e:
+            new_summary = None
+            print(f"[历史] 生成摘要失败: {e}")
+        with self._lock:
+            self._summarizing = False
+            if generation != self._generation: # 期间历史被清空过
+                return
+            if new_summary:
+                self.summary = new_summary.strip()
+                self.pending = [turn for turn in self.pending if not any(turn is b for b in batch)]
+                print(f"[历史] {len(batch)} 轮旧对话已并入摘要（{len(self.summary)} 字，耗时 {time.time() - start:.1f} s）")
+            elif len(self.pending) > self.keep_turns * 2: # 摘要一直失败时丢掉最旧的，保证历史有界
+                del self.pending[:len(self.pending) - self.keep_turns * 2]
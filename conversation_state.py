@@ -0,0 +1,102 @@
+# conversation_state.py
+# 对话的共享状态和状态机。ASR/TTS 回调通过 ConversationState 直接通知等待方，
+# 主循环不再用 sleep 轮询全局标志。
+import datetime
+import threading
+import time
+
+
+class ConversationState:
+    """
+    线程安全的共享状态（替代原来的 is_tts_speaking / asr_error_occurred / last_recognized_sentence 全局变量）。
+
+    所有修改都在同一个 Condition 下完成并 notify_all，等待方用 wait_for(条件, 超时) 阻塞。
+    """
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._tts_speaking = False
+        self._asr_error = False
+        self._sentence = "" # 本次监听累积的完整句子
+
+    # ---- TTS ----
+    @property
+    def tts_speaking(self):
+        return self._tts_speaking
+
+    def set_tts_speaking(self, speaking):
+        with self._cond:
+            self._tts_speaking = speaking
+            self._cond.notify_all()
+
+    def try_begin_tts(self):
+        """原子地占用 TTS，已在说话时返回 False"""
+        with self._cond:
+            if self._tts_speaking:
+                return False
+            self._tts_speaking = True
+            return True
+
+    def wait_tts_idle(self, timeout=None):
+        """阻塞到 TTS 说完，超时返回 False"""
+        with self._cond:
+            return self._cond.wait_for(lambda: not self._tts_speaking, timeout)
+
+    # ---- ASR ----
+    @property
+    def asr_error(self):
+        return self._asr_error
+
+    def set_asr_error(self):
+        with self._cond:
+            self._asr_error = True
+            self._cond.notify_all()
+
+    @property
+    def sentence(self):
+        return self._sentence
+
+    def reset_recognition(self):
+        """开始新的监听前清空识别结果和错误标志"""
+        with self._cond:
+            self._sentence = ""
+            self._asr_error = False
+
+    def append_sentence(self, text):
+        """识别到一个完整句子（ASR 回调线程调用），返回累积后的文本"""
+        with self._cond:
+            self._sentence = f"{self._sentence} {text}" if self._sentence else text
+            self._cond.notify_all()
+            return self._sentence
+
+    def take_sentence(self):
+        """取走目前累积的句子并清空"""
+        with self._cond:
+            sentence, self._sentence = self._sentence, ""
+            return sentence
+
+    # ---- 通用 ----
+    def notify(self):
+        """外部条件（例如监听线程退出）变化时唤醒所有等待方"""
+        with self._cond:
+            self._cond.notify_all()
+
+    def wait_for(self, predicate, timeout=None):
+        with self._cond:
+            return self._cond.wait_for(predicate, timeout)
+
+
+class ConversationStateMachine:
+    """WAKE_WORD / COMMAND 状态机，每次转换打印时间戳、原因和在上一状态停留的时长"""
+    WAKE_WORD = "WAKE_WORD"
+    COMMAND = "COMMAND"
+
+    def __init__(self, initial=WAKE_WORD):
+        self.state = initial
+        self.entered_at = time.time()
+
+    def transition(self, new_state, reason=""):
+        now = time.time()
+        stamp = datetime.datetime.now().strftime("%H:%M:%S.%f")[:-3]
+        print(f"[{stamp}] 状态 {self.state} -> {new_state} ({reason}; 停留 {(now - self.entered_at) * 1000:.0f} ms)")
+        self.state = new_state
+        self.entered_at = now
@@ -0,0 +1,311 @@
+# fake_services.py
+# 端到端基准测试用的本地替身服务，跑在后台线程的 aiohttp 事件循环里，一个端口同时提供：
+#   /api-ws/v1/inference  — DashScope 的 websocket 协议（run-task / continue-task / finish-task），
+#                           按 run-task 里的 task 区分：
+#                           ASR：按脚本回放识别结果，指令会话开始时通知 null 麦克风"说话"一段时间
+#                           TTS：收到文本后按固定速率发回 PCM
+#   /v1/chat/completions  — OpenAI 兼容的对话接口，按固定的首字延迟和字间隔流式返回脚本里的回复
+# 语音进程只需把 DASHSCOPE_WEBSOCKET_BASE_URL 和 LLM_MODEL_SERVER 指向这里，走的仍是真实的 SDK 和主循环。
+import asyncio
+import json
+import math
+import socket
+import threading
+import time
+import uuid
+
+from aiohttp import WSMsgType, web
+
+TTS_SAMPLE_RATE = 22050
+
+
+def _event(task_id, event, payload=None):
+    message = {"header": {"task_id": task_id, "event": event, "attributes": {}}, "payload": payload or {}}
+    return json.dumps(message, ensure_ascii=False)
+
+
+def _sentence(text, end_ms=None):
+    """ASR 的一条识别结果，end_time 不为空表示句末"""
+    return {"output": {"sentence": {"begin_time": 0, "end_time": end_ms, "text": text, "words": []}}, "usage": None}
+
+
+class FakeServices:
+    """
+    start() 启动服务并返回端口，stop() 关闭。时间参数都是毫秒：
+
+    ASR：唤醒会话开始后 wake_delay_ms 让麦克风说 wake_speech_ms，说完 asr_final_ms 后给出唤醒词；
+         唤醒之后的第一个指令会话让麦克风说 speech_ms，中途给出半句中间结果，说完 asr_final_ms 后给出整句。
+         之后的指令会话不说话，语音进程静音超时后退下，重新等待唤醒，这样每一轮都从唤醒开始。
+    TTS：每段文本先等 tts_first_packet_ms，再按每字 tts_ms_per_char 的音频时长、tts_rtf 的实时率分块发送。
+    LLM：首字前等 llm_first_token_ms，之后每 llm_token_interval_ms 发 llm_token_chars 个字；
+         tool 不为空时先按 nous 格式返回一次该工具调用，收到工具结果后再流式返回 reply。
+    """
+    def __init__(self, command_text, reply="好的。", tool=None, wake_text="小川同学", mic_control_port=0,
+                 wake_delay_ms=500, wake_speech_ms=700, speech_ms=1200, asr_final_ms=150,
+                 tts_first_packet_ms=250, tts_ms_per_char=180, tts_rtf=0.3, tts_chunk_ms=100,
+                 llm_first_token_ms=400, llm_token_interval_ms=40, llm_token_chars=2):
+        self.command_text = command_text
+        self.reply = reply
+        self.tool = tool
+        self.wake_text = wake_text
+        self.mic_control_port = mic_control_port
+        self.wake_delay_ms = wake_delay_ms
+        self.wake_speech_ms = wake_speech_ms
+        self.speech_ms = speech_ms
+        self.asr_final_ms = asr_final_ms
+        self.tts_first_packet_ms = tts_first_packet_ms
+        self.tts_ms_per_char = tts_ms_per_char
+        self.tts_rtf = tts_rtf
+        self.tts_chunk_ms = tts_chunk_ms
+        self.llm_first_token_ms = llm_first_token_ms
+        self.llm_token_interval_ms = llm_token_interval_ms
+        self.llm_token_chars = llm_token_chars
+        self.port = None
+        self.counts = {"asr_wake": 0, "asr_command": 0, "tts": 0, "tts_chars": 0, "llm": 0, "llm_tool_calls": 0}
+        self.tts_texts = [] # 按收到的顺序记录每段送来合成的文本，供检查朗读内容
+        self._command_pending = False # 已唤醒、下一个指令会话要说话
+        self._loop = None
+        self._runner = None
+        self._thread = None
+        self._mic = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    # ---- 生命周期 ----
+    def start(self, host="127.0.0.1", port=0):
+        ready = threading.Event()
+
+        def run():
+            self._loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(self._loop)
+            self._loop.run_until_complete(self._start_site(host, port))
+            ready.set()
+            self._loop.run_forever()
+
+        self._thread = threading.Thread(target=run, name="fake-services", daemon=True)
+        self._thread.start()
+        ready.wait(10)
+        return self.port
+
+    async def _start_site(self, host, port):
+        app = web.Application()
+        app.router.add_get("/api-ws/v1/inference", self._handle_ws)
+        app.router.add_get("/api-ws/v1/inference/", self._handle_ws)
+        app.router.add_post("/v1/chat/completions", self._handle_chat)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, port)
+        await site.start()
+        self.port = self._runner.addresses[0][1]
+
+    def stop(self):
+        if self._loop is None:
+            return
+        asyncio.run_coroutine_threadsafe(self._runner.cleanup(), self._loop).result(10)
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join(10)
+        self._mic.close()
+
+    @property
+    def ws_url(self):
+        return f"ws://127.0.0.1:{self.port}/api-ws/v1/inference"
+
+    @property
+    def llm_url(self):
+        return f"http://127.0.0.1:{self.port}/v1"
+
+    def _speak(self, ms):
+        """让 null 麦克风接下来 ms 毫秒产生语音电平的噪声"""
+        if self.mic_control_port > 0:
+            self._mic.sendto(json.dumps({"speech_ms": ms}).encode("utf-8"), ("127.0.0.1", self.mic_control_port))
+
+    # ---- DashScope websocket ----
+    async def _handle_ws(self, request):
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+        task = None # 当前任务的协程，TTS 连接可以复用，连续跑多个任务
+        async for msg in ws:
+            if msg.type == WSMsgType.BINARY:
+                continue # ASR 上行音频：替身不做识别，只按脚本回放
+            if msg.type != WSMsgType.TEXT:
+                break
+            message = json.loads(msg.data)
+            header, payload = message.get("header", {}), message.get("payload", {})
+            action, task_id = header.get("action"), header.get("task_id") or uuid.uuid4().hex
+            if action == "run-task":
+                await ws.send_str(_event(task_id, "task-started"))
+                if payload.get("task") == "tts":
+                    task = _TTSTask(self, ws, task_id)
+                else:
+                    task = _ASRTask(self, ws, task_id, payload.get("parameters", {}))
+                task.start()
+            elif action == "continue-task" and task is not None:
+                task.feed(payload.get("input", {}))
+            elif action == "finish-task" and task is not None:
+                await task.finish(payload.get("input", {}).get("directive") == "cancel")
+                task = None
+        if task is not None:
+            task.cancel()
+        return ws
+
+    # ---- OpenAI 兼容接口 ----
+    async def _handle_chat(self, request):
+        body = await request.json()
+        self.counts["llm"] += 1
+        messages = body.get("messages", [])
+        last = json.dumps(messages[-1].get("content", ""), ensure_ascii=False) if messages else ""
+        if self.tool and "<tool_response>" not in last:
+            self.counts["llm_tool_calls"] += 1
+            call = json.dumps({"name": self.tool, "arguments": {}}, ensure_ascii=False)
+            text = f"<tool_call>\n{call}\n</tool_call>"
+        else:
+            text = self.reply
+        model = body.get("model", "fake")
+        if not body.get("stream"):
+            await asyncio.sleep(self.llm_first_token_ms / 1000)
+            return web.json_response({
+                "id": "chatcmpl-" + uuid.uuid4().hex, "object": "chat.completion", "created": int(time.time()),
+                "model": model, "choices": [{"index": 0, "message": {"role": "assistant", "content": text},
+                                             "finish_reason": "stop"}],
+                "usage": {"prompt_tokens": 0, "completion_tokens": len(text), "total_tokens": len(text)}})
+
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream", "Cache-Control": "no-cache"})
+        await response.prepare(request)
+        chunk_id = "chatcmpl-" + uuid.uuid4().hex
+
+        async def send(delta, finish_reason=None):
+            chunk = {"id": chunk_id, "object": "chat.completion.chunk", "created": int(time.time()), "model": model,
+                     "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}]}
+            await response.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode("utf-8"))
+
+        await asyncio.sleep(self.llm_first_token_ms / 1000)
+        await send({"role": "assistant", "content": ""})
+        step = max(1, self.llm_token_chars)
+        for i in range(0, len(text), step):
+            if i:
+                await asyncio.sleep(self.llm_token_interval_ms / 1000)
+            await send({"content": text[i:i + step]})
+        await send({}, "stop")
+        await response.write(b"data: [DONE]\n\n")
+        await response.write_eof()
+        return response
+
+
+class _ASRTask:
+    def __init__(self, services, ws, task_id, parameters):
+        self.services = services
+        self.ws = ws
+        self.task_id = task_id
+        self.command = "max_sentence_silence" in parameters # 只有指令监听带这个参数
+        self.final = None # 还没发出的整句结果
+        self._script = None
+
+    def start(self):
+        s = self.services
+        if self.command:
+            s.counts["asr_command"] += 1
+            if s._command_pending:
+                s._command_pending = False
+                self._script = asyncio.ensure_future(self._utter(s.command_text, 0, s.speech_ms, partial=True))
+        else:
+            s.counts["asr_wake"] += 1
+            self._script = asyncio.ensure_future(self._utter(s.wake_text, s.wake_delay_ms, s.wake_speech_ms))
+
+    async def _utter(self, text, delay_ms, speech_ms, partial=False):
+        s = self.services
+        await asyncio.sleep(delay_ms / 1000)
+        s._speak(speech_ms)
+        self.final = text
+        if partial and len(text) > 1:
+            await asyncio.sleep(speech_ms / 2000)
+            await self._send(_sentence(text[:len(text) // 2]))
+            await asyncio.sleep(speech_ms / 2000 + s.asr_final_ms / 1000)
+        else:
+            await asyncio.sleep((speech_ms + s.asr_final_ms) / 1000)
+        await self._send_final()
+        if not self.command:
+            s._command_pending = True
+
+    async def _send(self, payload):
+        if not self.ws.closed:
+            await self.ws.send_str(_event(self.task_id, "result-generated", payload))
+
+    async def _send_final(self):
+        if self.final is not None:
+            text, self.final = self.final, None
+            await self._send(_sentence(text, end_ms=self.services.speech_ms))
+
+    def feed(self, data):
+        pass
+
+    async def finish(self, cancel=False):
+        # 真实服务在 finish-task 时会把尚未断句的内容作为最终结果发出
+        if self._script is not None and not self._script.done():
+            self._script.cancel()
+        if not cancel:
+            await self._send_final()
+        if not self.ws.closed:
+            await self.ws.send_str(_event(self.task_id, "task-finished", {"output": {}, "usage": None}))
+
+    def cancel(self):
+        if self._script is not None:
+            self._script.cancel()
+
+
+class _TTSTask:
+    def __init__(self, services, ws, task_id):
+        self.services = services
+        self.ws = ws
+        self.task_id = task_id
+        self._queue = asyncio.Queue()
+        self._worker = None
+        self._phase = 0.0
+
+    def start(self):
+        self.services.counts["tts"] += 1
+        self._worker = asyncio.ensure_future(self._synthesize())
+
+    def feed(self, data):
+        text = data.get("text")
+        if text:
+            self.services.counts["tts_chars"] += len(text)
+            self.services.tts_texts.append(text)
+            self._queue.put_nowait(text)
+
+    def _pcm(self, ms):
+        """一段低音量正弦波，跨块保持相位"""
+        n = int(TTS_SAMPLE_RATE * ms / 1000)
+        step = 2 * math.pi * 220 / TTS_SAMPLE_RATE
+        samples = bytearray()
+        for i in range(n):
+            value = int(3000 * math.sin(self._phase + i * step))
+            samples += value.to_bytes(2, "little", signed=True)
+        self._phase += n * step
+        return bytes(samples)
+
+    async def _synthesize(self):
+        s = self.services
+        while True:
+            text = await self._queue.get()
+            if text is None:
+                break
+            await asyncio.sleep(s.tts_first_packet_ms / 1000)
+            remaining = len(text) * s.tts_ms_per_char
+            while remaining > 0:
+                ms = min(s.tts_chunk_ms, remaining)
+                if self.ws.closed:
+                    return
+                await self.ws.send_bytes(self._pcm(ms))
+                remaining -= ms
+                await asyncio.sleep(ms * s.tts_rtf / 1000)
+
+    async def finish(self, cancel=False):
+        if cancel:
+            self._worker.cancel()
+        else:
+            self._queue.put_nowait(None)
+            await asyncio.gather(self._worker, return_exceptions=True)
+        if not self.ws.closed:
+            await self.ws.send_str(_event(self.task_id, "task-finished", {"output": {}}))
+
+    def cancel(self):
+        if self._worker is not None:
+            self._worker.cancel()
@@ -0,0 +1,36 @@
+# http_session.py
+# 带连接池和自动重试的 requests.Session。同一主机的请求复用 keep-alive 连接，
+# 省掉每次的 TCP（以及重定向到 HTTPS 时的 TLS）握手；连接失败按指数退避重试。
+import os
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+HTTP_CONNECT_TIMEOUT = float(os.environ.get("HTTP_CONNECT_TIMEOUT", "3.05"))
+HTTP_READ_TIMEOUT = float(os.environ.get("HTTP_READ_TIMEOUT", "15"))
+HTTP_POOL_CONNECTIONS = int(os.environ.get("HTTP_POOL_CONNECTIONS", "4")) # 缓存连接池的主机数
+HTTP_POOL_MAXSIZE = int(os.environ.get("HTTP_POOL_MAXSIZE", "8")) # 每个主机保持的连接数（不小于并发探测线程数）
+HTTP_RETRIES = int(os.environ.get("HTTP_RETRIES", "2"))
+HTTP_RETRY_BACKOFF = float(os.environ.get("HTTP_RETRY_BACKOFF", "0.3"))
+
+
+def make_session(pool_connections=HTTP_POOL_CONNECTIONS, pool_maxsize=HTTP_POOL_MAXSIZE,
+                 retries=HTTP_RETRIES, backoff=HTTP_RETRY_BACKOFF):
+    """
+    创建带连接池的 Session。只对连接阶段的错误重试（请求还没发出去，重试是安全的）；
+    读超时和 HTTP 错误状态不重试，交给调用方换下一首等。
+    """
+    retry = Retry(total=retries, connect=retries, read=0, status=0, redirect=5,
+                  backoff_factor=backoff, allowed_methods=frozenset(["GET", "HEAD"]),
+                  raise_on_status=False)
+    adapter = HTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize, max_retries=retry)
+    session = requests.Session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def timeout(read=HTTP_READ_TIMEOUT):
+    """requests 的 (连接超时, 读超时) 二元组"""
+    return (HTTP_CONNECT_TIMEOUT, read)
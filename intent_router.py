@@ -0,0 +1,66 @@
+# intent_router.py
+# 本地意图快速通道：暂停/继续/停止/下一首/问时间这类不需要推理的指令，用预编译的正则整句匹配，
+# 命中后直接调用 MCP 工具或本地回答，不走一遍 LLM。只做整句匹配，带其它内容的句子一律交给 LLM。
+import re
+from collections import deque
+
+# 句首的称呼、客套话和句尾语气词，匹配前去掉
+_PREFIX = re.compile(r"^(小川同学|小川|请你|请|麻烦你|麻烦|帮我|给我|你)+")
+_SUFFIX = re.compile(r"(一下|吧|啊|呀|哦|呢|好吗|可以吗|谢谢)+$")
+_PUNCT = re.compile(r"[\s，。！？、,.!?~～]+")
+
+DEFAULT_INTENTS = {
+    "pause": [r"(把)?(音乐|歌曲|歌)?(先)?暂停(播放|音乐|一下)?"],
+    "resume": [r"(继续|恢复)(播放|放)(音乐|歌曲|歌)?", r"(继续|恢复)(音乐|歌曲|歌)", r"接着(放|播放|听)(音乐|歌)?"],
+    "stop": [r"(停止|关闭|关掉|停掉|别放了|不要放了|不听了)(播放)?(音乐|歌曲|歌)?", r"(把)?(音乐|歌)(停了|关了|关掉|停掉)"],
+    "next": [r"(播放|放|来)?(下一首|换一首|换首歌|切歌)(歌)?"],
+    "time": [r"(现在)?(几点了?|几点钟了?|什么时间了?|是什么时间)"],
+}
+
+
+def normalize(text):
+    text = _PUNCT.sub("", text or "")
+    text = _PREFIX.sub("", text)
+    return _SUFFIX.sub("", text)
+
+
+class IntentRouter:
+    """
+    match(文本) 返回意图名或 None。record_llm_turn 记录走 LLM 的轮次耗时，
+    record_local 据此估算每次本地处理节省的时间。
+    """
+    def __init__(self, intents=DEFAULT_INTENTS):
+        self._patterns = [(name, re.compile(p)) for name, patterns in intents.items() for p in patterns]
+        self.matched = {name: 0 for name in intents}
+        self.fallthrough = 0
+        self.saved_ms = 0.0
+        self._llm_turn_ms = deque(maxlen=50)
+
+    def match(self, text):
+        normalized = normalize(text)
+        for name, pattern in self._patterns:
+            if pattern.fullmatch(normalized):
+                self.matched[name] += 1
+                return name
+        self.fallthrough += 1
+        return None
+
+    def record_llm_turn(self, seconds):
+        self._llm_turn_ms.append(seconds * 1000)
+
+    def typical_llm_ms(self):
+        if not self._llm_turn_ms:
+            return None
+        return sorted(self._llm_turn_ms)[len(self._llm_turn_ms) // 2]
+
+    def record_local(self, name, seconds):
+        """返回估算节省的毫秒数（还没有 LLM 轮次可参考时为 None）"""
+        typical = self.typical_llm_ms()
+        saved = None if typical is None else max(0.0, typical - seconds * 1000)
+        if saved is not None:
+            self.saved_ms += saved
+        return saved
+
+    def stats(self):
+        return {"matched": dict(self.matched), "fallthrough": self.fallthrough,
+                "typical_llm_ms": self.typical_llm_ms(), "saved_ms_total": round(self.saved_ms)}
@@ -0,0 +1,98 @@
+# keyword_spotter.py
+# 本地唤醒词检测：加载 .env 中 WakeupModelFile 指定的关键词模型(wakeword.table)，
+# 用 Azure Speech SDK 的 KeywordRecognizer 在本机 CPU 上离线识别，不上传音频。
+import os
+import threading
+import time
+from collections import namedtuple
+
+KWS_SAMPLE_RATE = 16000
+KWS_FRAME_BYTES = 1600 # 每次推送 50ms 音频
+
+# text: 识别到的关键词; keyword_end: 关键词在音频中结束的位置(秒);
+# detected_at: 检测回调触发时已推送的音频长度(秒); latency: 两者之差
+KeywordHit = namedtuple("KeywordHit", ["text", "keyword_end", "detected_at", "latency"])
+
+
+class LocalKeywordSpotter:
+    """
+    基于关键词模型文件的离线唤醒词检测器。
+
+    wait_for_keyword(cursor) 持续从 cursor.read(nbytes, timeout) 取 16kHz 16bit 单声道 PCM
+    推给识别器，命中时返回 KeywordHit。read 返回 None 表示暂时没有数据，返回 b"" 表示音频结束。
+    """
+    def __init__(self, model_file):
+        import azure.cognitiveservices.speech as speechsdk # 可选依赖
+        if not os.path.exists(model_file):
+            raise FileNotFoundError(model_file)
+        self._sdk = speechsdk
+        self.model_file = model_file
+        self.model = speechsdk.KeywordRecognitionModel(model_file)
+        self._format = speechsdk.audio.AudioStreamFormat(
+            samples_per_second=KWS_SAMPLE_RATE, bits_per_sample=16, channels=1)
+
+    def wait_for_keyword(self, cursor, stop_event=None, timeout=None):
+        """阻塞直到检测到关键词、stop_event 被设置、超时或音频结束"""
+        sdk = self._sdk
+        push_stream = sdk.audio.PushAudioInputStream(stream_format=self._format)
+        recognizer = sdk.KeywordRecognizer(audio_config=sdk.audio.AudioConfig(stream=push_stream))
+        hit_event = threading.Event()
+        fed = [0] # 已推送的采样点数
+        hit = []
+
+        def on_recognized(evt):
+            if evt.result.reason == sdk.ResultReason.RecognizedKeyword:
+                detected_at = fed[0] / KWS_SAMPLE_RATE
+                keyword_end = (evt.result.offset + evt.result.duration) / 1e7 # 单位为100ns
+                hit.append(KeywordHit(evt.result.text, keyword_end, detected_at,
+                                      max(0.0, detected_at - keyword_end)))
+                hit_event.set()
+
+        recognizer.recognized.connect(on_recognized)
+        future = recognizer.recognize_once_async(self.model)
+        deadline = None if timeout is None else time.time() + timeout
+        try:
+            while not hit_event.is_set():
+                if stop_event is not None and stop_event.is_set():
+                    break
+                if deadline is not None and time.time() > deadline:
+                    break
+                data = cursor.read(KWS_FRAME_BYTES, timeout=0.5)
+                if data is None:
+                    continue
+                if not data: # 音频结束，给识别器一点时间处理尾部
+                    push_stream.close()
+                    hit_event.wait(1.0)
+                    break
+                push_stream.write(data)
+                fed[0] += len(data) // 2
+        finally:
+            if not hit_event.is_set():
+                try:
+                    recognizer.stop_recognition_async().get()
+                except Exception:
+                    pass
+            else:
+                future.get()
+            try:
+                push_stream.close()
+            except Exception:
+                pass
+        return hit[0] if hit else None
+
+
+def load_keyword_spotter(model_file):
+    """按配置加载本地唤醒词检测器，依赖或模型文件缺失时返回 None（回退到云端识别）"""
+    if not model_file:
+        return None
+    try:
+        spotter = LocalKeywordSpotter(model_file)
+        print(f"本地唤醒词模型已加载: {model_file}")
+        return spotter
+    except ImportError:
+        print("未安装 azure-cognitiveservices-speech，唤醒词使用云端识别")
+    except FileNotFoundError:
+        print(f"未找到唤醒词模型文件 {model_file}，唤醒词使用云端识别")
+    except Exception as e:
+        print(f"加载本地唤醒词模型失败: {e}，唤醒词使用云端识别")
+    return None
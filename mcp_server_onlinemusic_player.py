@@ -8,7 +8,6 @@ import json, ast
 
 import requests, json
 from io import BytesIO 
-import tempfile 
 import time
 import datetime  
 import io 
@@ -18,6 +17,9 @@ import os
 import platform
 #from dotenv import load_dotenv  
 import subprocess  
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from collections import deque
 
 # ---- 日志记录配置 ----
 import logging
@@ -54,19 +56,225 @@ else:
         xdg_runtime_dir = '/tmp'
 
 os.environ['XDG_RUNTIME_DIR'] = xdg_runtime_dir
+os.environ.setdefault('PYGAME_HIDE_SUPPORT_PROMPT', '1') # pygame 导入时的欢迎语会打到 stdout，混进 MCP 的 stdio 通道
 import pygame   
+from music_cache import SongCache
+from streaming_buffer import StreamingAudioBuffer
+from ttl_cache import TTLCache
+from http_session import make_session, timeout as http_timeout
+from player_state import PlayerStatePublisher
 
 quitReg=False
 pause=False
+# 所有网络请求共用一个带连接池的 Session，同一主机复用 keep-alive 连接
+http = make_session()
 playing=False
 # Create an MCP server
 mcp = FastMCP("music_player")
-# 初始化pygame  
-pygame.init()  
-pygame.mixer.init() # 显式初始化 mixer
+# 只用到 pygame 的 mixer：不调用 pygame.init()（会启动显示、joystick 等全部子系统），
+# mixer 也推迟到第一次播放时才打开，服务启动后能立即响应工具调用
+mixer_lock = threading.Lock()
+# 与语音进程 audio_output.py 读同一个环境变量；直接读，不为一个常量导入整个输出引擎（numpy 等）
+AUDIO_DEVICE_RATE = int(os.environ.get("AUDIO_DEVICE_RATE", "44100"))
 
-# 用于存储当前播放的临时文件名，方便清理
-current_temp_file = None
+def ensureMixer():
+    if pygame.mixer.get_init():
+        return
+    with mixer_lock:
+        if not pygame.mixer.get_init():
+            start = time.time()
+            # 与语音进程的输出引擎使用同一设备采样率，避免 ALSA 在TTS和音乐之间切换采样率
+            pygame.mixer.init(frequency=AUDIO_DEVICE_RATE)
+            logger.info(f"pygame mixer 已初始化，耗时 {(time.time() - start) * 1000:.0f} ms")
+
+def mixerBusy():
+    """mixer 还没打开时肯定没有在播放"""
+    return bool(pygame.mixer.get_init()) and pygame.mixer.music.get_busy()
+
+# ---- 播放状态推送 ----
+# 状态变化时通过本机 UDP 推给语音进程（见 player_state.py），语音进程查状态不必再调用 getPlaybackStatus
+state_publisher = PlayerStatePublisher()
+
+# ---- 边下载边播放 ----
+# 缓冲到 MUSIC_STREAM_PREBUFFER_BYTES 就开始播放，内存中最多保留 MUSIC_STREAM_MAX_BUFFER_BYTES，与歌曲长度无关
+MUSIC_STREAMING = os.environ.get("MUSIC_STREAMING", "1") != "0"
+MUSIC_STREAM_PREBUFFER_BYTES = int(os.environ.get("MUSIC_STREAM_PREBUFFER_BYTES", str(96 * 1024)))
+MUSIC_STREAM_MAX_BUFFER_BYTES = int(os.environ.get("MUSIC_STREAM_MAX_BUFFER_BYTES", str(1024 * 1024)))
+# SDL_mixer 加载 MP3 时会先读文件末尾找 ID3v1/APE 标签，这部分用单独的 Range 请求先取回来
+MUSIC_STREAM_TAIL_BYTES = int(os.environ.get("MUSIC_STREAM_TAIL_BYTES", "8192"))
+current_stream = None # 当前正在边下边播的 StreamingAudioBuffer
+
+# ---- 歌曲磁盘缓存 ----
+MUSIC_CACHE_DIR = os.environ.get("MUSIC_CACHE_DIR", "music_cache")
+MUSIC_CACHE_MAX_MB = int(os.environ.get("MUSIC_CACHE_MAX_MB", "500"))
+song_cache = SongCache(MUSIC_CACHE_DIR, MUSIC_CACHE_MAX_MB * 1024 * 1024)
+current_song_id = None # 当前播放歌曲的 id，点歌成功后用来记录 关键字->id
+logger.info(f"歌曲缓存: {MUSIC_CACHE_DIR}, {song_cache.stats()}")
+
+# ---- 候选歌曲并发探测 ----
+# 排名靠前的歌可能是 VIP/无版权，先用 Range 请求并发探测一批，再下载第一首能播放的
+MUSIC_PROBE_CANDIDATES = int(os.environ.get("MUSIC_PROBE_CANDIDATES", "4")) # 每批探测几首
+MUSIC_MAX_CANDIDATES = int(os.environ.get("MUSIC_MAX_CANDIDATES", "10")) # 最多尝试前几首
+MUSIC_PROBE_TIMEOUT = float(os.environ.get("MUSIC_PROBE_TIMEOUT", "5"))
+probe_pool = ThreadPoolExecutor(max_workers=MUSIC_PROBE_CANDIDATES, thread_name_prefix="probe")
+
+# ---- 候选歌曲排序 ----
+# 下载前先用搜索结果里的元数据（付费标记、版权状态、时长、歌名/歌手匹配度）给候选打分重排
+UNPLAYABLE_FEES = (1, 4) # 1: VIP 歌曲，4: 付费专辑，外链只能拿到试听片段或错误页
+MIN_SONG_DURATION_MS = 45 * 1000
+# skipped_probes_est 是估计值：原排名里排在第一首可播放歌曲之前、这次排到后面去的歌数，
+# 这些歌原本也只会收到一次小的 Range 探测，不是完整下载
+ranking_stats = {"searches": 0, "reordered": 0, "skipped_probes_est": 0}
+
+# ---- 播放队列 ----
+# 当前歌曲播放时后台把队首下载进歌曲缓存，再交给 pygame.mixer.music.queue，当前歌一结束 SDL 立即接上，没有间隙
+play_queue = deque() # 待播放的歌曲 {"id", "name"}
+queue_lock = threading.RLock()
+queued_in_mixer = None # 已交给 mixer 排队的条目（即 play_queue[0]）
+current_track = None # 当前播放的条目
+preload_event = threading.Event()
+QUEUE_MONITOR_INTERVAL = 0.2
+
+# ---- 搜索结果缓存 ----
+# "搜一下X" 紧接着 "播放X" 时第二次不必再请求搜索接口
+MUSIC_SEARCH_CACHE_TTL = float(os.environ.get("MUSIC_SEARCH_CACHE_TTL", "600"))
+MUSIC_SEARCH_CACHE_SIZE = int(os.environ.get("MUSIC_SEARCH_CACHE_SIZE", "64"))
+search_cache = TTLCache(MUSIC_SEARCH_CACHE_SIZE, MUSIC_SEARCH_CACHE_TTL, name="search")
+
+def _downloadIntoBuffer(response, buffer, songName, cache_writer=None):
+    """后台线程：把 HTTP 响应分块写入流式缓冲区，同时写入歌曲缓存（完整下载后才入索引）"""
+    completed = False
+    try:
+        for chunk in response.iter_content(chunk_size=16 * 1024):
+            if not chunk:
+                continue
+            if cache_writer:
+                cache_writer.write(chunk)
+            if not buffer.feed(chunk):
+                logger.debug(f"[{songName}] 流式缓冲区已关闭，停止下载")
+                return
+        completed = True
+        logger.info(f"[{songName}] 流式下载完成，共 {buffer.received} bytes，缓冲区峰值 {buffer.peak_bytes} bytes")
+    except Exception as e:
+        logger.error(f"[{songName}] 流式下载中断: {e}")
+    finally:
+        buffer.finish()
+        response.close()
+        if cache_writer:
+            try:
+                if completed and cache_writer.commit(songName):
+                    logger.info(f"[{songName}] 已写入歌曲缓存: {song_cache.stats()}")
+                else:
+                    cache_writer.abort()
+            except OSError as e:
+                logger.error(f"[{songName}] 写入歌曲缓存失败: {e}")
+                cache_writer.abort()
+
+def closeCurrentStream():
+    """停止当前的边下边播（须在 mixer 卸载音乐之后调用）"""
+    global current_stream
+    if current_stream is not None:
+        try:
+            current_stream.close()
+        except Exception as e:
+            logger.error(f"关闭流式缓冲区时出错: {e}")
+        current_stream = None
+
+def streamAndPlay(url, songName, request_start, songid=None):
+    """
+    边下载边播放。成功开始播放返回 True；pygame 无法从流中解码返回 False（调用方改为完整下载）。
+    网络错误或返回的不是音频时抛出 requests 异常，由调用方换下一首。
+    """
+    global current_stream
+    response = http.get(url, timeout=http_timeout(15), stream=True)
+    response.raise_for_status()
+    content_type = response.headers.get("Content-Type", "")
+    if "text/html" in content_type:
+        response.close()
+        raise requests.exceptions.RequestException(f"返回的是网页而不是音频 (Content-Type: {content_type})")
+    total_length = int(response.headers.get("Content-Length", 0)) or None
+    buffer = StreamingAudioBuffer(total_length, max_ahead=MUSIC_STREAM_MAX_BUFFER_BYTES // 2,
+                                  keep_behind=MUSIC_STREAM_MAX_BUFFER_BYTES // 2)
+    if total_length and total_length > MUSIC_STREAM_TAIL_BYTES:
+        try:
+            tail = http.get(response.url, headers={"Range": f"bytes=-{MUSIC_STREAM_TAIL_BYTES}"},
+                            timeout=http_timeout(5))
+            if tail.status_code == 206 and len(tail.content) == MUSIC_STREAM_TAIL_BYTES:
+                buffer.set_tail(tail.content)
+        except requests.exceptions.RequestException as e:
+            logger.debug(f"[{songName}] 获取文件末尾失败，加载时可能多等一会: {e}")
+    cache_writer = None
+    if songid is not None:
+        try:
+            cache_writer = song_cache.begin(songid, total_length)
+        except OSError as e:
+            logger.error(f"[{songName}] 无法创建歌曲缓存文件: {e}")
+    threading.Thread(target=_downloadIntoBuffer, args=(response, buffer, songName, cache_writer), daemon=True).start()
+
+    if not buffer.wait_for(MUSIC_STREAM_PREBUFFER_BYTES, timeout=15):
+        buffer.close()
+        raise requests.exceptions.RequestException("预缓冲超时")
+    try:
+        ensureMixer()
+        pygame.mixer.music.load(buffer, "mp3")
+        pygame.mixer.music.play()
+    except pygame.error as pg_e:
+        logger.warning(f"[{songName}] pygame 无法从流中播放: {pg_e}")
+        buffer.close()
+        return False
+    current_stream = buffer
+    for _ in range(10): # 最多等 0.5 秒确认开始出声
+        if mixerBusy():
+            break
+        time.sleep(0.05)
+    if not mixerBusy():
+        logger.warning(f"[{songName}] 流式播放未能开始")
+        pygame.mixer.music.unload()
+        closeCurrentStream()
+        return False
+    logger.info(f"[{songName}] 流式播放已开始，首次出声耗时 {(time.time() - request_start) * 1000:.0f} ms，"
+                f"已缓冲 {buffer.received} bytes / 总长 {total_length}")
+    return True
+
+def playCachedSong(path, songName, request_start):
+    """直接播放缓存中的文件（不走网络）"""
+    try:
+        ensureMixer()
+        pygame.mixer.music.load(path)
+        pygame.mixer.music.play()
+    except pygame.error as pg_e:
+        logger.error(f"[{songName}] 播放缓存文件 {path} 出错: {pg_e}")
+        return False
+    for _ in range(10):
+        if mixerBusy():
+            logger.info(f"[{songName}] 从缓存播放，首次出声耗时 {(time.time() - request_start) * 1000:.0f} ms")
+            return True
+        time.sleep(0.05)
+    logger.warning(f"[{songName}] 缓存文件未能开始播放")
+    return False
+
+def searchSongs(song_name):
+    """
+    调用网易云搜索接口，返回原始 JSON 文本。search_music 和 play_music 共用，
+    结果按规范化后的关键字缓存 MUSIC_SEARCH_CACHE_TTL 秒。网络错误抛出 requests 异常。
+    """
+    key = SongCache.normalize_query(song_name)
+    text = search_cache.get(key)
+    if text is not None:
+        logger.info(f"搜索 '{song_name}' 命中缓存，{search_cache.stats()}")
+        return text
+    url='http://music.163.com/api/search/get/web?csrf_token=hlpretag=&hlposttag=&s= %s&type=1&offset=0&total=true&limit=10' % song_name
+    start = time.time()
+    res=http.get(url, timeout=http_timeout(10))
+    res.raise_for_status()
+    text = res.text
+    try: # 只缓存正常的搜索结果，接口报错的响应下次重新请求
+        if "result" in json.loads(text):
+            search_cache.put(key, text)
+    except json.JSONDecodeError:
+        pass
+    logger.info(f"搜索 '{song_name}' 未命中缓存，请求耗时 {(time.time() - start) * 1000:.0f} ms，{search_cache.stats()}")
+    return text
 
 @mcp.tool()
 def search_music(song_name:str)-> str:
@@ -79,14 +287,10 @@ def search_music(song_name:str)-> str:
     """
     logger.info(f"收到搜索音乐请求: {song_name}")
     #return f"为您找到歌曲：{song_name} 已开始播放。如果有其他任务请告知我，我先退下了。"
-    url='http://music.163.com/api/search/get/web?csrf_token=hlpretag=&hlposttag=&s= %s&type=1&offset=0&total=true&limit=10' % song_name
     try:
-        res=requests.get(url, timeout=10)
-        res.raise_for_status()
-        logger.info(f"搜索API成功，返回文本长度: {len(res.text)}")
-        # 这里应该直接返回res.text，后续的json.loads和songs拼接逻辑实际上不会执行，因为被return了
-        # 如果打算处理后返回，那么return res.text需要移到后面或修改逻辑
-        return res.text # MCP工具通常期望返回JSON字符串或可JSON序列化的Python对象
+        text = searchSongs(song_name)
+        logger.info(f"搜索API成功，返回文本长度: {len(text)}")
+        return text # MCP工具通常期望返回JSON字符串或可JSON序列化的Python对象
     except requests.exceptions.RequestException as req_e:
         logger.error(f"搜索歌曲API请求失败: {req_e}")
         # 对于工具来说，抛出异常或者返回一个表示错误的JSON可能更好
@@ -111,33 +315,30 @@ def play_music(song_name:str)-> str:
         song_name: 歌曲名或关键字
     
     """
-    global playing, pause, current_temp_file
+    global playing, pause, current_song_id, current_track
     logger.info(f"play_music 调用，歌曲名: {song_name}")
+    if not pygame.mixer.get_init(): # 首次播放：打开音频设备和搜索、下载同时进行
+        threading.Thread(target=ensureMixer, daemon=True).start()
 
-    if playing or pygame.mixer.music.get_busy(): # 检查pygame是否也认为在播放
-        logger.debug("检测到已有音乐在播放或mixer仍繁忙，先停止并卸载旧的播放...")
-        try:
-            pygame.mixer.music.stop()
-            pygame.mixer.music.unload() # 卸载音乐以释放文件
-            logger.debug("旧音乐已停止并卸载")
-            if current_temp_file and os.path.exists(current_temp_file):
-                try:
-                    os.remove(current_temp_file)
-                    logger.debug(f"清理了旧的临时文件: {current_temp_file}")
-                    current_temp_file = None
-                except Exception as e:
-                    logger.error(f"清理旧临时文件 {current_temp_file} 时出错: {e}")
-        except Exception as e:
-            logger.error(f"停止旧音乐、卸载或清理文件时出错: {e}")
-    playing = False
-    pause = False
+    stopCurrentTrack()
+
+    cached = song_cache.lookup_query(song_name)
+    if cached:
+        cached_id, cached_name = cached
+        cached_path = song_cache.get(cached_id)
+        if cached_path and playCachedSong(cached_path, cached_name, time.time()):
+            current_song_id = cached_id
+            current_track = {"id": cached_id, "name": cached_name}
+            playing = True
+            pause = False
+            preload_event.set()
+            publishState()
+            logger.info(f"点歌 '{song_name}' 命中歌曲缓存: {cached_name}，缓存统计: {song_cache.stats()}")
+            return json.dumps({"status":f"歌曲【{cached_name}】已开始播放。"})
     
     logger.debug("正在搜索歌曲...")
-    url='http://music.163.com/api/search/get/web?csrf_token=hlpretag=&hlposttag=&s= %s&type=1&offset=0&total=true&limit=10' % song_name
     try:
-        res=requests.get(url, timeout=10) 
-        res.raise_for_status()
-        music_json=json.loads(res.text)
+        music_json=json.loads(searchSongs(song_name))
         logger.info(f"歌曲搜索API成功，找到歌曲数量: {music_json.get('result', {}).get('songCount', 0)}")
     except requests.exceptions.RequestException as req_e:
         logger.error(f"搜索歌曲API请求失败: {req_e}")
@@ -149,13 +350,19 @@ def play_music(song_name:str)-> str:
     count = music_json.get("result", {}).get("songCount", 0)
     
     if count > 0:
+        result = music_json.get("result", {})
+        result["songs"] = rankCandidates(result.get("songs", []) or [], song_name)
         musicName = downloadAndPlay(music_json, 0)
         if musicName:
+            song_cache.remember_query(song_name, current_song_id)
+            preload_event.set()
+            publishState()
             logger.info(f"找到歌曲：'{musicName}' 开始播放。请欣赏。")
             return json.dumps({"status":f"歌曲【{musicName}】已开始播放。"})
         else:
             playing=False
             pause = False
+            publishState()
             logger.warning("downloadAndPlay 未成功播放音乐")
             return json.dumps({"error": "播放音乐失败，请检查网络或稍后再试。"})
     
@@ -164,124 +371,269 @@ def play_music(song_name:str)-> str:
     logger.info("没有找到符合条件的音乐")
     return json.dumps({"status": "没有找到音乐。"})
 
-def downloadAndPlay(music_json,index):
-    global playing, pause, current_temp_file
-    logger.debug(f"downloadAndPlay 调用, index: {index}")
-    
-    if current_temp_file and os.path.exists(current_temp_file):
+def stopCurrentTrack():
+    """停止并卸载当前歌曲，清理流式缓冲（mixer 里排队的下一首也一并丢弃）"""
+    global playing, pause, queued_in_mixer
+    with queue_lock:
+        queued_in_mixer = None
+    if playing or mixerBusy(): # 检查pygame是否也认为在播放
+        logger.debug("检测到已有音乐在播放或mixer仍繁忙，先停止并卸载旧的播放...")
         try:
-            os.remove(current_temp_file)
-            logger.debug(f"清理了上一个临时文件: {current_temp_file}")
+            pygame.mixer.music.stop()
+            pygame.mixer.music.unload() # 卸载音乐以释放文件
+            closeCurrentStream()
+            logger.debug("旧音乐已停止并卸载")
         except Exception as e:
-            logger.error(f"清理旧临时文件时出错: {e}")
-        current_temp_file = None
+            logger.error(f"停止或卸载旧音乐时出错: {e}")
+    playing = False
+    pause = False
 
-    count = music_json.get("result", {}).get("songCount", 0)
-    if index >= count:
-        logger.debug(f"downloadAndPlay: 索引 {index} 超出歌曲数量 {count}")
-        playing = False 
-        pause = False
-        return False
-        
-    songs = music_json.get("result", {}).get("songs", [])
-    if not songs or index >= len(songs):
-        logger.warning(f"downloadAndPlay: 歌曲列表为空或索引无效")
-        playing = False
-        pause = False
-        return False
+def songUrl(songid):
+    return 'http://music.163.com/song/media/outer/url?id=%s.mp3' % songid
+
+def isPlayableAudio(head):
+    """文件开头是 ID3 标签或 MPEG 帧同步字（11 个 1）才认为是可播放的 MP3"""
+    if head[:3] == b"ID3":
+        return True
+    return len(head) >= 2 and head[0] == 0xFF and (head[1] & 0xE0) == 0xE0
+
+def probeSong(songid, cancelled):
+    """
+    用 Range 请求只取前 16 字节，判断这首歌能否播放（VIP/无版权时会重定向到网页或 404）。
+    返回 (是否可播放, 最终的音频URL 或 失败原因)。
+    """
+    if cancelled.is_set():
+        return False, "已取消"
+    try:
+        response = http.get(songUrl(songid), headers={"Range": "bytes=0-15"},
+                             timeout=http_timeout(MUSIC_PROBE_TIMEOUT), stream=True)
+        try:
+            if response.status_code >= 400:
+                return False, f"HTTP {response.status_code}"
+            content_type = response.headers.get("Content-Type", "")
+            if "text/html" in content_type:
+                return False, f"返回的是网页 ({content_type})"
+            head = next(response.iter_content(chunk_size=16), b"")
+            if not isPlayableAudio(head):
+                return False, f"不是 MP3 数据: {head[:8]!r}"
+            return True, response.url # 重定向后的真实地址，下载时省掉一次跳转
+        finally:
+            response.close()
+    except requests.exceptions.RequestException as e:
+        return False, f"探测失败: {e}"
+
+def findPlayable(songs, start):
+    """
+    并发探测 songs[start:start+MUSIC_PROBE_CANDIDATES]，按搜索排名返回第一首可播放的 (下标, URL)，
+    都不可播放返回 None。已缓存的歌直接视为可播放，不走网络。选中后取消其余探测。
+    """
+    batch = songs[start:start + MUSIC_PROBE_CANDIDATES]
+    for offset, song_info in enumerate(batch): # 排在已缓存歌曲之后的候选不必探测
+        if song_info.get("id") and song_cache.contains(song_info["id"]):
+            batch = batch[:offset + 1]
+            break
+
+    probe_start = time.time()
+    cancelled = threading.Event()
+    futures = []
+    for song_info in batch:
+        songid = song_info.get("id")
+        if not songid:
+            futures.append(None)
+        elif song_cache.contains(songid):
+            futures.append("cached")
+        else:
+            futures.append(probe_pool.submit(probeSong, songid, cancelled))
+    try:
+        for offset, future in enumerate(futures):
+            song_info = batch[offset]
+            if future is None:
+                logger.error(f"歌曲信息中缺少ID: {song_info}")
+                continue
+            if future == "cached":
+                return start + offset, None
+            ok, detail = future.result()
+            if ok:
+                logger.info(f"探测 {len(batch)} 首候选歌曲，第 {start + offset} 首《{song_info.get('name')}》可播放，"
+                            f"耗时 {(time.time() - probe_start) * 1000:.0f} ms")
+                return start + offset, detail
+            logger.info(f"候选《{song_info.get('name')}》(ID: {song_info.get('id')}) 不可播放: {detail}")
+        return None
+    finally:
+        cancelled.set()
+        for future in futures:
+            if future not in (None, "cached"):
+                future.cancel()
+
+def likelyUnplayable(song_info):
+    """根据元数据判断外链大概率放不了，返回原因，能放返回 None"""
+    if song_info.get("fee") in UNPLAYABLE_FEES:
+        return f"fee={song_info.get('fee')}"
+    if (song_info.get("status") or 0) < 0:
+        return f"status={song_info.get('status')}"
+    if song_info.get("noCopyrightRcmd"):
+        return "无版权"
+    return None
+
+def scoreSong(song_info, query):
+    """分数越高越先尝试；大概率放不了的直接排到最后"""
+    score = 0.0
+    if likelyUnplayable(song_info):
+        score -= 100
+    duration = song_info.get("duration") or 0
+    if 0 < duration < MIN_SONG_DURATION_MS:
+        score -= 20 # 片段、铃声之类
+    normalized = SongCache.normalize_query(query)
+    name = SongCache.normalize_query(song_info.get("name", ""))
+    if name and name == normalized:
+        score += 20
+    elif name and (name in normalized or normalized in name):
+        score += 10
+    for artist in song_info.get("artists") or []:
+        artist_name = SongCache.normalize_query(artist.get("name", ""))
+        if artist_name and artist_name in normalized:
+            score += 10
+            break
+    return score
+
+def rankCandidates(songs, query):
+    """
+    按可播放性和与关键字的匹配度对搜索结果重新排序（同分保持原排名），
+    并估计原本排在第一首可播放歌曲之前、现在不用再探测的歌曲数。
+    """
+    ranked = sorted(enumerate(songs), key=lambda item: (-scoreSong(item[1], query), item[0]))
+    ranked_songs = [song for _, song in ranked]
+    ranking_stats["searches"] += 1
+    if [i for i, _ in ranked] != list(range(len(songs))):
+        ranking_stats["reordered"] += 1
+    first_playable = next((i for i, song in enumerate(songs) if not likelyUnplayable(song)), len(songs))
+    skipped = songs[:first_playable]
+    if skipped and ranked_songs and not likelyUnplayable(ranked_songs[0]):
+        ranking_stats["skipped_probes_est"] += len(skipped)
+        for song in skipped:
+            logger.info(f"跳过《{song.get('name')}》(ID: {song.get('id')}): {likelyUnplayable(song)}")
+    logger.info(f"候选排序: {[s.get('name') for s in ranked_songs[:5]]}，累计 {ranking_stats}")
+    return ranked_songs
+
+def downloadAndPlay(music_json, index=0):
+    """
+    从 songs[index] 起按排名找第一首能播放的歌并开始播放，返回歌名，全部失败返回 False。
+    每轮并发探测一批候选，最多尝试前 MUSIC_MAX_CANDIDATES 首。
+    """
+    global playing, pause, current_track
+    logger.debug(f"downloadAndPlay 调用, index: {index}")
+    songs = music_json.get("result", {}).get("songs", []) or []
+    limit = min(len(songs), MUSIC_MAX_CANDIDATES)
+    position = index
+    while position < limit:
+        found = findPlayable(songs[:limit], position)
+        if found is None:
+            position += MUSIC_PROBE_CANDIDATES
+            continue
+        chosen, resolved_url = found
+        musicName = playSong(songs[chosen], resolved_url)
+        if musicName:
+            current_track = {"id": songs[chosen].get("id"), "name": musicName}
+            return musicName
+        position = chosen + 1
+    logger.warning(f"downloadAndPlay: 前 {limit} 首候选都无法播放")
+    playing = False
+    pause = False
+    return False
+
+def playSong(song_info, resolved_url=None):
+    """下载（或从缓存读取）并播放一首歌，成功返回歌名，失败返回 False"""
+    global playing, pause, current_song_id
 
-    song_info = songs[index]
     songid = song_info.get("id")
     songName = song_info.get("name", "未知歌曲")
-    
-    if not songid:
-        logger.error(f"歌曲信息中缺少ID: {song_info}")
-        playing = False; pause = False
-        return downloadAndPlay(music_json, index + 1)
+    current_song_id = songid
+    cached_path = song_cache.get(songid)
+    if cached_path:
+        if playCachedSong(cached_path, songName, time.time()):
+            playing = True
+            pause = False
+            logger.info(f"成功开始播放(缓存): {songName}，缓存统计: {song_cache.stats()}")
+            return songName
+        logger.warning(f"[{songName}] 缓存文件无法播放，重新下载")
 
-    url='http://music.163.com/song/media/outer/url?id=%s.mp3' % songid
+    url = resolved_url or songUrl(songid)
     logger.info(f"准备下载歌曲: {songName} (ID: {songid}), URL: {url}")
     
-    temp_file = None
-    temp_file_name_for_this_attempt = None
     response_obj = None # 重命名以避免与外部的response混淆，并初始化
 
     try:
-        logger.debug(f"[{songName}] Calling requests.get(url, timeout=15)...") # 修复：直接记录将使用的超时值
-        response_obj = requests.get(url, timeout=15) # timeout参数单位为秒
-        logger.debug(f"[{songName}] requests.get() returned. Status: {response_obj.status_code if response_obj else 'No response_obj'}")
+        request_start = time.time()
+        if MUSIC_STREAMING:
+            if streamAndPlay(url, songName, request_start, songid):
+                playing = True
+                pause = False
+                logger.info(f"成功开始播放: {songName}")
+                return songName
+            logger.info(f"[{songName}] 改为完整下载后播放")
+
+        logger.debug(f"[{songName}] Calling http.get(url, timeout={http_timeout(15)})...")
+        response_obj = http.get(url, timeout=http_timeout(15)) # (连接超时, 读超时)，单位为秒
+        logger.debug(f"[{songName}] http.get() returned. Status: {response_obj.status_code if response_obj else 'No response_obj'}")
 
         logger.debug(f"[{songName}] Calling response_obj.raise_for_status()...")
         response_obj.raise_for_status() 
         logger.debug(f"[{songName}] response_obj.raise_for_status() successful.")
 
-        logger.debug(f"[{songName}] Accessing response_obj.content...")
-        audio_data_content = response_obj.content # 首先直接访问 .content
-        logger.debug(f"[{songName}] response_obj.content accessed, length: {len(audio_data_content) if audio_data_content is not None else 'None'}. Now creating BytesIO.")
-        
-        logger.debug(f"[{songName}] Creating BytesIO object...")
-        audio_data = BytesIO(audio_data_content)
-        logger.debug(f"[{songName}] BytesIO object created.")
-
-        # 这条日志之前出现得很晚
-        logger.info(f"歌曲 {songName} 下载成功，大小: {len(audio_data.getvalue())} bytes") 
-
-        temp_file = tempfile.NamedTemporaryFile(suffix=".mp3", delete=False)
-        temp_file_name_for_this_attempt = temp_file.name
-        current_temp_file = temp_file_name_for_this_attempt
-        
-        temp_file.write(audio_data.getbuffer())
-        temp_file.close() 
-        
-        logger.debug(f"临时音频文件已创建: {temp_file_name_for_this_attempt}")
+        audio_data_content = response_obj.content
+        logger.info(f"歌曲 {songName} 下载成功，大小: {len(audio_data_content)} bytes") 
 
-        pygame.mixer.music.load(temp_file_name_for_this_attempt)
-        logger.debug(f"'{temp_file_name_for_this_attempt}' 已加载到pygame mixer")
+        ensureMixer()
+        # 直接从内存加载，不写临时文件（pygame 持有 BytesIO 的引用直到下一次 load/unload）
+        pygame.mixer.music.load(BytesIO(audio_data_content), "mp3")
         pygame.mixer.music.play()
         logger.debug("调用 pygame.mixer.music.play()")
         
-        time.sleep(0.5) 
-        if pygame.mixer.music.get_busy():
+        for _ in range(10): # 最多等 0.5 秒确认开始出声
+            if mixerBusy():
+                break
+            time.sleep(0.05)
+        if mixerBusy():
             playing = True
             pause = False
-            logger.info(f"成功开始播放: {songName}")
+            logger.info(f"成功开始播放: {songName}，首次出声耗时 {(time.time() - request_start) * 1000:.0f} ms")
+            try:
+                song_cache.put(songid, songName, audio_data_content)
+            except OSError as cache_e:
+                logger.error(f"[{songName}] 写入歌曲缓存失败: {cache_e}")
             return songName
         else:
             logger.error(f"Pygame未能开始播放歌曲: {songName} (mixer.music.get_busy() is False)")
             playing = False; pause = False
-            if temp_file_name_for_this_attempt and os.path.exists(temp_file_name_for_this_attempt):
-                try:
-                    os.remove(temp_file_name_for_this_attempt)
-                    logger.debug(f"清理播放失败的临时文件: {temp_file_name_for_this_attempt}")
-                    if current_temp_file == temp_file_name_for_this_attempt:
-                         current_temp_file = None
-                except Exception as del_e:
-                    logger.error(f"清理播放失败的临时文件时出错: {del_e}")
-            return downloadAndPlay(music_json, index + 1)
+            pygame.mixer.music.unload()
+            return False
         
     except requests.exceptions.RequestException as req_e:
         logger.error(f"下载歌曲 {songName} (ID: {songid}) 失败: {req_e}")
         playing=False; pause = False
-        if temp_file_name_for_this_attempt and os.path.exists(temp_file_name_for_this_attempt):
-             try: os.remove(temp_file_name_for_this_attempt); logger.debug(f"清理下载失败的临时文件: {temp_file_name_for_this_attempt}"); current_temp_file = None if current_temp_file == temp_file_name_for_this_attempt else current_temp_file
-             except Exception as del_e: logger.error(f"清理下载失败临时文件时出错: {del_e}")
-        return downloadAndPlay(music_json,index+1)
+        return False
         
     except pygame.error as pg_e:
-        logger.error(f"Pygame播放 {songName} (来自 {temp_file_name_for_this_attempt}) 时出错: {pg_e}")
+        logger.error(f"Pygame播放 {songName} 时出错: {pg_e}")
         playing=False; pause = False
-        if temp_file_name_for_this_attempt and os.path.exists(temp_file_name_for_this_attempt):
-             try: os.remove(temp_file_name_for_this_attempt); logger.debug(f"清理Pygame错误的临时文件: {temp_file_name_for_this_attempt}"); current_temp_file = None if current_temp_file == temp_file_name_for_this_attempt else current_temp_file
-             except Exception as del_e: logger.error(f"清理Pygame错误临时文件时出错: {del_e}")
-        return downloadAndPlay(music_json,index+1)
+        return False
         
     except Exception as e:  
         logger.error(f"处理歌曲 {songName} (ID: {songid}) 时发生通用错误: {e}", exc_info=True)
         playing=False; pause = False
-        if temp_file_name_for_this_attempt and os.path.exists(temp_file_name_for_this_attempt):
-             try: os.remove(temp_file_name_for_this_attempt); logger.debug(f"清理通用错误的临时文件: {temp_file_name_for_this_attempt}"); current_temp_file = None if current_temp_file == temp_file_name_for_this_attempt else current_temp_file
-             except Exception as del_e: logger.error(f"清理通用错误临时文件时出错: {del_e}")
-        return downloadAndPlay(music_json,index+1)
+        return False
+
+@mcp.tool()
+def getMusicCacheStats():
+    """
+    查看歌曲缓存的统计信息
+
+    返回:
+        缓存的歌曲数、占用字节数、上限、命中/未命中次数、命中率、淘汰次数
+    """
+    stats = song_cache.stats()
+    logger.info(f"歌曲缓存统计: {stats}")
+    return json.dumps(stats, ensure_ascii=False)
 
 @mcp.tool()       
 def getPlaybackStatus():
@@ -297,7 +649,7 @@ def getPlaybackStatus():
     logger.debug("getPlaybackStatus 调用")
     current_status = "stopped" # 默认状态
     try:
-        pygame_busy = pygame.mixer.music.get_busy()
+        pygame_busy = mixerBusy()
         logger.debug(f"pygame_busy={pygame_busy}, global playing={playing}, global pause={pause}")
 
         if playing: # 全局标志认为正在播放或暂停
@@ -356,48 +708,42 @@ def stopplay():
     返回: 
         播放状态: 已停止
     """
-    global playing, pause, current_temp_file
+    global playing, pause, queued_in_mixer
     logger.info("stopplay: 收到停止指令")
+    with queue_lock:
+        queued_in_mixer = None # stop() 会丢弃 mixer 里排队的歌，队列本身保留
+    if not pygame.mixer.get_init(): # 还没播放过任何歌曲
+        closeCurrentStream()
+        playing = False
+        pause = False
+        publishState()
+        return json.dumps({"status": "stopped"})
     try:
         logger.debug("执行 pygame.mixer.music.stop()")
         pygame.mixer.music.stop()  
         pygame.mixer.music.unload() # 卸载音乐以释放文件
+        closeCurrentStream()
         logger.debug("音乐已停止并卸载")
         time.sleep(0.1) # 给卸载操作一点时间
         
         # 再次检查是否繁忙，以防万一
-        if pygame.mixer.music.get_busy(): 
+        if mixerBusy(): 
             logger.warning("调用stop和unload后，pygame仍然报告繁忙，尝试 fadeout...")
             pygame.mixer.music.fadeout(500) 
             pygame.mixer.music.unload() # fadeout 后再次确保卸载
             time.sleep(0.5) # 给fadeout和卸载时间
-            if pygame.mixer.music.get_busy():
+            if mixerBusy():
                  logger.error("再次停止和卸载后pygame仍然繁忙！音乐可能未完全停止。")
         else:
             logger.debug("stopplay: Pygame mixer确认已停止且音乐已卸载。")
 
-        # 只有在确认mixer不繁忙后才尝试删除文件
-        if not pygame.mixer.music.get_busy() and current_temp_file and os.path.exists(current_temp_file):
-            try:
-                logger.debug(f"准备清理临时文件: {current_temp_file}")
-                os.remove(current_temp_file)
-                logger.info(f"stopplay: 清理了临时文件 {current_temp_file}")
-            except Exception as e:
-                logger.error(f"stopplay: 清理临时文件 {current_temp_file} 时出错: {e}")
-            finally:
-                # 无论删除是否成功，都将 current_temp_file 设为 None，因为它要么被删了，要么删除失败不应再用
-                current_temp_file = None 
-        elif current_temp_file:
-            logger.warning(f"stopplay: Mixer仍在忙或文件不存在 ({current_temp_file})，未尝试删除临时文件。")
-        else:
-            logger.debug("stopplay: 没有当前临时文件需要清理或文件不存在。")
-
     except Exception as e:
         logger.error(f"stopplay: 执行pygame.mixer.music.stop()或相关操作时出错: {e}", exc_info=True)
     
     finally: 
         playing = False
         pause = False
+        publishState()
         logger.info("stopplay: 全局状态已更新为 playing=False, pause=False")
     
     return json.dumps({"status": "stopped"}) # 确保返回JSON字符串
@@ -429,6 +775,7 @@ def pauseplay():
         try:
             pygame.mixer.music.pause()
             pause = True # playing 保持 True
+            publishState()
             logger.info("音乐已暂停")
             return json.dumps({"status": "paused"})
         except Exception as e:
@@ -466,6 +813,7 @@ def unpauseplay():
         try:
             pygame.mixer.music.unpause()
             pause = False # playing 保持 True
+            publishState()
             logger.info("音乐已恢复播放")
             return json.dumps({"status": "playing"})
         except Exception as e:
@@ -478,8 +826,262 @@ def unpauseplay():
         logger.warning(f"音乐未暂停或已停止 (状态: {current_playback_status})，无法恢复")
         return json.dumps({"status": "stopped"})
 
+
+def currentStatus():
+    """只读当前状态，不做 getPlaybackStatus 那样的纠正"""
+    if not playing:
+        return "stopped"
+    return "paused" if pause else "playing"
+
+def publishState(event=None):
+    """状态或当前歌曲有变化时推送给语音进程；event 为 "next"（自动切歌）或 "ended"（播完）等"""
+    name = current_track["name"] if (playing and current_track) else None
+    state_publisher.publish(currentStatus(), name, event)
+
+def findFirstPlayable(song_name):
+    """搜索并排序后返回第一首可播放的歌 {"id", "name"}，找不到返回 None"""
+    cached = song_cache.lookup_query(song_name)
+    if cached:
+        return {"id": cached[0], "name": cached[1]}
+    music_json = json.loads(searchSongs(song_name))
+    songs = rankCandidates(music_json.get("result", {}).get("songs", []) or [], song_name)
+    songs = songs[:MUSIC_MAX_CANDIDATES]
+    position = 0
+    while position < len(songs):
+        found = findPlayable(songs, position)
+        if found is not None:
+            song_info = songs[found[0]]
+            return {"id": song_info.get("id"), "name": song_info.get("name", "未知歌曲")}
+        position += MUSIC_PROBE_CANDIDATES
+    return None
+
+def downloadToCache(entry):
+    """把队列中的歌完整下载进歌曲缓存，返回缓存文件路径，失败返回 None"""
+    path = song_cache.get(entry["id"])
+    if path:
+        return path
+    start = time.time()
+    try:
+        response = http.get(songUrl(entry["id"]), timeout=http_timeout(15), stream=True)
+        response.raise_for_status()
+        if "text/html" in response.headers.get("Content-Type", ""):
+            logger.warning(f"预加载《{entry['name']}》失败: 返回的是网页")
+            return None
+        writer = song_cache.begin(entry["id"], int(response.headers.get("Content-Length", 0)) or None)
+        try:
+            for chunk in response.iter_content(chunk_size=64 * 1024):
+                writer.write(chunk)
+        except Exception:
+            writer.abort()
+            raise
+        finally:
+            response.close()
+        if not writer.commit(entry["name"]):
+            logger.warning(f"预加载《{entry['name']}》未能写入歌曲缓存")
+            return None
+    except (requests.exceptions.RequestException, OSError) as e:
+        logger.error(f"预加载《{entry['name']}》失败: {e}")
+        return None
+    logger.info(f"预加载《{entry['name']}》完成，耗时 {(time.time() - start) * 1000:.0f} ms")
+    return song_cache.get(entry["id"])
+
+def preloadNext():
+    """把队首歌曲下载好并交给 mixer 排队；队首下载失败就丢掉换下一首"""
+    global queued_in_mixer
+    while True:
+        with queue_lock:
+            if not play_queue or queued_in_mixer is not None or not playing:
+                return
+            entry = play_queue[0]
+        path = downloadToCache(entry)
+        with queue_lock:
+            if not play_queue or play_queue[0] is not entry or queued_in_mixer is not None or not playing:
+                continue # 下载期间队列或播放状态变了，重新判断
+            if path is None:
+                play_queue.popleft()
+                logger.warning(f"《{entry['name']}》无法预加载，已移出播放队列")
+                continue
+            try:
+                pygame.mixer.music.queue(path)
+            except pygame.error as pg_e:
+                play_queue.popleft()
+                logger.error(f"mixer 无法排队《{entry['name']}》: {pg_e}")
+                continue
+            entry["queued_at"] = time.time()
+            queued_in_mixer = entry
+            logger.info(f"《{entry['name']}》已交给 mixer 排队，当前歌曲结束后无缝播放")
+            return
+
+def preloadWorker():
+    while True:
+        preload_event.wait()
+        preload_event.clear()
+        try:
+            preloadNext()
+        except Exception as e:
+            logger.error(f"预加载线程出错: {e}", exc_info=True)
+
+def onTrackAdvanced():
+    """mixer 已自动切到排队的下一首（调用方持有 queue_lock）。返回 True 表示需要调用方改播队列里的下一首"""
+    global queued_in_mixer, current_track, current_song_id, playing
+    entry = queued_in_mixer
+    queued_in_mixer = None
+    if play_queue and play_queue[0] is entry:
+        play_queue.popleft()
+    closeCurrentStream() # 上一首若是边下边播，下载可以停了
+    if entry.get("cancelled"): # 已排进 mixer 后队列被清空
+        logger.info(f"《{entry['name']}》已被移出队列，停止播放")
+        pygame.mixer.music.stop()
+        playing = False
+        return bool(play_queue)
+    current_track = entry
+    current_song_id = entry["id"]
+    logger.info(f"无缝切换到下一首《{entry['name']}》，队列剩余 {len(play_queue)} 首")
+    preload_event.set()
+    publishState("next")
+    return False
+
+def queueMonitor():
+    """
+    检测 mixer 自动切歌（get_pos 归零）、预加载没赶上时当前歌已结束、以及没有下一首时播放结束的情况；
+    顺带把状态变化和心跳推送给语音进程。
+    """
+    global playing, pause
+    last_pos = 0
+    idle_ticks = 0 # 连续几次检查 mixer 都不忙（暂停的瞬间 get_busy 也为 False，需要连续两次才算播完）
+    while True:
+        time.sleep(QUEUE_MONITOR_INTERVAL)
+        play_next = False
+        ended = False
+        try:
+            with queue_lock:
+                if not playing or pause:
+                    last_pos = 0
+                    idle_ticks = 0
+                else:
+                    pos = pygame.mixer.music.get_pos()
+                    idle_ticks = idle_ticks + 1 if not mixerBusy() else 0
+                    if queued_in_mixer is not None and 0 <= pos < last_pos:
+                        play_next = onTrackAdvanced()
+                    elif idle_ticks >= 2 and queued_in_mixer is None:
+                        if play_queue:
+                            play_next = True
+                        else:
+                            playing = False
+                            pause = False
+                            ended = True
+                    last_pos = pos
+            if ended:
+                logger.info("当前歌曲播放结束，队列中没有下一首")
+                publishState("ended")
+            if play_next:
+                logger.warning("当前歌曲已结束但下一首还没交给 mixer，直接播放下一首")
+                playNextInQueue()
+                last_pos = 0
+                idle_ticks = 0
+            publishState()
+            state_publisher.heartbeat()
+        except Exception as e:
+            logger.error(f"播放队列监视线程出错: {e}", exc_info=True)
+
+def playNextInQueue():
+    """停止当前歌曲，播放队列里的下一首；队首放不了就继续往后，返回歌名或 None"""
+    global current_track
+    stopCurrentTrack()
+    while True:
+        with queue_lock:
+            if not play_queue:
+                return None
+            entry = play_queue.popleft()
+        musicName = playSong(entry)
+        if musicName:
+            current_track = entry
+            preload_event.set()
+            return musicName
+        logger.warning(f"队列中的《{entry['name']}》无法播放，跳过")
+
+@mcp.tool()
+def enqueue_music(song_name:str)-> str:
+    """
+    把一首歌加入播放队列（当前没有播放时立即开始播放）。想连续播放多首歌时逐首调用。
+
+    params:
+        song_name: 歌曲名或关键字
+    """
+    logger.info(f"enqueue_music 调用，歌曲名: {song_name}")
+    try:
+        entry = findFirstPlayable(song_name)
+    except requests.exceptions.RequestException as req_e:
+        logger.error(f"搜索歌曲API请求失败: {req_e}")
+        return json.dumps({"error": "网络请求失败，无法搜索歌曲。"})
+    except json.JSONDecodeError as json_e:
+        logger.error(f"解析歌曲搜索结果失败: {json_e}")
+        return json.dumps({"error": "解析歌曲数据失败。"})
+    if entry is None:
+        return json.dumps({"status": "没有找到可以播放的音乐。"})
+    with queue_lock:
+        play_queue.append(entry)
+        ahead = len(play_queue) - 1
+    if not playing and not mixerBusy():
+        musicName = playNextInQueue()
+        if musicName:
+            return json.dumps({"status": f"歌曲【{musicName}】已开始播放。"})
+        return json.dumps({"error": "播放音乐失败，请检查网络或稍后再试。"})
+    preload_event.set()
+    logger.info(f"《{entry['name']}》已加入播放队列，前面还有 {ahead} 首")
+    return json.dumps({"status": f"歌曲【{entry['name']}】已加入播放队列，前面还有{ahead}首。"})
+
+@mcp.tool()
+def next_music()-> str:
+    """
+    切到播放队列中的下一首歌
+
+    返回:
+        开始播放的歌名，或队列为空的提示
+    """
+    logger.info("next_music 调用")
+    with queue_lock:
+        if not play_queue:
+            return json.dumps({"status": "播放队列是空的。"})
+    musicName = playNextInQueue()
+    if musicName:
+        return json.dumps({"status": f"歌曲【{musicName}】已开始播放。"})
+    return json.dumps({"error": "队列中的歌曲都无法播放。"})
+
+@mcp.tool()
+def list_queue()-> str:
+    """
+    查看当前播放的歌曲和播放队列
+
+    返回:
+        current: 当前歌曲名（没有播放时为 null），queue: 排队的歌名列表
+    """
+    with queue_lock:
+        current = current_track["name"] if (playing and current_track) else None
+        names = [entry["name"] for entry in play_queue]
+    logger.info(f"list_queue: 当前 {current}，队列 {names}")
+    return json.dumps({"current": current, "queue": names}, ensure_ascii=False)
+
+@mcp.tool()
+def clear_queue()-> str:
+    """
+    清空播放队列（不影响当前正在播放的歌曲）
+    """
+    with queue_lock:
+        count = len(play_queue)
+        play_queue.clear()
+        if queued_in_mixer is not None:
+            queued_in_mixer["cancelled"] = True # mixer 里已排队的歌无法撤回，切歌时再停
+    logger.info(f"clear_queue: 清空了 {count} 首")
+    return json.dumps({"status": f"已清空播放队列，共移除{count}首。"})
+
+threading.Thread(target=preloadWorker, daemon=True, name="preload").start()
+threading.Thread(target=queueMonitor, daemon=True, name="queue-monitor").start()
     
 if __name__ == "__main__":
    logger.info(f"音乐播放器服务 (mcp_server_onlinemusic_player.py) 正在启动，PID: {os.getpid()}")
-   mcp.run(transport='stdio')
+   try:
+       mcp.run(transport='stdio')
+   finally:
+       song_cache.flush() # 命中时只更新了内存里的使用时间
    logger.info("音乐播放器服务已停止") # 这句可能在正常stdio退出时不会执行
\ No newline at end of file
@@ -0,0 +1,176 @@
+# mcp_startup.py
+# 并行连接 mcp_server_config.json 中的 MCP 服务，并支持把服务标记为 "lazy": true 延后启动。
+#   - 非 lazy 的服务同时连接，每个最多等 MCP_CONNECT_TIMEOUT 秒，个别服务慢或连不上不会拖住整个启动；
+#     超时的服务连上后再补注册到助手。
+#   - lazy 服务：上次连接时记下的工具描述（mcp_tools_cache.json）直接注册成代理工具，
+#     第一次调用时才启动/连接服务；没有缓存的工具描述时改为启动后在后台连接。
+# 启动时打印每个服务的连接耗时。
+import asyncio
+import concurrent.futures
+import hashlib
+import json
+import os
+import threading
+import time
+
+from qwen_agent.tools import MCPManager
+from qwen_agent.tools.base import BaseTool
+
+MCP_CONNECT_TIMEOUT = float(os.environ.get("MCP_CONNECT_TIMEOUT", "30"))
+MCP_TOOLS_CACHE = os.environ.get("MCP_TOOLS_CACHE", "mcp_tools_cache.json")
+
+
+def _config_hash(server_cfg):
+    cfg = {k: v for k, v in server_cfg.items() if k != "lazy"}
+    return hashlib.sha1(json.dumps(cfg, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+class MCPServerLoader:
+    def __init__(self, config, schema_cache_path=MCP_TOOLS_CACHE, connect_timeout=MCP_CONNECT_TIMEOUT):
+        self.servers = dict(config.get("mcpServers", {}))
+        self.schema_cache_path = schema_cache_path
+        self.connect_timeout = connect_timeout
+        self._lock = threading.Lock()
+        self._futures = {} # 服务名 -> 连接 future
+        self._real_tools = {} # 工具名 -> MCPManager 创建的真实工具
+        self._late_tools = [] # 助手创建前/后才连上的工具，attach 时补注册
+        self._agent = None
+        self.report = {} # 服务名 -> {"mode", "status", "ms", "tools"}
+        self._schemas = self._load_schemas()
+
+    # ---- 启动 ----
+    def start(self):
+        """连接所有非 lazy 服务（并行），返回可直接交给 Assistant(function_list=...) 的工具列表"""
+        boot_start = time.time()
+        tools = []
+        eager = [name for name, cfg in self.servers.items() if not cfg.get("lazy")]
+        for name in eager:
+            self._connect_async(name, "eager")
+        for name in eager:
+            future = self._futures[name]
+            try:
+                server_tools = future.result(timeout=max(0.0, boot_start + self.connect_timeout - time.time()))
+                tools.extend(server_tools)
+            except concurrent.futures.TimeoutError:
+                self.report[name]["status"] = "超时，后台继续连接"
+            except Exception as e:
+                self.report[name]["status"] = f"失败: {e}"
+        for name, cfg in self.servers.items():
+            if not cfg.get("lazy"):
+                continue
+            cached = self._schemas.get(name)
+            if cached and cached.get("hash") == _config_hash(cfg):
+                proxies = [self._make_lazy_tool(name, schema) for schema in cached["tools"]]
+                tools.extend(proxies)
+                self.report[name] = {"mode": "lazy", "status": "首次调用时启动", "ms": None, "tools": len(proxies)}
+            else: # 不知道它有哪些工具，只能先在后台连上
+                self._connect_async(name, "lazy(后台)")
+        with self._lock:
+            self._late_tools = [t for t in self._late_tools if t not in tools]
+        self.print_report(time.time() - boot_start)
+        return tools
+
+    def attach(self, agent):
+        """助手创建后调用：之后（或之前）在后台连上的服务的工具补注册进去"""
+        with self._lock:
+            self._agent = agent
+            late, self._late_tools = self._late_tools, []
+        for tool in late:
+            agent.function_map[tool.name] = tool
+
+    def print_report(self, total_seconds):
+        print(f"MCP 服务启动耗时 {total_seconds * 1000:.0f} ms：")
+        for name, info in self.report.items():
+            ms = f"{info['ms']:.0f} ms" if info.get("ms") is not None else "-"
+            print(f"  {name:<16}{info['mode']:<12}{ms:>10}  工具 {info.get('tools', 0):>2} 个  {info['status']}")
+
+    # ---- 连接 ----
+    def _connect_async(self, name, mode):
+        """提交连接协程（同一服务只提交一次），返回 future"""
+        with self._lock:
+            if name in self._futures:
+                return self._futures[name]
+            cfg = {k: v for k, v in self.servers[name].items() if k != "lazy"}
+            manager = MCPManager()
+            started = time.time()
+            self.report[name] = {"mode": mode, "status": "连接中", "ms": None, "tools": 0}
+            future = asyncio.run_coroutine_threadsafe(manager.init_config_async({"mcpServers": {name: cfg}}), manager.loop)
+            self._futures[name] = future
+        future.add_done_callback(lambda f: self._on_connected(name, started, f))
+        return future
+
+    def _on_connected(self, name, started, future):
+        info = self.report[name]
+        info["ms"] = (time.time() - started) * 1000
+        if future.exception() is not None:
+            info["status"] = f"失败: {future.exception()}"
+            if info["mode"] != "eager": # eager 服务的失败在启动报告里
+                print(f"MCP 服务 {name} 连接失败（{info['ms']:.0f} ms）: {future.exception()}")
+            return
+        tools = future.result()
+        info["status"] = "已连接"
+        info["tools"] = len(tools)
+        with self._lock:
+            for tool in tools:
+                self._real_tools[tool.name] = tool
+            # 非代理注册的服务（eager 超时、lazy 无缓存）连上后补注册
+            proxied = info["mode"] == "lazy"
+            agent = self._agent
+            if not proxied:
+                if agent is None:
+                    self._late_tools.extend(tools)
+                else:
+                    for tool in tools:
+                        agent.function_map[tool.name] = tool
+        if proxied:
+            print(f"MCP 服务 {name} 已按需启动（{info['ms']:.0f} ms，{len(tools)} 个工具）")
+        elif info["mode"] != "eager":
+            print(f"MCP 服务 {name} 已在后台连接（{info['ms']:.0f} ms，{len(tools)} 个工具）")
+        self._save_schema(name, tools)
+
+    def call_lazy(self, server_name, tool_name, params, **kwargs):
+        """代理工具被调用：按需启动服务并等待连接完成，再转发"""
+        if server_name not in self._futures:
+            print(f"首次使用 {tool_name}，正在启动 MCP 服务 {server_name}...")
+        future = self._connect_async(server_name, "lazy")
+        future.result(timeout=self.connect_timeout)
+        tool = self._real_tools.get(tool_name)
+        if tool is None:
+            return f"Tool {tool_name} does not exists."
+        return tool.call(params, **kwargs)
+
+    def _make_lazy_tool(self, server_name, schema):
+        loader = self
+
+        class LazyMCPTool(BaseTool):
+            name = schema["name"]
+            description = schema["description"]
+            parameters = schema["parameters"]
+
+            def call(self, params, **kwargs):
+                return loader.call_lazy(server_name, self.name, params, **kwargs)
+
+        LazyMCPTool.__name__ = f"{schema['name']}_LazyClass"
+        return LazyMCPTool()
+
+    # ---- 工具描述缓存 ----
+    def _load_schemas(self):
+        try:
+            with open(self.schema_cache_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+
+    def _save_schema(self, name, tools):
+        with self._lock:
+            self._schemas[name] = {
+                "hash": _config_hash(self.servers[name]),
+                "tools": [{"name": t.name, "description": t.description, "parameters": t.parameters} for t in tools],
+            }
+            try:
+                tmp = self.schema_cache_path + ".tmp"
+                with open(tmp, "w", encoding="utf-8") as f:
+                    json.dump(self._schemas, f, ensure_ascii=False, indent=1)
+                os.replace(tmp, self.schema_cache_path)
+            except OSError as e:
+                print(f"保存 MCP 工具描述缓存失败: {e}")
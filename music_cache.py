@@ -0,0 +1,185 @@
+# music_cache.py
+# 歌曲 MP3 的磁盘缓存，以网易云歌曲 id 为键。index.json 记录每首歌的大小和最近使用时间，
+# 以及"点歌关键字 -> 歌曲 id"的对应关系，命中时连搜索都不用发，完全不走网络。
+# 总大小超过上限时按最近最少使用淘汰；索引落盘，音乐服务重启后仍然有效。
+# 命中只更新内存里的使用时间，索引在歌曲入库、淘汰或 flush() 时才写盘，避免每次点歌都写一次 SD 卡。
+import json
+import os
+import tempfile
+import threading
+import time
+
+
+class SongCacheWriter:
+    """边下载边写入缓存的临时文件，下载完整后 commit 才会进入索引"""
+    def __init__(self, cache, song_id, expected_size=None):
+        self.cache = cache
+        self.song_id = str(song_id)
+        self.expected_size = expected_size
+        # 每个写入者用自己的临时文件：边下边播和队列预加载可能同时下载同一首歌
+        fd, self.tmp_path = tempfile.mkstemp(prefix=self.song_id + ".", suffix=".mp3.part", dir=cache.cache_dir)
+        self._file = os.fdopen(fd, "wb")
+        self.size = 0
+
+    def write(self, data):
+        self._file.write(data)
+        self.size += len(data)
+
+    def commit(self, name):
+        self._file.close()
+        if self.size == 0 or (self.expected_size and self.size != self.expected_size):
+            self.abort()
+            return False
+        return self.cache._commit(self.song_id, name, self.tmp_path, self.size)
+
+    def abort(self):
+        if not self._file.closed:
+            self._file.close()
+        try:
+            os.remove(self.tmp_path)
+        except OSError:
+            pass
+        self.cache._forget_pending(self.song_id)
+
+
+class SongCache:
+    def __init__(self, cache_dir="music_cache", max_bytes=500 * 1024 * 1024):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.index_path = os.path.join(cache_dir, "index.json")
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        os.makedirs(cache_dir, exist_ok=True)
+        for name in os.listdir(cache_dir): # 上次退出时没下载完的临时文件
+            if name.endswith(".part"):
+                try: os.remove(os.path.join(cache_dir, name))
+                except OSError: pass
+        self._songs, self._queries = self._load_index()
+        self._pending_queries = {} # 关键字 -> 还没下载完的歌曲 id，只在内存里，入库时转入 _queries
+
+    @staticmethod
+    def normalize_query(query):
+        return " ".join(query.lower().split())
+
+    def _load_index(self):
+        try:
+            with open(self.index_path, "r", encoding="utf-8") as f:
+                index = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}, {}
+        # 丢掉文件已经不存在的条目
+        songs = {k: v for k, v in index.get("songs", {}).items() if os.path.exists(self._path(k))}
+        queries = {q: i for q, i in index.get("queries", {}).items() if i in songs}
+        return songs, queries
+
+    def _save_index(self):
+        tmp = self.index_path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"songs": self._songs, "queries": self._queries}, f, ensure_ascii=False)
+        os.replace(tmp, self.index_path)
+
+    def _path(self, song_id):
+        return os.path.join(self.cache_dir, f"{song_id}.mp3")
+
+    def lookup_query(self, query):
+        """按点歌关键字查缓存，返回 (歌曲id, 歌名) 或 None；不计入命中统计"""
+        with self._lock:
+            song_id = self._queries.get(self.normalize_query(query))
+            if song_id is None or song_id not in self._songs:
+                return None
+            return song_id, self._songs[song_id]["name"]
+
+    def remember_query(self, query, song_id):
+        """记录关键字对应的歌曲；边下边播时歌曲稍后才下载完，先记在内存里，入库时再写进索引"""
+        query, song_id = self.normalize_query(query), str(song_id)
+        with self._lock:
+            if song_id not in self._songs:
+                self._pending_queries[query] = song_id
+            elif self._queries.get(query) != song_id:
+                self._queries[query] = song_id
+                self._save_index()
+
+    def _forget_pending(self, song_id):
+        """下载放弃时丢掉等这首歌入库的关键字"""
+        with self._lock:
+            self._pending_queries = {q: i for q, i in self._pending_queries.items() if i != song_id}
+
+    def contains(self, song_id):
+        return str(song_id) in self._songs
+
+    def get(self, song_id):
+        """命中时返回缓存文件路径并刷新使用时间，未命中返回 None"""
+        song_id = str(song_id)
+        with self._lock:
+            entry = self._songs.get(song_id)
+            path = self._path(song_id)
+            if entry is None or not os.path.exists(path):
+                self._songs.pop(song_id, None)
+                self.misses += 1
+                return None
+            self.hits += 1
+            entry["last_used"] = time.time() # 下次写入索引时一起保存
+            return path
+
+    def flush(self):
+        """把内存中的使用时间写回索引（退出时调用）"""
+        with self._lock:
+            self._save_index()
+
+    def begin(self, song_id, expected_size=None):
+        return SongCacheWriter(self, song_id, expected_size)
+
+    def put(self, song_id, name, data):
+        if not data or len(data) > self.max_bytes:
+            return False
+        writer = self.begin(song_id, len(data))
+        writer.write(data)
+        return writer.commit(name)
+
+    def _commit(self, song_id, name, tmp_path, size):
+        if size > self.max_bytes:
+            os.remove(tmp_path)
+            self._forget_pending(song_id)
+            return False
+        with self._lock:
+            os.replace(tmp_path, self._path(song_id))
+            self._songs[song_id] = {"name": name, "size": size, "last_used": time.time()}
+            for query in [q for q, i in self._pending_queries.items() if i == song_id]:
+                self._queries[query] = self._pending_queries.pop(query)
+            self._evict(keep=song_id)
+            self._save_index()
+        return True
+
+    def _evict(self, keep=None):
+        total = sum(e["size"] for e in self._songs.values())
+        evicted = set()
+        for song_id, entry in sorted(self._songs.items(), key=lambda kv: kv[1]["last_used"]):
+            if total <= self.max_bytes:
+                break
+            if song_id == keep:
+                continue
+            try:
+                os.remove(self._path(song_id))
+            except OSError: # Windows 下正在播放的文件删不掉，下次再淘汰
+                continue
+            total -= entry["size"]
+            del self._songs[song_id]
+            evicted.add(song_id)
+            self.evictions += 1
+        self._queries = {q: i for q, i in self._queries.items() if i not in evicted}
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "songs": len(self._songs),
+            "queries": len(self._queries),
+            "pending_queries": len(self._pending_queries),
+            "bytes": sum(e["size"] for e in self._songs.values()),
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+        }
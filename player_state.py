@@ -0,0 +1,141 @@
+# player_state.py
+# 音乐服务把播放状态（playing/paused/stopped、当前歌曲、切歌/播完事件）推送给语音进程，
+# 语音进程本地保留一份镜像，查询状态不用再走一次 MCP 工具调用。
+# 通过本机回环 UDP 发送 JSON 报文：单向、不需要连接，语音进程没启动或重启时发送方也不受影响；
+# 发送方定期重发当前状态（心跳），丢包或接收方后启动都能在一个心跳内对齐，超过几个心跳没收到就视为状态未知。
+import json
+import os
+import socket
+import threading
+import time
+
+PLAYER_STATE_HOST = "127.0.0.1"
+PLAYER_STATE_PORT = int(os.environ.get("PLAYER_STATE_PORT", "47631")) # 0 表示不推送
+PLAYER_STATE_HEARTBEAT = float(os.environ.get("PLAYER_STATE_HEARTBEAT", "2"))
+
+
+class PlayerStatePublisher:
+    """音乐服务端：状态变化时 publish，定期调用 heartbeat。发送失败静默忽略（stdio 服务不能往 stdout 打印）"""
+    def __init__(self, port=PLAYER_STATE_PORT, heartbeat=PLAYER_STATE_HEARTBEAT):
+        self.addr = (PLAYER_STATE_HOST, port)
+        self.heartbeat_interval = heartbeat
+        self.enabled = port > 0
+        self._sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM) if self.enabled else None
+        self._lock = threading.Lock()
+        self._seq = 0
+        self._last = None # 上次发送的 (status, track)
+        self._last_sent = 0.0
+        self.sent = 0
+
+    def publish(self, status, track=None, event=None, force=False):
+        """状态或歌曲有变化（或带事件、force）时发送，返回是否发送"""
+        with self._lock:
+            if not self.enabled:
+                return False
+            if not force and event is None and self._last == (status, track):
+                return False
+            self._last = (status, track)
+            return self._send(status, track, event)
+
+    def heartbeat(self):
+        with self._lock:
+            if not self.enabled or self._last is None or time.time() - self._last_sent < self.heartbeat_interval:
+                return False
+            return self._send(*self._last, None)
+
+    def _send(self, status, track, event):
+        self._seq += 1
+        message = {"pid": os.getpid(), "seq": self._seq, "status": status, "track": track,
+                   "event": event, "ts": time.time()}
+        self._last_sent = time.time()
+        try:
+            self._sock.sendto(json.dumps(message, ensure_ascii=False).encode("utf-8"), self.addr)
+        except OSError:
+            return False
+        self.sent += 1
+        return True
+
+
+class PlayerStateMirror:
+    """
+    语音进程端：后台线程接收状态报文。status() 返回镜像中的状态，
+    没收到过或已超过 stale_after 秒没有更新时返回 None，调用方应改为直接查询音乐服务。
+    """
+    def __init__(self, port=PLAYER_STATE_PORT, stale_after=PLAYER_STATE_HEARTBEAT * 3):
+        self.port = port
+        self.stale_after = stale_after
+        self._lock = threading.Lock()
+        self._status = None
+        self._track = None
+        self._updated = 0.0
+        self._source = None # (pid, seq)：忽略乱序的旧报文，发送方重启后 pid 变化时重新开始
+        self.received = 0
+        self._sock = None
+        self._thread = None
+
+    def start(self):
+        """绑定端口并启动接收线程；端口被占用等情况返回 False，镜像不可用"""
+        if self.port <= 0:
+            return False
+        try:
+            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            sock.bind((PLAYER_STATE_HOST, self.port))
+        except OSError as e:
+            print(f"播放状态镜像不可用，端口 {self.port}: {e}")
+            return False
+        self._sock = sock
+        self._thread = threading.Thread(target=self._receive_loop, name="player-state", daemon=True)
+        self._thread.start()
+        return True
+
+    def status(self):
+        with self._lock:
+            if self._status is None or time.time() - self._updated > self.stale_after:
+                return None
+            return self._status
+
+    @property
+    def track(self):
+        with self._lock:
+            return self._track
+
+    def set_local(self, status, expected):
+        """
+        本进程刚发出暂停/恢复指令时先乐观更新（仅当镜像当前为 expected），
+        音乐服务的推送或心跳随后会确认或纠正
+        """
+        with self._lock:
+            if self._status == expected:
+                self._status = status
+
+    def stats(self):
+        with self._lock:
+            age = time.time() - self._updated if self._updated else None
+            return {"status": self._status, "track": self._track, "received": self.received,
+                    "age_s": round(age, 1) if age is not None else None}
+
+    def _receive_loop(self):
+        while True:
+            try:
+                data, _ = self._sock.recvfrom(4096)
+                message = json.loads(data.decode("utf-8"))
+            except (OSError, ValueError):
+                if self._sock.fileno() < 0: # 已关闭
+                    return
+                continue
+            self._apply(message)
+
+    def _apply(self, message):
+        source = (message.get("pid"), message.get("seq", 0))
+        with self._lock:
+            if self._source and source[0] == self._source[0] and source[1] <= self._source[1]:
+                return
+            self._source = source
+            self._status = message.get("status")
+            self._track = message.get("track")
+            self._updated = time.time()
+            self.received += 1
+
+    def close(self):
+        if self._sock is not None:
+            self._sock.close()
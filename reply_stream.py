@@ -0,0 +1,91 @@
+# reply_stream.py
+# 把 qwen_agent 流式返回的消息列表转成可以依次送去合成的句子。
+# bot.run 每次返回本轮到目前为止生成的全部消息，最后一条还在增长；工具调用前后是不同的消息。
+# 工具调用消息在生成过程中先以 "<tool_call>..." 文本出现，解析完成后才变成空内容加 function_call，
+# 所以内容不保证只在末尾追加：这里只把确定不属于工具调用标记的部分送去朗读。
+
+TOOL_CALL_TAG = "<tool_call>"
+
+
+def speakable_text(content):
+    """去掉工具调用标记及其之后的内容；末尾可能是半截标记（如 "<tool"）的部分先不算"""
+    if not isinstance(content, str):
+        return ""
+    cut = content.find(TOOL_CALL_TAG[:-1]) # 同时覆盖 "<tool_call>" 和 "<tool_call"
+    if cut >= 0:
+        return content[:cut]
+    for n in range(min(len(TOOL_CALL_TAG) - 1, len(content)), 0, -1):
+        if content.endswith(TOOL_CALL_TAG[:n]):
+            return content[:-n]
+    return content
+
+
+class ReplySegmenter:
+    """
+    update(response) 传入 bot.run 的一次返回，得到 (新增的可读文本, 可以送去合成的完整句子列表)；
+    finish() 返回最后一条消息剩余没送出的文本。text 为当前这条助手消息的可读文本（写入历史用）。
+    """
+    def __init__(self, delimiters="。！？，"):
+        self.delimiters = delimiters
+        self.index = None # 当前助手消息在 response 中的位置
+        self.text = ""
+        self.consumed = 0 # text 中已送去合成的字符位置
+
+    def update(self, response):
+        if not response or not isinstance(response, list):
+            return "", []
+        segments = []
+        last = len(response) - 1
+        if self.index is not None and last != self.index:
+            # 开始了新的一条消息：上一条以它的最终内容为准送完剩余部分，再从头切句
+            previous = self._speakable(response[self.index]) if self.index < len(response) else None
+            if previous is not None:
+                self._sync(previous)
+                segments += self._advance(previous, final=True)
+            self.index, self.text, self.consumed = None, "", 0
+        text = self._speakable(response[last])
+        if text is None:
+            if last == self.index: # 这条消息最终解析成了工具调用，不再朗读
+                self.index, self.text, self.consumed = None, "", 0
+            return "", segments
+        self.index = last
+        self._sync(text)
+        new_text = text[len(self.text):]
+        segments += self._advance(text)
+        return new_text, segments
+
+    def finish(self):
+        return self._advance(self.text, final=True)
+
+    def _sync(self, text):
+        """内容被改写（不是在末尾追加）时，已经送出的部分不再重复，从公共前缀处接着切"""
+        if text.startswith(self.text):
+            return
+        common = 0
+        while common < min(len(text), len(self.text)) and text[common] == self.text[common]:
+            common += 1
+        self.text = text[:common]
+        self.consumed = min(self.consumed, common)
+
+    @staticmethod
+    def _speakable(message):
+        """助手的普通回复返回可读文本；工具调用、工具结果等其他消息返回 None"""
+        if not isinstance(message, dict) or message.get("role") != "assistant" or message.get("function_call"):
+            return None
+        return speakable_text(message.get("content", ""))
+
+    def _advance(self, text, final=False):
+        self.text = text
+        if final:
+            cut = len(text) - 1
+        else:
+            cut = -1
+            for i in range(len(text) - 1, self.consumed - 1, -1):
+                if text[i] in self.delimiters:
+                    cut = i
+                    break
+        if cut < self.consumed:
+            return []
+        segment = text[self.consumed:cut + 1].strip()
+        self.consumed = cut + 1
+        return [segment] if segment else []
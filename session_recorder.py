@@ -0,0 +1,199 @@
+# session_recorder.py
+# 会话录制：把一次运行中的麦克风输入、输出引擎的混音（即 TTS 播放的内容）和事件时间线录进一个 zip：
+#   mic.wav       麦克风输入，16kHz 16bit 单声道
+#   tts.wav       输出引擎的混音，重采样到 16kHz；与 mic.wav 同时开始、连续录制（没声音时是静音），两者按时间对齐
+#   events.jsonl  每行一个事件：t_ms 为距录制开始的毫秒数，mic_ms 为事件发生时 mic.wav 录到的位置，
+#                 name 为事件名（监听开始/结束、识别出的整句、送去合成的文本、每轮打点和结算）
+#   meta.json     录制参数
+# 录制中的文件先写在 <zip 路径>.parts 目录，close() 时打包成 zip（deflate 压缩，静音段几乎不占空间）。
+# 现场录下的会话可以用 MIC_SOURCE=wav:session.zip 代替麦克风回放（1 倍速或尽快，见 audio_capture.py），
+# 用来复现问题，或作为回归和性能测试的素材。
+#
+# 查看录制内容: python session_recorder.py session-20260101-120000.zip [--events 50]
+import argparse
+import json
+import os
+import queue
+import shutil
+import threading
+import time
+import wave
+import zipfile
+
+import numpy as np
+
+from audio_output import _LinearResampler
+
+SESSION_RATE = 16000
+SESSION_MEMBERS = ("mic.wav", "tts.wav", "events.jsonl", "meta.json")
+
+
+class SessionRecorder:
+    """
+    attach(capture, engine) 开始录制麦克风和输出，event(名称, **字段) 记录事件，close() 打包并返回 zip 路径。
+    采集和输出回调里只把数据放进队列，写文件在单独的线程里做。录满 max_seconds 后停止录音频，事件照常记录。
+    """
+    def __init__(self, path, max_seconds=None, meta=None):
+        self.path = path
+        self.max_samples = int(max_seconds * SESSION_RATE) if max_seconds else None
+        self.meta = dict(meta or {})
+        self.parts_dir = path + ".parts"
+        os.makedirs(self.parts_dir, exist_ok=True)
+        self._mic = self._open_wav("mic.wav")
+        self._out = self._open_wav("tts.wav")
+        self._events = open(os.path.join(self.parts_dir, "events.jsonl"), "w", encoding="utf-8")
+        self._queue = queue.Queue()
+        self._capture = None
+        self._engine = None
+        self._resampler = None
+        self._mic_offset = 0 # attach 时采集已经写过的采样点数
+        self.started = time.time()
+        self.mic_samples = 0
+        self.out_samples = 0
+        self.event_count = 0
+        self.truncated = False
+        self._closed = False
+        self._writer = threading.Thread(target=self._write_loop, name="session-recorder", daemon=True)
+        self._writer.start()
+
+    def _open_wav(self, name):
+        writer = wave.open(os.path.join(self.parts_dir, name), "wb")
+        writer.setnchannels(1)
+        writer.setsampwidth(2)
+        writer.setframerate(SESSION_RATE)
+        return writer
+
+    def attach(self, capture, engine):
+        """capture 的采样率需为 SESSION_RATE（audio_capture 固定 16kHz），输出按 engine.rate 重采样"""
+        self._capture = capture
+        self._engine = engine
+        self._resampler = _LinearResampler(engine.rate, SESSION_RATE)
+        self._mic_offset = capture.total_samples
+        self.started = time.time()
+        capture.tap = self._on_mic
+        engine.tap = self._on_output
+        engine.start() # 输出引擎平时第一次说话时才打开，这里提前打开，tts.wav 从录制开始就和 mic.wav 对齐
+
+    def _on_mic(self, data):
+        self._queue.put(("mic", data))
+
+    def _on_output(self, pcm):
+        self._queue.put(("out", pcm))
+
+    def event(self, name, ts=None, **fields):
+        """记录一个事件，可在任意线程调用；ts 为事件发生的时间（默认现在）"""
+        ts = time.time() if ts is None else ts
+        record = {"t_ms": round((ts - self.started) * 1000), "name": name}
+        if self._capture is not None:
+            record["mic_ms"] = round((self._capture.total_samples - self._mic_offset) * 1000 / self._capture.rate)
+        record.update(fields)
+        self._queue.put(("event", record))
+
+    def _write_loop(self):
+        while True:
+            kind, data = self._queue.get()
+            if kind is None:
+                return
+            try:
+                if kind == "event":
+                    self._events.write(json.dumps(data, ensure_ascii=False) + "\n")
+                    self.event_count += 1
+                elif self.truncated:
+                    continue
+                elif kind == "mic":
+                    self._mic.writeframes(data)
+                    self.mic_samples += len(data) // 2
+                else:
+                    x = np.frombuffer(data, dtype=np.int16).astype(np.float32) / 32768.0
+                    pcm = (np.clip(self._resampler.process(x), -1.0, 1.0) * 32767.0).astype(np.int16)
+                    self._out.writeframes(pcm.tobytes())
+                    self.out_samples += pcm.size
+                if self.max_samples and self.mic_samples >= self.max_samples and not self.truncated:
+                    self.truncated = True
+                    print(f"会话录制已达到最长时长 {self.max_samples / SESSION_RATE:.0f} 秒，停止录制音频")
+            except Exception as e:
+                print(f"会话录制写入失败: {e}")
+
+    def close(self):
+        """停止录制并打包成 zip，返回 zip 路径"""
+        if self._closed:
+            return self.path
+        self._closed = True
+        if self._capture is not None:
+            self._capture.tap = None
+        if self._engine is not None:
+            self._engine.tap = None
+        self._queue.put((None, None))
+        self._writer.join(10)
+        self._mic.close()
+        self._out.close()
+        self._events.close()
+        meta = dict(self.meta, version=1, started=self.started, rate=SESSION_RATE,
+                    mic_seconds=round(self.mic_samples / SESSION_RATE, 1),
+                    tts_seconds=round(self.out_samples / SESSION_RATE, 1),
+                    events=self.event_count, truncated=self.truncated)
+        with open(os.path.join(self.parts_dir, "meta.json"), "w", encoding="utf-8") as f:
+            json.dump(meta, f, ensure_ascii=False, indent=2)
+        with zipfile.ZipFile(self.path, "w", compression=zipfile.ZIP_DEFLATED) as z:
+            for name in SESSION_MEMBERS:
+                z.write(os.path.join(self.parts_dir, name), name)
+        shutil.rmtree(self.parts_dir, ignore_errors=True)
+        return self.path
+
+
+def read_session(path):
+    """返回 (meta, events)"""
+    with zipfile.ZipFile(path) as z:
+        meta = json.loads(z.read("meta.json").decode("utf-8"))
+        events = [json.loads(line) for line in z.read("events.jsonl").decode("utf-8").splitlines() if line.strip()]
+    return meta, events
+
+
+def listen_segments(path, rate=SESSION_RATE):
+    """
+    录制时各段麦克风读取的 (起点, 终点) 采样点位置，按时间顺序。第一段是从录制开始到第一个监听器开始
+    （启动时标定噪声底读的那一秒），之后每个 listen_start/listen_stop 对应一段。
+    """
+    _, events = read_session(path)
+    segments, start = [], None
+    for e in events:
+        if "mic_ms" not in e:
+            continue
+        position = int(e["mic_ms"] * rate / 1000)
+        if e["name"] == "listen_start":
+            if not segments and start is None:
+                segments.append((0, position))
+            start = position
+        elif e["name"] == "listen_stop" and start is not None:
+            segments.append((start, position))
+            start = None
+    return segments
+
+
+def main():
+    parser = argparse.ArgumentParser(description="查看会话录制文件的内容")
+    parser.add_argument("path")
+    parser.add_argument("--events", type=int, default=50, help="最多列出多少个事件，0 表示全部")
+    args = parser.parse_args()
+
+    meta, events = read_session(args.path)
+    size = os.path.getsize(args.path)
+    started = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(meta["started"]))
+    print(f"{args.path}（{size / 1024:.0f} KB）开始于 {started}")
+    print(f"  麦克风 {meta['mic_seconds']} 秒，输出 {meta['tts_seconds']} 秒，事件 {meta['events']} 个"
+          + ("，音频因超过最长时长被截断" if meta.get("truncated") else ""))
+    extra = {k: v for k, v in meta.items()
+             if k not in ("version", "started", "rate", "mic_seconds", "tts_seconds", "events", "truncated")}
+    if extra:
+        print(f"  {json.dumps(extra, ensure_ascii=False)}")
+    shown = events if args.events <= 0 else events[:args.events]
+    for e in shown:
+        fields = {k: v for k, v in e.items() if k not in ("t_ms", "mic_ms", "name")}
+        mic = f"mic {e['mic_ms'] / 1000:8.2f}s" if "mic_ms" in e else " " * 14
+        print(f"  {e['t_ms'] / 1000:8.2f}s  {mic}  {e['name']:<16} {json.dumps(fields, ensure_ascii=False) if fields else ''}")
+    if len(shown) < len(events):
+        print(f"  ...（共 {len(events)} 个事件）")
+
+
+if __name__ == "__main__":
+    main()
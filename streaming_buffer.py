@@ -0,0 +1,128 @@
+# streaming_buffer.py
+# 音乐服务边下边播用的有界缓冲区：下载线程写入，pygame mixer 把它当文件对象读。
+import io
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class StreamingAudioBuffer(io.RawIOBase):
+    """
+    下载线程写入、pygame mixer 读取的有界缓冲区。
+
+    读取位置之前只保留 keep_behind 字节供解码器小范围回退，读取位置之后最多缓存 max_ahead 字节，
+    写满时下载线程阻塞（背压）。总长度取自 Content-Length，解码器查询文件大小时不必等下载完成；
+    文件末尾的一小段可以用 set_tail 预先放入，解码器加载时读标签不用等整首下载完。
+    """
+    def __init__(self, total_length=None, max_ahead=512 * 1024, keep_behind=512 * 1024, read_timeout=10):
+        super().__init__()
+        self.total_length = total_length
+        self.max_ahead = max_ahead
+        self.keep_behind = keep_behind
+        self.read_timeout = read_timeout
+        self._cond = threading.Condition()
+        self._buf = bytearray()
+        self._base = 0 # _buf[0] 在整个文件中的偏移
+        self._pos = 0 # 读取位置
+        self._eof = False
+        self._aborted = False
+        self._tail = b""
+        self.peak_bytes = 0
+
+    def set_tail(self, data):
+        """放入文件最后 len(data) 字节（需已知总长度）"""
+        with self._cond:
+            self._tail = data
+
+    @property
+    def received(self):
+        return self._base + len(self._buf)
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def feed(self, data):
+        """下载线程调用；返回 False 表示缓冲区已被关闭，应停止下载"""
+        with self._cond:
+            while not self._aborted and self.received - self._pos >= self.max_ahead:
+                self._cond.wait(1.0)
+            if self._aborted:
+                return False
+            self._buf += data
+            self.peak_bytes = max(self.peak_bytes, len(self._buf))
+            self._cond.notify_all()
+            return True
+
+    def finish(self):
+        with self._cond:
+            self._eof = True
+            if self.total_length is None:
+                self.total_length = self.received
+            self._cond.notify_all()
+
+    def wait_for(self, nbytes, timeout):
+        """等待至少缓冲 nbytes（或下载结束），返回是否有足够数据开始播放"""
+        with self._cond:
+            self._cond.wait_for(lambda: self.received >= nbytes or self._eof or self._aborted, timeout)
+            return not self._aborted and (self.received >= nbytes or (self._eof and self.received > 0))
+
+    def readinto(self, b):
+        with self._cond:
+            if self._pos < self._base:
+                raise OSError("请求的数据已从流式缓冲区中丢弃")
+            tail_start = self.total_length - len(self._tail) if self._tail else None
+            if tail_start is not None and self._pos >= tail_start and self._pos >= self.received:
+                start = self._pos - tail_start
+                n = min(len(b), len(self._tail) - start)
+                if n <= 0:
+                    return 0
+                b[:n] = self._tail[start:start + n]
+                self._pos += n # 读末尾不移动窗口，也不丢弃已缓冲的数据
+                return n
+            if self._pos - self.received >= self.max_ahead and not self._eof:
+                return 0 # 在背压下永远等不到的位置，按文件结束处理
+            if not self._cond.wait_for(lambda: self.received > self._pos or self._eof or self._aborted, self.read_timeout):
+                logger.warning("流式缓冲区等待数据超时，按文件结束处理")
+                return 0
+            start = self._pos - self._base
+            n = min(len(b), len(self._buf) - start)
+            if n <= 0:
+                return 0
+            b[:n] = self._buf[start:start + n]
+            self._pos += n
+            # 丢掉远在读取位置之前的数据，保持内存有界
+            drop = self._pos - self.keep_behind - self._base
+            if drop > 0:
+                del self._buf[:drop]
+                self._base += drop
+            self._cond.notify_all()
+            return n
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        with self._cond:
+            if whence == io.SEEK_SET:
+                target = offset
+            elif whence == io.SEEK_CUR:
+                target = self._pos + offset
+            else:
+                if self.total_length is None:
+                    raise OSError("未知总长度，无法从末尾定位")
+                target = self.total_length + offset
+            if target < self._base:
+                raise OSError("请求的位置已从流式缓冲区中丢弃")
+            self._pos = max(0, target)
+            self._cond.notify_all()
+            return self._pos
+
+    def tell(self):
+        return self._pos
+
+    def close(self):
+        with self._cond:
+            self._aborted = True
+            self._cond.notify_all()
+        super().close()
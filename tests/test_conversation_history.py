@@ -0,0 +1,110 @@
+import os
+import sys
+import threading
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import conversation_history
+from conversation_history import ConversationHistory
+
+
+@pytest.fixture(autouse=True)
+def char_tokens(monkeypatch):
+    """按字数计 token，结果不依赖是否装了 qwen 分词器"""
+    monkeypatch.setattr(conversation_history, "count_tokens", lambda text: len(text or ""))
+
+
+def _turn(history, user, reply="好的"):
+    messages = history.begin_turn(user)
+    history.end_turn(reply)
+    return messages
+
+
+def _wait(predicate, timeout=2.0):
+    deadline = time.time() + timeout
+    while not predicate():
+        assert time.time() < deadline, "等待超时"
+        time.sleep(0.01)
+
+
+def test_only_keep_turns_are_sent_verbatim():
+    history = ConversationHistory(keep_turns=2, token_budget=10000)
+    for i in range(5):
+        _turn(history, f"问题{i}")
+    messages = history.begin_turn("问题5")
+    users = [m["content"] for m in messages if m["role"] == "user"]
+    assert users == ["问题3", "问题4", "问题5"]
+    assert len(history.pending) == 3
+    # 没有摘要器时待摘要的轮次在预算内以原文放进系统消息
+    assert messages[0]["role"] == "system" and "问题2" in messages[0]["content"]
+
+
+def test_prompt_stays_within_token_budget():
+    history = ConversationHistory(keep_turns=50, token_budget=100)
+    for i in range(30):
+        messages = _turn(history, f"第{i}个问题" + "啊" * 10, "回答" + "嗯" * 10)
+        assert sum(len(m["content"]) for m in messages) <= 100
+    assert history.stats()["max_prompt_tokens"] <= 100
+
+
+def test_old_turns_roll_into_the_summary():
+    calls = []
+
+    def summarizer(previous, text):
+        calls.append((previous, text))
+        return f"摘要{len(calls)}"
+
+    history = ConversationHistory(keep_turns=1, token_budget=10000, summarizer=summarizer)
+    _turn(history, "问题0")
+    _turn(history, "问题1")
+    _turn(history, "问题2")
+    _wait(lambda: len(calls) >= 1 and not history._summarizing)
+    _turn(history, "问题3")
+    _wait(lambda: len(calls) >= 2 and not history._summarizing)
+    assert calls[0][0] == "" and "问题0" in calls[0][1]
+    assert calls[1] == ("摘要1", "用户: 问题1\n助手: 好的") # 在上一份摘要的基础上滚动
+    assert history.summary == "摘要2" and history.pending == []
+    messages = history.begin_turn("问题4")
+    system = messages[0]["content"]
+    assert system.startswith("之前对话的摘要：摘要2")
+    assert "问题0" not in system and "问题1" not in system
+    assert [m["content"] for m in messages if m["role"] == "user"] == ["问题3", "问题4"]
+
+
+def test_failed_summaries_keep_pending_bounded():
+    history = ConversationHistory(keep_turns=1, token_budget=10000,
+                                  summarizer=lambda previous, text: None)
+    for i in range(10):
+        _turn(history, f"问题{i}")
+        _wait(lambda: not history._summarizing)
+    assert len(history.pending) <= 2 + 1
+
+
+def test_idle_reset_discards_history_and_late_summary():
+    release = threading.Event()
+
+    def slow_summarizer(previous, text):
+        release.wait(2)
+        return "过时的摘要"
+
+    history = ConversationHistory(keep_turns=1, token_budget=10000, idle_reset_seconds=60,
+                                  summarizer=slow_summarizer)
+    _turn(history, "问题0")
+    _turn(history, "问题1") # 问题0 移入待摘要，后台摘要被卡住
+    history.last_active -= 120
+    messages = history.begin_turn("新话题")
+    assert messages == [{"role": "user", "content": "新话题"}]
+    release.set()
+    _wait(lambda: not history._summarizing)
+    assert history.summary == ""
+
+
+def test_turn_without_reply_is_dropped():
+    history = ConversationHistory()
+    history.begin_turn("你好")
+    history.end_turn("")
+    assert history.turns == []
+    assert history.begin_turn("再说一次") == [{"role": "user", "content": "再说一次"}]
@@ -0,0 +1,82 @@
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from music_cache import SongCache
+
+
+def _put(cache, song_id, size):
+    assert cache.put(song_id, f"song{song_id}", b"x" * size)
+    time.sleep(0.01) # 让 last_used 有先后
+
+
+def test_least_recently_used_song_is_evicted(tmp_path):
+    cache = SongCache(str(tmp_path), max_bytes=300)
+    _put(cache, 1, 100)
+    _put(cache, 2, 100)
+    _put(cache, 3, 100)
+    assert cache.get(1) # 1 最近用过，2 变成最久未用
+    time.sleep(0.01)
+    _put(cache, 4, 100)
+    assert cache.contains(1) and cache.contains(3) and cache.contains(4)
+    assert not cache.contains(2)
+    assert not os.path.exists(os.path.join(str(tmp_path), "2.mp3"))
+    assert cache.stats()["evictions"] == 1
+
+
+def test_queries_of_evicted_songs_are_dropped(tmp_path):
+    cache = SongCache(str(tmp_path), max_bytes=200)
+    _put(cache, 1, 100)
+    cache.remember_query("晴天", 1)
+    _put(cache, 2, 100)
+    _put(cache, 3, 100)
+    assert cache.lookup_query("晴天") is None
+    assert cache.stats()["queries"] == 0
+
+
+def test_index_survives_a_restart(tmp_path):
+    cache = SongCache(str(tmp_path), max_bytes=1000)
+    _put(cache, 1, 100)
+    _put(cache, 2, 100)
+    cache.remember_query("  Jay  晴天 ", 1)
+    cache.get(1)
+    cache.flush()
+    os.remove(os.path.join(str(tmp_path), "2.mp3")) # 文件丢了的条目重启时丢弃
+
+    reloaded = SongCache(str(tmp_path), max_bytes=1000)
+    assert reloaded.lookup_query("jay 晴天") == ("1", "song1")
+    assert reloaded.get(1) == os.path.join(str(tmp_path), "1.mp3")
+    assert not reloaded.contains(2)
+
+
+def test_pending_query_is_saved_only_once_the_song_is_cached(tmp_path):
+    cache = SongCache(str(tmp_path), max_bytes=1000)
+    cache.remember_query("稻香", 7)
+    writer = cache.begin(7, expected_size=3)
+    assert cache.lookup_query("稻香") is None
+    assert not os.path.exists(os.path.join(str(tmp_path), "index.json")) # 没下载完的映射不落盘
+    writer.write(b"abc")
+    assert writer.commit("稻香")
+    assert cache.lookup_query("稻香") == ("7", "稻香")
+    assert SongCache(str(tmp_path)).lookup_query("稻香") == ("7", "稻香")
+
+
+def test_aborted_download_forgets_its_query(tmp_path):
+    cache = SongCache(str(tmp_path), max_bytes=1000)
+    cache.remember_query("七里香", 8)
+    writer = cache.begin(8)
+    writer.write(b"abc")
+    writer.abort()
+    assert cache.stats()["pending_queries"] == 0
+    assert not [n for n in os.listdir(str(tmp_path)) if n.endswith(".part")]
+
+
+def test_concurrent_writers_of_the_same_song_both_commit(tmp_path):
+    cache = SongCache(str(tmp_path), max_bytes=1000)
+    first, second = cache.begin(9, 3), cache.begin(9, 3)
+    first.write(b"abc")
+    second.write(b"abc")
+    assert first.commit("a") and second.commit("a")
+    assert cache.get(9)
@@ -0,0 +1,84 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from reply_stream import ReplySegmenter, speakable_text
+
+
+def _assistant(content, function_call=None):
+    message = {"role": "assistant", "content": content}
+    if function_call:
+        message["function_call"] = function_call
+    return message
+
+
+def _run(responses):
+    segmenter = ReplySegmenter()
+    printed, sent = "", []
+    for response in responses:
+        new_text, sentences = segmenter.update(response)
+        printed += new_text
+        sent += sentences
+    sent += segmenter.finish()
+    return segmenter, printed, sent
+
+
+def test_sentences_are_sent_as_they_complete():
+    segmenter = ReplySegmenter()
+    assert segmenter.update([_assistant("你好")]) == ("你好", [])
+    assert segmenter.update([_assistant("你好，今天")]) == ("，今天", ["你好，"])
+    assert segmenter.update([_assistant("你好，今天天气不错。明天")]) == ("天气不错。明天", ["今天天气不错。"])
+    assert segmenter.finish() == ["明天"]
+    assert segmenter.text == "你好，今天天气不错。明天"
+
+
+def test_reply_after_tool_call_is_spoken_from_its_start():
+    call = {"name": "weather", "arguments": '{"city": "北京"}'}
+    preamble = _assistant("好的，我查一下。")
+    tool_result = {"role": "function", "name": "weather", "content": "晴 20度"}
+    responses = [
+        [_assistant("好的，我查")],
+        [_assistant("好的，我查一下。")],
+        [preamble, _assistant("<tool_call")], # 解析前工具调用以文本形式出现
+        [preamble, _assistant('<tool_call>\n{"name": "weather", "arguments": {"city": "北')],
+        [preamble, _assistant("", call)], # 解析后内容被改写为空，带 function_call
+        [preamble, _assistant("", call), tool_result],
+        [preamble, _assistant("", call), tool_result, _assistant("北京今天晴，")],
+        [preamble, _assistant("", call), tool_result, _assistant("北京今天晴，气温二十度。")],
+    ]
+    segmenter, printed, sent = _run(responses)
+    assert sent == ["好的，", "我查一下。", "北京今天晴，", "气温二十度。"]
+    assert "tool_call" not in printed
+    assert segmenter.text == "北京今天晴，气温二十度。"
+
+
+def test_previous_message_is_flushed_with_its_final_content():
+    responses = [
+        [_assistant("让我想")],
+        [_assistant("让我想想"), _assistant("答案是")], # 上一条最后一次增长只出现在新消息到来时的列表里
+        [_assistant("让我想想"), _assistant("答案是四十二。")],
+    ]
+    _, _, sent = _run(responses)
+    assert sent == ["让我想想", "答案是四十二。"]
+
+
+def test_rewritten_content_restarts_from_common_prefix():
+    segmenter = ReplySegmenter()
+    segmenter.update([_assistant("第一句。第二")])
+    _, sentences = segmenter.update([_assistant("第一句。改写后的。")])
+    assert sentences == ["改写后的。"]
+
+
+def test_message_parsed_into_tool_call_is_not_flushed():
+    call = {"name": "stopplay", "arguments": "{}"}
+    _, printed, sent = _run([[_assistant("好的")], [_assistant("好的", call)]])
+    assert sent == []
+    assert printed == "好的"
+
+
+def test_speakable_text_holds_back_partial_tags():
+    assert speakable_text("好的。<tool_call>{}") == "好的。"
+    assert speakable_text("好的。<tool") == "好的。"
+    assert speakable_text("好的。<") == "好的。"
+    assert speakable_text("a<b") == "a<b"
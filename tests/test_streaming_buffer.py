@@ -0,0 +1,76 @@
+import io
+import os
+import sys
+import threading
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from streaming_buffer import StreamingAudioBuffer
+
+DATA = bytes(range(256)) * 64 # 16 KB
+
+
+def test_tail_is_served_before_the_download_reaches_it():
+    buffer = StreamingAudioBuffer(len(DATA), max_ahead=4096, keep_behind=4096, read_timeout=0.1)
+    buffer.set_tail(DATA[-512:])
+    buffer.feed(DATA[:1024])
+    buffer.seek(-128, io.SEEK_END) # 解码器加载时读标签
+    assert buffer.read(128) == DATA[-128:]
+    assert buffer.read(16) == b"" # 文件末尾
+    buffer.seek(0)
+    assert buffer.read(1024) == DATA[:1024] # 读末尾没有丢掉已缓冲的开头
+
+
+def test_feed_blocks_when_max_ahead_is_buffered():
+    buffer = StreamingAudioBuffer(len(DATA), max_ahead=2048, keep_behind=1024, read_timeout=1)
+    assert buffer.feed(DATA[:2048])
+    fed = threading.Event()
+
+    def download():
+        buffer.feed(DATA[2048:3072])
+        fed.set()
+
+    threading.Thread(target=download, daemon=True).start()
+    assert not fed.wait(0.2) # 背压：读取位置之前已缓冲 max_ahead 字节
+    assert buffer.read(1024) == DATA[:1024]
+    assert fed.wait(2)
+
+
+def test_memory_stays_bounded_and_discarded_data_cannot_be_reread():
+    buffer = StreamingAudioBuffer(len(DATA), max_ahead=2048, keep_behind=1024, read_timeout=1)
+    done = threading.Event()
+
+    def download():
+        for i in range(0, len(DATA), 512):
+            buffer.feed(DATA[i:i + 512])
+        buffer.finish()
+        done.set()
+
+    threading.Thread(target=download, daemon=True).start()
+    out = bytearray()
+    while True:
+        chunk = buffer.read(700)
+        if not chunk:
+            break
+        out += chunk
+    assert bytes(out) == DATA
+    assert done.wait(2)
+    assert buffer.peak_bytes <= 2048 + 1024 + 512
+    with pytest.raises(OSError):
+        buffer.seek(0)
+
+
+def test_position_backpressure_can_never_deliver_reads_as_eof():
+    buffer = StreamingAudioBuffer(len(DATA), max_ahead=2048, keep_behind=1024, read_timeout=5)
+    buffer.feed(DATA[:512])
+    buffer.seek(8192)
+    assert buffer.read(16) == b"" # 不阻塞等待
+
+
+def test_close_stops_the_download():
+    buffer = StreamingAudioBuffer(len(DATA), max_ahead=1024, read_timeout=1)
+    assert buffer.feed(DATA[:1024])
+    buffer.close()
+    assert not buffer.feed(DATA[1024:2048])
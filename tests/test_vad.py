@@ -0,0 +1,92 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+
+from vad import Endpointer, NoiseFloorVAD, SpeechGate
+
+
+def _frames(n):
+    return [bytes([i]) * 320 for i in range(n)]
+
+
+def test_gate_prebuffers_frames_before_speech_in_order():
+    gate = SpeechGate(None, pre_speech_frames=3, keepalive_ms=10000)
+    frames = _frames(6)
+    sent = []
+    for i, frame in enumerate(frames):
+        sent += gate.process(frame, speech=(i == 5))
+    assert sent == frames[2:6]
+    assert gate.bytes_suppressed == 2 * 320
+
+
+def test_gate_never_sends_frames_older_than_a_keepalive():
+    gate = SpeechGate(None, pre_speech_frames=3, keepalive_ms=500)
+    frames = _frames(7)
+    sent = []
+    for i, frame in enumerate(frames):
+        sent += gate.process(frame, speech=(i == 6))
+    # frames[4] 作为保活帧发出，此前缓存的 frames[1:4] 比它旧，不再补发
+    assert sent == [frames[4], frames[5], frames[6]]
+    assert gate.bytes_sent + gate.bytes_suppressed == 7 * 320
+
+
+def _run_endpointer(endpointer, pattern):
+    """pattern 中 1 为语音帧、0 为静音帧，返回 (做出判定的帧序号, 原因)"""
+    for i, speech in enumerate(pattern):
+        reason = endpointer.update(b"", speech=bool(speech))
+        if reason:
+            return i, reason
+    return None, None
+
+
+def test_endpointer_ends_after_trailing_silence():
+    endpointer = Endpointer(None, end_silence_ms=800)
+    index, reason = _run_endpointer(endpointer, [0, 0, 1, 1, 1, 1] + [0] * 20)
+    assert reason == "endpoint"
+    assert index == 5 + 8
+    assert endpointer.decision_latency_ms == 800
+
+
+def test_endpointer_needs_less_silence_after_asr_sentence_end():
+    endpointer = Endpointer(None, end_silence_ms=800, sentence_end_silence_ms=300)
+    _run_endpointer(endpointer, [1, 1, 1])
+    endpointer.on_sentence_end()
+    index, reason = _run_endpointer(endpointer, [0] * 20)
+    assert (index, reason) == (2, "endpoint")
+
+
+def test_endpointer_new_partial_result_cancels_sentence_end():
+    endpointer = Endpointer(None, end_silence_ms=800, sentence_end_silence_ms=300)
+    _run_endpointer(endpointer, [1, 1])
+    endpointer.on_sentence_end()
+    endpointer.on_speech_text()
+    index, reason = _run_endpointer(endpointer, [0] * 20)
+    assert (index, reason) == (7, "endpoint")
+
+
+def test_endpointer_single_speech_frame_does_not_start_speech():
+    endpointer = Endpointer(None, no_speech_timeout=1.0, speech_start_frames=2)
+    index, reason = _run_endpointer(endpointer, [0, 1, 0, 1, 0, 0, 0, 0, 0, 0, 0])
+    assert (index, reason) == (9, "no_speech")
+    assert not endpointer.speech_started
+
+
+def test_endpointer_max_duration_while_still_talking():
+    endpointer = Endpointer(None, max_duration=1.5)
+    index, reason = _run_endpointer(endpointer, [1] * 30)
+    assert (index, reason) == (14, "max_duration")
+    assert endpointer.update(b"", speech=True) == "max_duration" # 判定后保持不变
+
+
+def test_noise_floor_vad_calibrates_and_ignores_speech_for_adaptation():
+    vad = NoiseFloorVAD(factor=3.0, margin=60.0, min_threshold=100.0)
+    quiet = (np.ones(1600) * 50).astype(np.int16).tobytes()
+    loud = (np.ones(1600) * 3000).astype(np.int16).tobytes()
+    assert vad.calibrate([quiet] * 5) == 50
+    assert vad.threshold == 150
+    assert vad.is_speech(loud)
+    assert vad.noise_floor == 50
+    assert not vad.is_speech(quiet)
@@ -0,0 +1,99 @@
+# tool_cache.py
+# 幂等 MCP 工具调用的结果缓存。按工具名匹配 TTL 规则（fnmatch 通配），参数规范化后作为键，
+# 有副作用或结果随时变化的工具（播放器、时间）不缓存。
+import fnmatch
+import json
+import os
+import time
+
+from qwen_agent.agents import Assistant
+from ttl_cache import TTLCache
+
+# 按顺序匹配，第一条命中的规则生效；TTL 为 0 表示不缓存。可用环境变量 TOOL_CACHE_RULES（JSON 对象）覆盖
+DEFAULT_TOOL_CACHE_RULES = {
+    "music_player-*": 0, # 播放/暂停/状态查询都有副作用或实时状态
+    "time-*": 0,
+    "amap-maps-maps_weather": 30 * 60,
+    "amap-maps-maps_direction_*": 5 * 60, # 路线受实时路况影响
+    "amap-maps-*": 60 * 60, # 地理编码、POI 搜索等基本不变
+    "fetch-*": 10 * 60,
+}
+
+# 这些返回说明调用失败，不缓存
+_ERROR_PREFIXES = ("An error occurred when calling tool", "Tool ")
+
+
+def load_rules():
+    raw = os.environ.get("TOOL_CACHE_RULES")
+    if not raw:
+        return dict(DEFAULT_TOOL_CACHE_RULES)
+    try:
+        return {str(k): float(v) for k, v in json.loads(raw).items()}
+    except (ValueError, AttributeError) as e:
+        print(f"TOOL_CACHE_RULES 格式错误，使用默认规则: {e}")
+        return dict(DEFAULT_TOOL_CACHE_RULES)
+
+
+def _normalize_value(value):
+    if isinstance(value, str):
+        return " ".join(value.split())
+    if isinstance(value, dict):
+        return {k: _normalize_value(v) for k, v in value.items() if v is not None}
+    if isinstance(value, list):
+        return [_normalize_value(v) for v in value]
+    return value
+
+
+def normalize_args(tool_args):
+    """把工具参数（JSON 字符串或 dict）规范成稳定的键：键排序、去掉 None、压缩空白"""
+    if isinstance(tool_args, str):
+        try:
+            tool_args = json.loads(tool_args or "{}")
+        except json.JSONDecodeError:
+            return " ".join(tool_args.split())
+    return json.dumps(_normalize_value(tool_args), sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+
+
+class CachedToolAssistant(Assistant):
+    """在 Assistant._call_tool 外加一层 TTL 缓存，LLM 发起的工具调用和代码里直接调用的都会经过这里"""
+    def __init__(self, *args, tool_cache_rules=None, tool_cache_size=128, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.tool_cache_rules = load_rules() if tool_cache_rules is None else tool_cache_rules
+        self.tool_cache = TTLCache(maxsize=tool_cache_size, ttl=0, name="tools")
+        self.tool_cache_counts = {} # 工具名 -> [命中, 未命中]
+        self.tool_call_hook = None # hook(工具名, 开始时间, 结束时间, 是否命中缓存)，用于统计每次工具调用耗时
+
+    def tool_ttl(self, tool_name):
+        for pattern, ttl in self.tool_cache_rules.items():
+            if fnmatch.fnmatchcase(tool_name, pattern):
+                return ttl
+        return 0
+
+    def _call_tool(self, tool_name, tool_args='{}', **kwargs):
+        start = time.time()
+        cached = False
+        try:
+            ttl = self.tool_ttl(tool_name)
+            if ttl <= 0:
+                return super()._call_tool(tool_name, tool_args, **kwargs)
+            key = (tool_name, normalize_args(tool_args))
+            counts = self.tool_cache_counts.setdefault(tool_name, [0, 0])
+            result = self.tool_cache.get(key)
+            if result is not None:
+                counts[0] += 1
+                cached = True
+                print(f"[工具缓存] 命中 {tool_name}，该工具命中率 {counts[0] / sum(counts):.0%}")
+                return result
+            counts[1] += 1
+            result = super()._call_tool(tool_name, tool_args, **kwargs)
+            if result and not (isinstance(result, str) and result.startswith(_ERROR_PREFIXES)):
+                self.tool_cache.put(key, result, ttl=ttl)
+            return result
+        finally:
+            if self.tool_call_hook is not None:
+                self.tool_call_hook(tool_name, start, time.time(), cached)
+
+    def tool_cache_stats(self):
+        stats = self.tool_cache.stats()
+        stats["per_tool"] = {name: {"hits": h, "misses": m} for name, (h, m) in self.tool_cache_counts.items()}
+        return stats
@@ -0,0 +1,108 @@
+# tts_cache.py
+# 固定提示语的 TTS PCM 磁盘缓存。以 (文本, 模型, 音色, 格式) 为键保存合成好的 PCM，
+# 播放时用内存映射直接读文件，不再每次走一遍云端合成。总大小超过上限时按最近最少使用淘汰。
+# 命中只更新内存里的 last_used，索引在写入新条目时或 flush() 时才落盘，避免每次唤醒都写一次 SD 卡。
+import hashlib
+import json
+import mmap
+import os
+import threading
+import time
+
+
+class TTSCache:
+    def __init__(self, cache_dir="tts_cache", max_bytes=50 * 1024 * 1024):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.index_path = os.path.join(cache_dir, "index.json")
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(cache_dir, exist_ok=True)
+        self._index = self._load_index()
+
+    @staticmethod
+    def make_key(text, model, voice, fmt):
+        raw = json.dumps([text, model, voice, fmt], ensure_ascii=False)
+        return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+    def _load_index(self):
+        try:
+            with open(self.index_path, "r", encoding="utf-8") as f:
+                index = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+        # 丢掉文件已经不存在的条目
+        return {k: v for k, v in index.items() if os.path.exists(self._path(k))}
+
+    def _save_index(self):
+        tmp = self.index_path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self._index, f, ensure_ascii=False)
+        os.replace(tmp, self.index_path)
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key + ".pcm")
+
+    def contains(self, text, model, voice, fmt):
+        return self.make_key(text, model, voice, fmt) in self._index
+
+    def open(self, text, model, voice, fmt):
+        """命中时返回只读的内存映射(调用方负责 close)，未命中返回 None"""
+        key = self.make_key(text, model, voice, fmt)
+        with self._lock:
+            entry = self._index.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            try:
+                with open(self._path(key), "rb") as f:
+                    mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except (OSError, ValueError):
+                self._index.pop(key, None)
+                self.misses += 1
+                return None
+            self.hits += 1
+            entry["last_used"] = time.time() # 下次写入索引时一起保存
+            return mapped
+
+    def put(self, text, model, voice, fmt, pcm):
+        if not pcm or len(pcm) > self.max_bytes:
+            return
+        key = self.make_key(text, model, voice, fmt)
+        path = self._path(key)
+        with self._lock:
+            tmp = path + ".tmp"
+            with open(tmp, "wb") as f:
+                f.write(pcm)
+            os.replace(tmp, path)
+            self._index[key] = {"text": text, "size": len(pcm), "last_used": time.time()}
+            self._evict()
+            self._save_index()
+
+    def flush(self):
+        """把内存中的访问时间写回索引（退出时调用）"""
+        with self._lock:
+            self._save_index()
+
+    def _evict(self):
+        total = sum(e["size"] for e in self._index.values())
+        for key, entry in sorted(self._index.items(), key=lambda kv: kv[1]["last_used"]):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(self._path(key))
+            except OSError:
+                pass
+            total -= entry["size"]
+            del self._index[key]
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._index),
+            "bytes": sum(e["size"] for e in self._index.values()),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+        }
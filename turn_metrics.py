@@ -0,0 +1,233 @@
+# turn_metrics.py
+# 每轮对话的延迟分解。主循环和回调在关键点打时间戳（唤醒、指令端点、LLM 首字、每次工具调用、LLM 结束、
+# TTS 首个音频、TTS 结束），一轮结束时算出各阶段耗时：
+#   - 累计进直方图，通过本机 HTTP 以 Prometheus 文本格式暴露（/metrics），/stats 返回最近若干轮的 p50/p95
+#   - 每轮一行写入按大小轮转的 JSONL 文件，便于离线汇总整个设备群的数据
+import json
+import logging
+import logging.handlers
+import os
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+METRICS_HOST = os.environ.get("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.environ.get("METRICS_PORT", "9109")) # 0 表示不开 HTTP 端点
+TURN_METRICS_FILE = os.environ.get("TURN_METRICS_FILE", "turn_metrics.jsonl") # 为空表示不写文件
+TURN_METRICS_MAX_MB = float(os.environ.get("TURN_METRICS_MAX_MB", "5"))
+TURN_METRICS_BACKUPS = int(os.environ.get("TURN_METRICS_BACKUPS", "3"))
+
+# (阶段名, 起点时间戳, 终点时间戳)，两个时间戳都有时才计入
+STAGES = [
+    ("listen", "wake", "endpoint"), # 唤醒到判定说完（含用户说话时间）
+    ("asr_finalize", "endpoint", "asr_done"), # 判定说完到拿到最终识别结果
+    ("llm_first_token", "llm_start", "llm_first_token"),
+    ("llm_total", "llm_start", "llm_done"),
+    ("response", "endpoint", "tts_first_audio"), # 用户说完到听到第一个字，即体感延迟
+    ("tts_playback", "tts_first_audio", "tts_done"),
+    ("turn_total", "endpoint", "tts_done"),
+]
+BUCKETS = (0.05, 0.1, 0.25, 0.5, 0.75, 1.0, 1.5, 2.0, 3.0, 5.0, 8.0, 13.0, 20.0)
+# 这些结局的轮次只计数，不计入阶段直方图（listen 阶段会是整个超时时长）
+UNTIMED_OUTCOMES = ("no_command", "asr_error")
+
+
+class Histogram:
+    def __init__(self, buckets=BUCKETS, window=500):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+        self.recent = deque(maxlen=window) # 计算 p50/p95 用的最近样本
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+        self.recent.append(value)
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+
+    def quantile(self, q):
+        if not self.recent:
+            return None
+        ordered = sorted(self.recent)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def _labels(**labels):
+    return ",".join(f'{k}="{str(v).replace(chr(92), chr(92) * 2).replace(chr(34), chr(92) + chr(34))}"'
+                    for k, v in labels.items())
+
+
+class TurnMetrics:
+    """
+    begin_turn() 开始一轮，stamp(名称) 打点（同名只记第一次），record_tool 记录工具调用，
+    end_turn(结局) 结算。stamp 可以在任意线程调用；没有进行中的轮次时忽略。
+    """
+    def __init__(self, jsonl_path=TURN_METRICS_FILE):
+        self._lock = threading.Lock()
+        self._turn = None
+        self.turn_count = 0
+        self.stages = {name: Histogram() for name, _, _ in STAGES}
+        self.tools = {} # (工具名, 是否命中缓存) -> Histogram
+        self.outcomes = {}
+        self._server = None
+        self._log = None
+        self.stamp_hook = None # stamp_hook(名称, ts=时间) 在每个被记录的时间点之后调用（会话录制用）
+        if jsonl_path:
+            self._log = logging.getLogger("turn_metrics")
+            self._log.propagate = False
+            self._log.setLevel(logging.INFO)
+            if not self._log.handlers:
+                handler = logging.handlers.RotatingFileHandler(
+                    jsonl_path, maxBytes=int(TURN_METRICS_MAX_MB * 1024 * 1024),
+                    backupCount=TURN_METRICS_BACKUPS, encoding="utf-8")
+                handler.setFormatter(logging.Formatter("%(message)s"))
+                self._log.addHandler(handler)
+
+    # ---- 打点 ----
+    def begin_turn(self):
+        """开始新的一轮（上一轮没结算就丢弃）"""
+        with self._lock:
+            self._turn = {"started": time.time(), "stamps": {}, "tools": []}
+
+    def ensure_turn(self):
+        """没有进行中的轮次时开始一轮（连续对话的后续指令没有唤醒这一步）"""
+        with self._lock:
+            if self._turn is None:
+                self._turn = {"started": time.time(), "stamps": {}, "tools": []}
+
+    def stamp(self, name, after=None):
+        """记录时间点；after 指定的时间点还没出现时忽略（例如端点之前的提示音不算回复的首个音频）"""
+        now = time.time()
+        with self._lock:
+            turn = self._turn
+            if turn is None or name in turn["stamps"] or (after and after not in turn["stamps"]):
+                return
+            turn["stamps"][name] = now
+        hook = self.stamp_hook
+        if hook is not None:
+            hook(name, ts=now)
+
+    def record_tool(self, tool_name, start, end, cached=False):
+        with self._lock:
+            self.tools.setdefault((tool_name, cached), Histogram()).observe(end - start)
+            if self._turn is not None:
+                self._turn["tools"].append({"name": tool_name, "start": start, "end": end, "cached": cached})
+
+    def end_turn(self, outcome):
+        """结算本轮，返回 {阶段: 毫秒}；没有进行中的轮次时返回 None"""
+        with self._lock:
+            turn, self._turn = self._turn, None
+            if turn is None:
+                return None
+            self.turn_count += 1
+            self.outcomes[outcome] = self.outcomes.get(outcome, 0) + 1
+            stamps = turn["stamps"]
+            stages = {}
+            for name, start, end in STAGES:
+                if start in stamps and end in stamps and stamps[end] >= stamps[start]:
+                    stages[name] = stamps[end] - stamps[start]
+            if outcome not in UNTIMED_OUTCOMES:
+                for name, seconds in stages.items():
+                    self.stages[name].observe(seconds)
+            origin = turn["started"]
+            record = {
+                "ts": round(origin, 3),
+                "turn": self.turn_count,
+                "outcome": outcome,
+                "stamps_ms": {k: round((v - origin) * 1000) for k, v in sorted(stamps.items(), key=lambda kv: kv[1])},
+                "stages_ms": {k: round(v * 1000) for k, v in stages.items()},
+                "tools": [{"name": t["name"], "cached": t["cached"], "start_ms": round((t["start"] - origin) * 1000),
+                           "ms": round((t["end"] - t["start"]) * 1000)} for t in turn["tools"]],
+            }
+        if self._log is not None:
+            try:
+                self._log.info(json.dumps(record, ensure_ascii=False))
+            except Exception as e:
+                print(f"[耗时] 写入 JSONL 失败: {e}")
+        return record["stages_ms"]
+
+    # ---- 汇总 ----
+    def summary(self):
+        with self._lock:
+            stages = {}
+            for name, hist in self.stages.items():
+                if hist.count:
+                    stages[name] = {"count": hist.count, "p50_ms": round(hist.quantile(0.5) * 1000),
+                                    "p95_ms": round(hist.quantile(0.95) * 1000)}
+            tools = {}
+            for (name, cached), hist in self.tools.items():
+                key = name + (" (缓存)" if cached else "")
+                tools[key] = {"count": hist.count, "p50_ms": round(hist.quantile(0.5) * 1000),
+                              "p95_ms": round(hist.quantile(0.95) * 1000)}
+            return {"turns": self.turn_count, "outcomes": dict(self.outcomes), "stages": stages, "tools": tools}
+
+    def prometheus_text(self):
+        lines = []
+        with self._lock:
+            lines += ["# HELP pibot_turns_total Conversation turns by outcome.", "# TYPE pibot_turns_total counter"]
+            for outcome, n in self.outcomes.items():
+                lines.append(f"pibot_turns_total{{{_labels(outcome=outcome)}}} {n}")
+            families = [("pibot_turn_stage_seconds", "Latency of each stage of a conversation turn.",
+                         [({"stage": name}, hist) for name, hist in self.stages.items()]),
+                        ("pibot_tool_call_seconds", "Duration of MCP tool calls.",
+                         [({"tool": name, "cached": str(cached).lower()}, hist) for (name, cached), hist in self.tools.items()])]
+            for family, help_text, series in families:
+                lines += [f"# HELP {family} {help_text}", f"# TYPE {family} histogram"]
+                for labels, hist in series:
+                    for bound, n in zip(hist.buckets, hist.counts):
+                        lines.append(f"{family}_bucket{{{_labels(**labels, le=bound)}}} {n}")
+                    lines.append(f"{family}_bucket{{{_labels(**labels, le='+Inf')}}} {hist.count}")
+                    lines.append(f"{family}_sum{{{_labels(**labels)}}} {hist.sum:.6f}")
+                    lines.append(f"{family}_count{{{_labels(**labels)}}} {hist.count}")
+            lines += ["# HELP pibot_turn_stage_recent_seconds p50/p95 over the most recent turns.",
+                      "# TYPE pibot_turn_stage_recent_seconds gauge"]
+            for name, hist in self.stages.items():
+                for q in (0.5, 0.95):
+                    value = hist.quantile(q)
+                    if value is not None:
+                        lines.append(f"pibot_turn_stage_recent_seconds{{{_labels(stage=name, quantile=q)}}} {value:.6f}")
+        return "\n".join(lines) + "\n"
+
+    # ---- HTTP 端点 ----
+    def serve(self, host=METRICS_HOST, port=METRICS_PORT):
+        """后台线程提供 /metrics（Prometheus 文本）和 /stats（JSON），返回是否启动成功"""
+        if port <= 0:
+            return False
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.startswith("/metrics"):
+                    body, ctype = metrics.prometheus_text().encode("utf-8"), "text/plain; version=0.0.4; charset=utf-8"
+                elif self.path.startswith("/stats"):
+                    body, ctype = json.dumps(metrics.summary(), ensure_ascii=False).encode("utf-8"), "application/json; charset=utf-8"
+                else:
+                    self.send_error(404)
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", ctype)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args): # 不把每次抓取打印到控制台
+                pass
+
+        try:
+            self._server = ThreadingHTTPServer((host, port), Handler)
+        except OSError as e:
+            print(f"[耗时] 指标端点启动失败 {host}:{port}: {e}")
+            return False
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, name="metrics-http", daemon=True).start()
+        print(f"[耗时] 指标端点: http://{host}:{port}/metrics")
+        return True
+
+    def close(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
@@ -0,0 +1,178 @@
+# vad.py
+# 基于帧能量的语音活动检测，以及在此之上的指令端点检测和云端ASR上行门控。
+# 噪声底在启动时用一段环境音标定，之后在静音帧上缓慢自适应。
+import threading
+from collections import deque
+
+import numpy as np
+
+
+def frame_energy(data):
+    """16bit PCM 一帧的平均绝对幅度"""
+    samples = np.frombuffer(data, dtype=np.int16)
+    if samples.size == 0:
+        return 0.0
+    return float(np.abs(samples.astype(np.int32)).mean())
+
+
+class NoiseFloorVAD:
+    """
+    自适应噪声底的能量 VAD。
+
+    阈值 = max(噪声底 * factor, 噪声底 + margin)，不低于 min_threshold。
+    只有判为非语音的帧才参与噪声底更新，避免说话声把噪声底抬高。
+    """
+    def __init__(self, factor=3.0, margin=60.0, min_threshold=100.0, adapt_rate=0.05):
+        self.factor = factor
+        self.margin = margin
+        self.min_threshold = min_threshold
+        self.adapt_rate = adapt_rate
+        self.noise_floor = None
+
+    def calibrate(self, frames):
+        """用一组环境音帧标定初始噪声底（取中位数，对偶发噪声不敏感）"""
+        energies = [frame_energy(f) for f in frames if f]
+        if energies:
+            self.noise_floor = float(np.median(energies))
+        return self.noise_floor
+
+    @property
+    def threshold(self):
+        if self.noise_floor is None:
+            return self.min_threshold
+        return max(self.noise_floor * self.factor, self.noise_floor + self.margin, self.min_threshold)
+
+    def is_speech(self, data):
+        energy = frame_energy(data)
+        speech = energy >= self.threshold
+        if not speech:
+            if self.noise_floor is None:
+                self.noise_floor = energy
+            else:
+                self.noise_floor += self.adapt_rate * (energy - self.noise_floor)
+        return speech
+
+
+class Endpointer:
+    """
+    指令模式的端点检测，每个指令监听器一个。
+
+    update(frame) 每收到一帧调用一次，返回 None 表示继续听，否则返回结束原因：
+      "endpoint"    用户说完（ASR 已给出句末时只需 sentence_end_silence_ms 的静音，否则需 end_silence_ms）
+      "no_speech"   no_speech_timeout 秒内一直没有开口
+      "max_duration" 超过本轮最长时长
+    时间按送入的音频帧计算，decision_latency_ms 记录从最后一帧语音到做出结束判定的时长。
+    """
+    def __init__(self, vad, frame_ms=100, no_speech_timeout=5.0, end_silence_ms=800,
+                 sentence_end_silence_ms=300, max_duration=20.0, speech_start_frames=2):
+        self.vad = vad
+        self.frame_ms = frame_ms
+        self.no_speech_timeout_ms = no_speech_timeout * 1000
+        self.end_silence_ms = end_silence_ms
+        self.sentence_end_silence_ms = sentence_end_silence_ms
+        self.max_duration_ms = max_duration * 1000
+        self.speech_start_frames = speech_start_frames
+        self._sentence_end = threading.Event()
+        self.elapsed_ms = 0
+        self.speech_started = False
+        self.last_speech_ms = None
+        self._speech_run = 0 # 连续语音帧数（起始挂起平滑）
+        self.decision_latency_ms = None
+        self.reason = None
+
+    def on_sentence_end(self):
+        """ASR 回调里 is_sentence_end 为真时调用（在识别线程中）"""
+        self._sentence_end.set()
+
+    def on_speech_text(self):
+        """ASR 有新的中间结果，说明用户仍在说话"""
+        self._sentence_end.clear()
+
+    def update(self, data, speech=None):
+        """speech 为调用方已算好的 VAD 结果（同一帧只让 VAD 更新一次噪声底）"""
+        if self.reason:
+            return self.reason
+        self.elapsed_ms += self.frame_ms
+        if speech is None:
+            speech = self.vad.is_speech(data)
+        if speech:
+            self._speech_run += 1
+            if self._speech_run >= self.speech_start_frames:
+                self.speech_started = True
+            self.last_speech_ms = self.elapsed_ms
+        else:
+            self._speech_run = 0
+
+        if not self.speech_started:
+            if self.elapsed_ms >= self.no_speech_timeout_ms:
+                return self._decide("no_speech")
+        else:
+            silence_ms = self.elapsed_ms - self.last_speech_ms
+            needed = self.sentence_end_silence_ms if self._sentence_end.is_set() else self.end_silence_ms
+            if silence_ms >= needed:
+                return self._decide("endpoint")
+        if self.elapsed_ms >= self.max_duration_ms:
+            return self._decide("max_duration")
+        return None
+
+    def _decide(self, reason):
+        self.reason = reason
+        if self.last_speech_ms is not None:
+            self.decision_latency_ms = self.elapsed_ms - self.last_speech_ms
+        return reason
+
+
+class SpeechGate:
+    """
+    云端 ASR 的上行门控：纯静音帧不上传。
+
+    process(frame) 返回本次应发送的帧列表。检测到语音时先补发 pre_speech_frames 帧缓存，
+    语音结束后继续发送 post_speech_frames 帧（需长于服务端断句静音，才能及时收到句末），
+    长时间无语音时每隔 keepalive_ms 发一帧，避免服务端因长时间收不到音频而断开。
+    """
+    def __init__(self, vad, frame_ms=100, pre_speech_frames=3, post_speech_frames=10, keepalive_ms=5000):
+        self.vad = vad
+        self.frame_ms = frame_ms
+        self.post_speech_frames = post_speech_frames
+        self.keepalive_ms = keepalive_ms
+        self._pre = deque(maxlen=pre_speech_frames)
+        self._hangover = 0
+        self._since_send_ms = 0
+        self.bytes_sent = 0
+        self.bytes_suppressed = 0
+
+    def process(self, data, speech=None):
+        if speech is None:
+            speech = self.vad.is_speech(data)
+        if speech:
+            out = list(self._pre) + [data]
+            self._pre.clear()
+            self._hangover = self.post_speech_frames
+        elif self._hangover > 0:
+            self._hangover -= 1
+            out = [data]
+        elif self._since_send_ms + self.frame_ms >= self.keepalive_ms:
+            # 缓存里的帧比这一帧旧，之后不能再补发，否则服务端收到的音频会乱序
+            self.bytes_suppressed += sum(len(f) for f in self._pre)
+            self._pre.clear()
+            out = [data]
+        else:
+            if len(self._pre) == self._pre.maxlen:
+                self.bytes_suppressed += len(self._pre[0])
+            self._pre.append(data)
+            self._since_send_ms += self.frame_ms
+            return []
+        self._since_send_ms = 0
+        self.bytes_sent += sum(len(f) for f in out)
+        return out
+
+    def finish(self):
+        """会话结束，缓存中没发出去的帧也计为被抑制"""
+        self.bytes_suppressed += sum(len(f) for f in self._pre)
+        self._pre.clear()
+
+    def stats(self):
+        total = self.bytes_sent + self.bytes_suppressed
+        ratio = self.bytes_suppressed / total * 100 if total else 0.0
+        return {"bytes_sent": self.bytes_sent, "bytes_suppressed": self.bytes_suppressed,
+                "suppressed_percent": round(ratio, 1)}
@@ -2,26 +2,29 @@ import os
 import signal  # 用于处理Ctrl+C
 import sys
 from dotenv import load_dotenv  
-import io  
-from openai import OpenAI
-import re  
 import time  
 import datetime  
 import threading  
-import json, ast  
-import requests  
-from io import BytesIO  
-import tempfile  
-import numpy as np 
-from qwen_agent.agents import Assistant
-from qwen_agent.tools.base import BaseTool, register_tool
-from qwen_agent.utils.output_beautify import typewriter_print
+from concurrent.futures import ThreadPoolExecutor
+import json  
+# qwen_agent 导入较慢（树莓派上数秒），放到后台线程的 init_agent 里，不耽误开始监听唤醒词
 # 添加阿里云语音合成和识别库和PyAudio
-import pyaudio
 import dashscope
 from dashscope.audio.tts_v2 import SpeechSynthesizer, AudioFormat, ResultCallback
 # 替换为流式识别
 from dashscope.audio.asr import Recognition, RecognitionCallback, RecognitionResult
+from audio_output import get_output_engine
+from audio_capture import get_capture, MIC_PREROLL_MS
+from keyword_spotter import load_keyword_spotter
+from vad import NoiseFloorVAD, Endpointer, SpeechGate
+from conversation_state import ConversationState, ConversationStateMachine
+from tts_cache import TTSCache
+from reply_stream import ReplySegmenter
+from conversation_history import ConversationHistory, count_tokens
+from intent_router import IntentRouter
+from player_state import PlayerStateMirror
+from turn_metrics import TurnMetrics
+from session_recorder import SessionRecorder
 
 load_dotenv(dotenv_path='qwen3-235b-a22b.env')
 # 设置阿里云API密钥
@@ -42,10 +45,44 @@ if not llm_api_key:
 TTS_MODEL = "cosyvoice-v1"
 TTS_VOICE = "longwan" # 尝试兼容旧配置或用默认值
 TTS_SAMPLE_RATE = 22050
+# 流式合成：LLM 边生成边按句切分送入同一个合成会话，第一句生成完即可开口
+TTS_STREAMING = os.environ.get("TTS_STREAMING", "1") != "0"
+TTS_SENTENCE_DELIMITERS = "。！？，"
+# 固定提示语的本地PCM缓存，TTS_CACHE_MAX_MB=0 时关闭
+TTS_CACHE_FORMAT = "PCM_22050HZ_MONO_16BIT"
+TTS_CACHE_DIR = os.environ.get("TTS_CACHE_DIR", "tts_cache")
+TTS_CACHE_MAX_MB = int(os.environ.get("TTS_CACHE_MAX_MB", "50"))
+DEFAULT_WELCOME = "你好！我是小川。" # .env 里没有 welcome_<语言> 时的欢迎语
+PROMPT_LISTEN = "请讲。"
+PROMPT_BYE = "我先退下了。"
+PROMPT_THINKING = "稍等片刻，正在思考哦"
+PROMPT_ASR_ERROR = "抱歉，识别时遇到问题。"
+# 本地意图快速通道的确认语
+PROMPT_PAUSED = "好的，已暂停。"
+PROMPT_RESUMED = "好的，继续播放。"
+PROMPT_STOPPED = "好的，已停止播放。"
+PROMPT_NEXT = "好的，换下一首。"
+PROMPT_NO_NEXT = "播放队列里没有下一首了。"
+PROMPT_NOT_PAUSED = "现在没有暂停的音乐。"
+FIXED_PROMPTS = [PROMPT_LISTEN, PROMPT_BYE, PROMPT_THINKING, PROMPT_ASR_ERROR,
+                 PROMPT_PAUSED, PROMPT_RESUMED, PROMPT_STOPPED, PROMPT_NEXT, PROMPT_NO_NEXT, PROMPT_NOT_PAUSED]
 
 # 阿里云语音识别配置 (使用流式模型)
 ASR_MODEL = "paraformer-realtime-v2"  # 流式识别模型
 ASR_SAMPLE_RATE = 16000
+# 服务端断句的静音阈值(ms)，越小 is_sentence_end 来得越快
+ASR_MAX_SENTENCE_SILENCE_MS = int(os.environ.get("ASR_MAX_SENTENCE_SILENCE_MS", "500"))
+
+# 指令模式端点检测配置
+COMMAND_NO_SPEECH_TIMEOUT = float(os.environ.get("COMMAND_NO_SPEECH_TIMEOUT", "5")) # 一直不开口多少秒后退下
+COMMAND_END_SILENCE_MS = int(os.environ.get("COMMAND_END_SILENCE_MS", "800")) # 说完后静音多久结束本轮
+COMMAND_SENTENCE_END_SILENCE_MS = int(os.environ.get("COMMAND_SENTENCE_END_SILENCE_MS", "300")) # ASR已判句末时只需的静音
+COMMAND_MAX_DURATION = float(os.environ.get("COMMAND_MAX_DURATION", "20")) # 单轮指令最长时长
+vad = NoiseFloorVAD() # 噪声底在启动时标定
+# 上行门控：只把语音及前后填充发给云端ASR，ASR_UPSTREAM_GATE=0 时全部上传
+ASR_UPSTREAM_GATE = os.environ.get("ASR_UPSTREAM_GATE", "1") != "0"
+upstream_totals = {"bytes_sent": 0, "bytes_suppressed": 0} # 进程启动以来的累计
+command_endpointer = None # 当前指令监听器的端点检测器
 
 # 从环境变量中读取逗号分隔的唤醒词，提供默认值
 WakeupWords_str = os.environ.get("WakeupWords") 
@@ -54,134 +91,111 @@ if not wake_word_list:
     print("警告：未配置有效的唤醒词，将使用默认 '小川同学'")
     wake_word_list = ["小川同学"]
 
-messages = []  
-
-# 麦克风和音频流的全局变量
-mic = None
-stream = None
-recognized_text_buffer = "" # 用于累积识别文本
-last_recognized_sentence = "" # 存储上一句完整识别结果
-is_tts_speaking = False # 全局标志：TTS是否正在说话
+# 本地唤醒词模型（WakeupModelFile），加载成功时唤醒阶段不再把音频持续上传云端
+WakeupModelFile = os.environ.get("WakeupModelFile")
+KWS_CLOUD_CONFIRM = os.environ.get("KWS_CLOUD_CONFIRM", "0") == "1" # 本地命中后是否再用云端ASR确认
+KWS_CONFIRM_PREROLL_MS = 2000 # 确认时回溯的音频长度，需覆盖整个唤醒词
+keyword_spotter = load_keyword_spotter(WakeupModelFile)
+
+# 本地意图快速通道，INTENT_FAST_PATH=0 时所有指令都交给 LLM
+INTENT_FAST_PATH = os.environ.get("INTENT_FAST_PATH", "1") != "0"
+intent_router = IntentRouter()
+
+# 对话历史：最近 HISTORY_KEEP_TURNS 轮原文 + 更早对话的滚动摘要，总提示不超过 HISTORY_TOKEN_BUDGET
+HISTORY_KEEP_TURNS = int(os.environ.get("HISTORY_KEEP_TURNS", "6"))
+HISTORY_TOKEN_BUDGET = int(os.environ.get("HISTORY_TOKEN_BUDGET", "3000"))
+HISTORY_IDLE_RESET_MINUTES = float(os.environ.get("HISTORY_IDLE_RESET_MINUTES", "30")) # 空闲多久后清空历史
+
+# 麦克风由 audio_capture 中常开的采集线程统一管理，监听器只持有读取游标
+# TTS是否在说话、ASR是否出错、累积的识别句子都放在线程安全的 conv 中，回调直接通知等待方
+conv = ConversationState()
+# 每轮对话的延迟分解：各关键点打时间戳，汇总成直方图（本机 /metrics 端点）并写入轮转的 JSONL
+turn_metrics = TurnMetrics()
+# 会话录制：SESSION_RECORD_DIR 非空时把麦克风输入、TTS 输出和事件时间线录成一个 zip（session_recorder.py），
+# 之后可以用 MIC_SOURCE=wav:该文件 回放复现
+SESSION_RECORD_DIR = os.environ.get("SESSION_RECORD_DIR", "")
+SESSION_RECORD_MAX_MINUTES = float(os.environ.get("SESSION_RECORD_MAX_MINUTES", "60"))
+session_recorder = None
 stop_recognition_flag = threading.Event() # 用于优雅停止识别线程
-asr_error_occurred = False # 标记ASR是否出错
+shutdown_event = threading.Event() # 程序退出
 
 # 创建TTS回调处理类
+# 音频统一交给常驻输出引擎播放，不再为每句话创建/销毁 PyAudio 输出流
 class TTSCallback(ResultCallback):
-    def __init__(self):
-        self._player = None
-        self._stream = None
+    def __init__(self, record=False):
+        self._engine = None
         self.completed = False
         self.error_occurred = False
+        self.recorded = [] if record else None # 需要写入缓存时保留一份PCM
 
     def on_open(self):
-        global is_tts_speaking
         print("语音合成连接已打开")
-        is_tts_speaking = True # TTS开始说话
+        conv.set_tts_speaking(True) # TTS开始说话
         try:
-            self._player = pyaudio.PyAudio()
-            self._stream = self._player.open(
-                format=pyaudio.paInt16, channels=1, rate=TTS_SAMPLE_RATE, output=True
-            )
-            print("TTS音频输出流已打开")
+            self._engine = get_output_engine()
+            self._engine.start() # 仅第一次真正打开设备
         except Exception as e:
-            print(f"打开音频输出流失败: {e}")
+            print(f"打开音频输出引擎失败: {e}")
             self.error_occurred = True
-            is_tts_speaking = False # 出错时确保重置
+            conv.set_tts_speaking(False) # 出错时确保重置
 
     def on_data(self, data: bytes) -> None:
-        if self._stream and not self.error_occurred:
+        turn_metrics.stamp("tts_first_audio", after="endpoint")
+        if self.recorded is not None:
+            self.recorded.append(data)
+        if self._engine and not self.error_occurred:
             try:
-                self._stream.write(data)
+                self._engine.enqueue(data, TTS_SAMPLE_RATE, channel="tts")
             except Exception as e:
                 print(f"写入音频数据失败: {e}")
                 self.error_occurred = True
-                is_tts_speaking = False # 出错时确保重置
-                # 尝试关闭流，避免持续错误
-                try: 
-                    self._stream.stop_stream(); 
-                    self._stream.close(); 
-                except: 
-                    pass
-                try: 
-                    self._player.terminate(); 
-                except: pass
+                conv.set_tts_speaking(False) # 出错时确保重置
+                self._engine.flush("tts")
 
     def on_complete(self):
         print("语音合成任务完成")
         self.completed = True
-        # is_tts_speaking 将在 on_close 中设置
+        # tts_speaking 将在 on_close 中复位
 
     def on_error(self, message: str):
-        global is_tts_speaking
         print(f"语音合成任务失败: {message}")
         self.error_occurred = True
-        is_tts_speaking = False # 出错时确保重置
+        conv.set_tts_speaking(False) # 出错时确保重置
 
     def on_close(self):
-        global is_tts_speaking
         print("语音合成连接已关闭")
-        # 确保播放完所有缓冲数据
-        time.sleep(0.2) # 短暂等待
-        if self._stream and not self.error_occurred:
-            try: 
-                self._stream.stop_stream(); 
-                self._stream.close(); 
-            except Exception as e: 
-                print(f"关闭TTS音频流时出错: {e}")
-        if self._player and not self.error_occurred:
-            try: 
-                self._player.terminate(); 
-            except Exception as e: 
-                print(f"终止TTS PyAudio时出错: {e}")
-        is_tts_speaking = False # TTS结束说话
+        # 等待引擎把本句缓冲的数据播放完，设备本身保持打开
+        if self._engine and not self.error_occurred:
+            if not self._engine.drain("tts", timeout=120):
+                print("等待TTS音频播放完毕超时")
+        conv.set_tts_speaking(False) # TTS结束说话，唤醒等待的主循环
 
 # 语音识别回调类 (使用RecognitionCallback)
 class ASRCallback(RecognitionCallback):
     def __init__(self, listener_type="wake_word"):
         self.listener_type = listener_type # "wake_word" or "command"
-        global recognized_text_buffer, last_recognized_sentence, asr_error_occurred
-        recognized_text_buffer = "" # 清空缓冲区
-        last_recognized_sentence = ""
-        asr_error_occurred = False # 重置错误标志
+        self.recognized_text_buffer = "" # 当前句子的识别片段
+        conv.reset_recognition() # 清空累积句子并重置错误标志
         print(f"初始化 ASRCallback (类型: {self.listener_type})")
 
     def on_open(self) -> None:
-        global mic, stream, asr_error_occurred
         print("语音识别连接已打开")
-        try:
-            # 确保之前的资源已释放
-            if stream: stream.close()
-            if mic: mic.terminate()
-            mic = pyaudio.PyAudio()
-            stream = mic.open(
-                format=pyaudio.paInt16, channels=1, rate=ASR_SAMPLE_RATE, input=True, frames_per_buffer=3200 # 使用固定buffer
-            )
-            print("麦克风流已打开")
-            asr_error_occurred = False
-        except Exception as e:
-            print(f"打开麦克风失败: {e}")
-            asr_error_occurred = True
-            stop_recognition_flag.set() # 通知主线程停止
 
     def on_close(self) -> None:
         print("语音识别连接已关闭")
-        # 资源关闭移到主线程的 run_asr_listener finally 块
 
     def on_complete(self) -> None:
         print(f'语音识别完成 (类型: {self.listener_type})')
 
     def on_error(self, message) -> None:
-        global asr_error_occurred
         print(f'语音识别错误 (类型: {self.listener_type}): {message.message}')
-        asr_error_occurred = True
+        conv.set_asr_error()
         stop_recognition_flag.set() # 通知主线程停止
 
     def on_event(self, result: RecognitionResult) -> None:
-        global recognized_text_buffer, last_recognized_sentence, is_tts_speaking, asr_error_occurred
-
-        if asr_error_occurred: return # 如果出错，不再处理
+        if conv.asr_error: return # 如果出错，不再处理
 
-        if is_tts_speaking and self.listener_type == "wake_word":
+        if conv.tts_speaking and self.listener_type == "wake_word":
             # print("[忽略ASR: TTSing]") # 调试
             return
 
@@ -189,19 +203,21 @@ class ASRCallback(RecognitionCallback):
         if sentence and 'text' in sentence:
             current_segment = sentence['text']
             if current_segment: # 仅在有文本时更新
-                recognized_text_buffer = current_segment # 保存当前识别片段
-                # print(f"实时 ({self.listener_type}): {recognized_text_buffer}") # 调试
-                if RecognitionResult.is_sentence_end(sentence):
-                    sentence_text = recognized_text_buffer.strip() # 获取当前完整句子文本
+                self.recognized_text_buffer = current_segment # 保存当前识别片段
+                # print(f"实时 ({self.listener_type}): {self.recognized_text_buffer}") # 调试
+                sentence_end = RecognitionResult.is_sentence_end(sentence)
+                if self.listener_type == "command" and command_endpointer:
+                    if sentence_end: command_endpointer.on_sentence_end() # 让端点检测只需很短的静音确认
+                    else: command_endpointer.on_speech_text()
+                if sentence_end:
+                    sentence_text = self.recognized_text_buffer.strip() # 获取当前完整句子文本
                     print(f"完整句 ({self.listener_type}): {sentence_text}")
                     if sentence_text: # 确保句子不为空
-                        # 修改：追加句子而不是覆盖
-                        if last_recognized_sentence: # 如果已有内容，加个空格分隔
-                            last_recognized_sentence += " " + sentence_text
-                        else:
-                            last_recognized_sentence = sentence_text # 第一个句子直接赋值
-                        print(f"累积指令: '{last_recognized_sentence}'") # 调试
-                    recognized_text_buffer = "" # 句子结束，清空缓冲区
+                        record_event("asr_sentence", listener=self.listener_type, text=sentence_text)
+                        # 追加句子而不是覆盖，并唤醒等待识别结果的主循环
+                        accumulated = conv.append_sentence(sentence_text)
+                        print(f"累积指令: '{accumulated}'") # 调试
+                    self.recognized_text_buffer = "" # 句子结束，清空缓冲区
 
 # 语言设置
 lang = "zh-CN"  
@@ -209,7 +225,8 @@ lang = "zh-CN"
 # LLM Agent 初始化
 llm_cfg = {
     'model': os.environ.get("model"), # 允许通过环境变量配置模型
-    'model_server': 'dashscope',
+    # 默认走 DashScope；LLM_MODEL_SERVER 设为 http(s) 地址时按 OpenAI 兼容接口调用（自建服务、基准测试的本地替身）
+    'model_server': os.environ.get("LLM_MODEL_SERVER", "dashscope"),
     'api_key': llm_api_key, # 使用单独的大模型Key
     'generate_cfg': {
         'top_p': 0.8,
@@ -226,28 +243,83 @@ system_instruction = '''你是一个AI陪伴机器人，可以陪你聊天，安
 3. 根据整合后的信息，用一段自然流畅、连贯、简洁的中文来回答用户的完整问题，而不是简单地拼接各个工具的结果，融合成一个单一的、流畅的文本段落，并且明确禁止在任何情况下使用列表或项目符号。
 例如，如果用户问"现在几点，天气怎么样？"，你应该回答类似"现在是下午2点30分，今天天气晴朗。"这样的完整句子，而不是返回时间和天气两个独立的信息块。
 4.若需要获取热点新闻，可以去新浪网查看，但不要直接返回新浪网的网页内容，而是总结出热点新闻的标题和内容，用一段自然流畅、连贯、简洁的中文来回答用户的完整问题，而不是简单地拼接各个工具的结果，融合成一个单一的、流畅的文本段落，并且明确禁止在任何情况下使用列表或项目符号，每一类新闻一行。
-5.当用户指令包含播放音乐的意图时，你必须调用相应的播放音乐工具。当用户指令包含“关闭播放”、“停止播放”或类似意图时，你必须调用名为 music_player-stopplay 的工具来实际停止音乐，而不是仅仅口头回复说音乐已停止。'''
-tools = []
-try:
-    # Ensure correct indentation for the try block
-    with open("mcp_server_config.json", "r", encoding='utf-8') as f: # Specify encoding
-        config = json.load(f)
-        # Ensure the loaded config is treated as a list if it's a single tool dict
-        if isinstance(config, dict):
-            tools = [config]
-        elif isinstance(config, list):
-            tools = config # If the file already contains a list of tools
-        print("MCP工具配置已加载")
-except FileNotFoundError:
-    print("未找到 mcp_server_config.json，将不加载工具")
-except json.JSONDecodeError:
-    print("mcp_server_config.json 格式错误，将不加载工具")
-except Exception as e: # Catch generic exceptions during tool loading
-    print(f"加载工具配置时发生错误: {e}")
-
-bot = Assistant(llm=llm_cfg,
-                system_message=system_instruction,
-                function_list=tools)
+5.当用户指令包含播放音乐的意图时，你必须调用相应的播放音乐工具。当用户指令包含“关闭播放”、“停止播放”或类似意图时，你必须调用名为 music_player-stopplay 的工具来实际停止音乐，而不是仅仅口头回复说音乐已停止。
+6.当用户想连续听多首歌（例如“多放几首某某的歌”）时，逐首调用 music_player-enqueue_music 把歌加入播放队列；用户说“下一首”时调用 music_player-next_music。'''
+# 摘要用同一个模型，不带工具
+SUMMARY_INSTRUCTION = "你负责压缩对话历史。把已有摘要和新的对话合并成一段不超过200字的中文摘要，保留用户的称呼、偏好、提到的人和事以及未完成的请求，只输出摘要本身。"
+
+def summarize_history(previous_summary, dialogue):
+    prompt = f"已有摘要：{previous_summary or '无'}\n\n新的对话：\n{dialogue}"
+    response = summary_llm.chat(messages=[{"role": "system", "content": SUMMARY_INSTRUCTION},
+                                          {"role": "user", "content": prompt}], stream=False)
+    return response[-1]["content"] if response else ""
+
+history = ConversationHistory(keep_turns=HISTORY_KEEP_TURNS,
+                              token_budget=HISTORY_TOKEN_BUDGET,
+                              idle_reset_seconds=HISTORY_IDLE_RESET_MINUTES * 60,
+                              summarizer=summarize_history)
+
+# MCP 服务配置文件，基准测试等场景可以换成只含部分服务的配置
+MCP_SERVER_CONFIG = os.environ.get("MCP_SERVER_CONFIG", "mcp_server_config.json")
+
+# LLM 助手和 MCP 工具在后台线程初始化（init_agent），完成前唤醒词监听已经开始；
+# 需要助手的地方调用 get_bot() 等待，查询/暂停播放器这类操作在助手就绪前直接跳过
+bot = None
+summary_llm = None
+agent_ready = threading.Event()
+
+def init_agent():
+    global bot, summary_llm
+    init_start = time.time()
+    try:
+        from qwen_agent.llm import get_chat_model
+        from tool_cache import CachedToolAssistant
+        from mcp_startup import MCPServerLoader
+
+        tools = []
+        mcp_loader = None
+        try:
+            # Ensure correct indentation for the try block
+            with open(MCP_SERVER_CONFIG, "r", encoding='utf-8') as f: # Specify encoding
+                config = json.load(f)
+                # Ensure the loaded config is treated as a list if it's a single tool dict
+                if isinstance(config, dict) and "mcpServers" in config:
+                    # 各 MCP 服务并行连接，标了 "lazy": true 的服务推迟到第一次用到时再启动（见 mcp_startup.py）
+                    mcp_loader = MCPServerLoader(config)
+                    tools = mcp_loader.start()
+                elif isinstance(config, dict):
+                    tools = [config]
+                elif isinstance(config, list):
+                    tools = config # If the file already contains a list of tools
+                print("MCP工具配置已加载")
+        except FileNotFoundError:
+            print(f"未找到 {MCP_SERVER_CONFIG}，将不加载工具")
+        except json.JSONDecodeError:
+            print(f"{MCP_SERVER_CONFIG} 格式错误，将不加载工具")
+        except Exception as e: # Catch generic exceptions during tool loading
+            print(f"加载工具配置时发生错误: {e}")
+
+        # 天气、地图、网页抓取等幂等工具的结果按 TTL 缓存（规则见 tool_cache.py，播放器和时间工具不缓存）
+        bot = CachedToolAssistant(llm=llm_cfg,
+                                  system_message=system_instruction,
+                                  function_list=tools)
+        if mcp_loader is not None:
+            mcp_loader.attach(bot) # 启动时没等到的服务连上后补注册工具
+        bot.tool_call_hook = turn_metrics.record_tool
+        summary_llm = get_chat_model(llm_cfg)
+        history.fixed_tokens = count_tokens(system_instruction)
+        print(f"助手初始化完成，耗时 {(time.time() - init_start) * 1000:.0f} ms")
+    except Exception as e:
+        print(f"助手初始化失败: {e}")
+    finally:
+        agent_ready.set()
+
+def get_bot():
+    """等待后台初始化完成并返回助手（初始化失败时为 None）"""
+    if not agent_ready.is_set():
+        print("等待助手初始化完成...")
+        agent_ready.wait()
+    return bot
 
 def display_text(s):
     print(s)
@@ -274,22 +346,74 @@ def display_text(s):
 #     text = re.sub(r'\n{2,}', '\n', text).strip()
 #     return text
 
-def text_to_speech(text, _lang=None):  
-    """使用阿里云语音合成服务将文本转换为语音，并管理 is_tts_speaking 标志"""
-    global is_tts_speaking
-    if is_tts_speaking:
+try:
+    tts_cache = TTSCache(TTS_CACHE_DIR, TTS_CACHE_MAX_MB * 1024 * 1024) if TTS_CACHE_MAX_MB > 0 else None
+except OSError as e:
+    print(f"TTS缓存目录不可用，关闭缓存: {e}")
+    tts_cache = None
+
+def play_cached_prompt(text):
+    """固定提示语命中缓存时，从内存映射的PCM文件直接播放，返回是否命中"""
+    if tts_cache is None:
+        return False
+    mapped = tts_cache.open(text, TTS_MODEL, TTS_VOICE, TTS_CACHE_FORMAT)
+    if mapped is None:
+        print(f"[TTS缓存] 未命中: {text} {tts_cache.stats()}")
+        return False
+    print(f"[TTS缓存] 命中: {text} {tts_cache.stats()}")
+    if not conv.try_begin_tts():
+        mapped.close()
+        print("警告：TTS 已经在说话，忽略新的请求")
+        return True
+    view = memoryview(mapped)
+    record_event("tts_text", text=text, cached=True)
+    turn_metrics.stamp("tts_first_audio", after="endpoint")
+    try:
+        engine = get_output_engine()
+        chunk = TTS_SAMPLE_RATE # 每次送 0.5 秒
+        for i in range(0, len(view), chunk):
+            engine.enqueue(view[i:i + chunk], TTS_SAMPLE_RATE, channel="tts")
+        engine.drain("tts", timeout=60)
+    except Exception as e:
+        print(f"播放缓存提示语时出错: {e}")
+    finally:
+        view.release()
+        mapped.close()
+        conv.set_tts_speaking(False)
+    return True
+
+def prewarm_tts_cache():
+    """启动时把欢迎语和固定提示语（实际会说的那些）预先合成进缓存（后台线程调用）"""
+    phrases = [os.environ.get("welcome_" + lang, DEFAULT_WELCOME)] + FIXED_PROMPTS
+    for text in dict.fromkeys(p for p in phrases if p):
+        if tts_cache.contains(text, TTS_MODEL, TTS_VOICE, TTS_CACHE_FORMAT):
+            continue
+        try:
+            synthesizer = SpeechSynthesizer(model=TTS_MODEL, voice=TTS_VOICE, format=AudioFormat.PCM_22050HZ_MONO_16BIT)
+            pcm = synthesizer.call(text) # 不带回调时同步返回完整音频
+            if pcm:
+                tts_cache.put(text, TTS_MODEL, TTS_VOICE, TTS_CACHE_FORMAT, pcm)
+        except Exception as e:
+            print(f"[TTS缓存] 预合成 '{text}' 失败: {e}")
+    print(f"[TTS缓存] 预热完成: {tts_cache.stats()}")
+
+def text_to_speech(text, _lang=None, cacheable=False):  
+    """使用阿里云语音合成服务将文本转换为语音，并管理 conv.tts_speaking 状态。
+    cacheable=True 的固定提示语优先从本地缓存播放，未命中时合成结果写入缓存。"""
+    if not text:
+        print("TTS: 文本为空，跳过合成")
+        return "完成。"
+    if cacheable and play_cached_prompt(text):
+        return "完成。"
+    if not conv.try_begin_tts(): # 原子地检查并占用TTS
         print("警告：TTS 已经在说话，忽略新的请求")
         return "忙碌中。"
 
     try:
         cleaned_text = text
-        if not cleaned_text:
-            print("TTS: 文本为空，跳过合成")
-            return "完成。"
-
         print(f"TTS: 准备合成: {cleaned_text}")
-        is_tts_speaking = True # TTS开始
-        callback = TTSCallback()
+        record_event("tts_text", text=cleaned_text)
+        callback = TTSCallback(record=cacheable and tts_cache is not None)
 
         synthesizer = SpeechSynthesizer(
             model=TTS_MODEL,
@@ -302,6 +426,8 @@ def text_to_speech(text, _lang=None):
         # DashScope SDK 会处理异步播放
         synthesizer.streaming_call(cleaned_text)
         synthesizer.streaming_complete() # 通知服务器文本已发送完毕
+        if callback.recorded and callback.completed and not callback.error_occurred:
+            tts_cache.put(cleaned_text, TTS_MODEL, TTS_VOICE, TTS_CACHE_FORMAT, b"".join(callback.recorded))
 
         # 不需要手动创建和管理线程了
         # tts_thread = threading.Thread(target=synthesizer.streaming_call, args=(cleaned_text,))
@@ -309,7 +435,7 @@ def text_to_speech(text, _lang=None):
         # synthesizer.streaming_complete() # 不应在这里立即调用
 
         print("TTS: 请求已发送，将在后台播放")
-        # 主循环通过检查 is_tts_speaking == False 来判断播放是否结束
+        # 主循环通过 conv.wait_tts_idle() 等待播放结束
         # 或者可以添加一个阻塞等待，如果需要确保播放完再继续
         # while not callback.completed and not callback.error_occurred:
         #     time.sleep(0.1)
@@ -320,17 +446,73 @@ def text_to_speech(text, _lang=None):
 
     except Exception as ex:  
         print(f"TTS: 意外错误: {ex}")
-        is_tts_speaking = False # 确保异常时重置标志
-        # 尝试清理可能残留的播放器资源
-        if 'callback' in locals() and hasattr(callback, '_player') and callback._player:
-            try: callback._player.terminate()
-            except: pass
+        conv.set_tts_speaking(False) # 确保异常时重置标志
+        # 丢弃可能残留在输出引擎里的半句音频
+        try: get_output_engine().flush("tts")
+        except Exception: pass
         return "发生错误！"
     
-def getPlayerStatus():
-    if is_tts_speaking: return "stopped" # TTS说话时，音乐应停止
+class StreamingTTS:
+    """把切好的句子（reply_stream.ReplySegmenter）依次送入同一个 streaming_call 合成会话"""
+    def __init__(self):
+        self.synthesizer = None
+        self.callback = None
+        self.failed = False
+
+    def send(self, segment):
+        segment = segment.strip()
+        if not segment or self.failed:
+            return
+        try:
+            if self.synthesizer is None:
+                print(f"\n[流式TTS] 首句开始合成: {segment}")
+                self.callback = TTSCallback()
+                self.synthesizer = SpeechSynthesizer(
+                    model=TTS_MODEL,
+                    voice=TTS_VOICE,
+                    format=AudioFormat.PCM_22050HZ_MONO_16BIT,
+                    callback=self.callback
+                )
+                # 思考提示等未命中缓存的合成可能还在播放，等它结束再占用，保证同一时间只有一个合成会话持有说话状态
+                while not conv.try_begin_tts():
+                    conv.wait_tts_idle()
+            record_event("tts_text", text=segment, streaming=True)
+            self.synthesizer.streaming_call(segment)
+        except Exception as e:
+            print(f"\n[流式TTS] 发送文本失败: {e}")
+            self.failed = True
+            conv.set_tts_speaking(False)
+
+    def finish(self):
+        """结束会话，等待全部音频播放完毕"""
+        if self.synthesizer is None:
+            return
+        try:
+            if not self.failed:
+                self.synthesizer.streaming_complete()
+        except Exception as e:
+            print(f"[流式TTS] 结束合成会话时出错: {e}")
+            conv.set_tts_speaking(False)
+
+    def cancel(self):
+        if self.synthesizer is not None:
+            try: self.synthesizer.streaming_cancel()
+            except Exception: pass
+        conv.set_tts_speaking(False)
+
+# 音乐服务通过本机 UDP 推送播放状态（player_state.py），这里保留镜像，查状态是内存读取
+player_state = PlayerStateMirror()
+player_state.start()
+# 暂停/恢复指令在单独的线程里按顺序发出，不等 MCP 往返；结果由音乐服务的状态推送确认
+player_commands = ThreadPoolExecutor(max_workers=1, thread_name_prefix="player-cmd")
+
+def queryPlayerStatus():
+    """优先读状态镜像，镜像不可用或过期时调用 MCP 工具查询"""
+    status = player_state.status()
+    if status is not None:
+        return status
     try:
-        result = bot._call_tool("music_player-getPlaybackStatus", "{}")
+        result = get_bot()._call_tool("music_player-getPlaybackStatus", "{}")
         # 假设工具返回包含状态的JSON字符串或字典
         if isinstance(result, str):
             status_data = json.loads(result)
@@ -344,28 +526,80 @@ def getPlayerStatus():
         print(f"获取播放器状态时出错: {e}")
         return "stopped" # 出错时默认为停止
 
-def pauseplay():
-    if is_tts_speaking: return "ignored" # TTS说话时不操作播放器
+def getPlayerStatus():
+    if conv.tts_speaking: return "stopped" # TTS说话时，音乐应停止
+    if not agent_ready.is_set(): return "stopped" # 启动阶段音乐服务还没连上，不可能在播放
+    return queryPlayerStatus()
+
+def sendPlayerCommand(tool_name):
     try:
-        return bot._call_tool("music_player-pauseplay","{}")
+        get_bot()._call_tool(tool_name, "{}")
     except Exception as e:
-        print(f"暂停/播放音乐时出错: {e}")
-        return "error"
+        print(f"调用 {tool_name} 时出错: {e}")
+
+def pauseplay():
+    if conv.tts_speaking: return "ignored" # TTS说话时不操作播放器
+    player_state.set_local("paused", expected="playing")
+    player_commands.submit(sendPlayerCommand, "music_player-pauseplay")
+    return "sent"
     
 def unpauseplay():
-    if is_tts_speaking: return "ignored" # TTS说话时不操作播放器
-    try:
-        return bot._call_tool("music_player-unpauseplay","{}")
-    except Exception as e:
-        print(f"恢复播放音乐时出错: {e}")
-        return "error"
+    if conv.tts_speaking: return "ignored" # TTS说话时不操作播放器
+    player_state.set_local("playing", expected="paused")
+    player_commands.submit(sendPlayerCommand, "music_player-unpauseplay")
+    return "sent"
+
+def handle_local_intent(intent):
+    """
+    执行本地意图并播报确认语。返回执行后的音乐状态（"playing"/"paused"/"stopped"），
+    不涉及音乐的意图返回 None。
+    """
+    if intent == "time":
+        now = datetime.datetime.now()
+        reply = f"现在是{now.hour}点{now.minute}分。"
+        display_text(f"AI: {reply}")
+        text_to_speech(reply)
+        return None
+    if intent == "pause":
+        pauseplay() # 唤醒时通常已经暂停，这里确保停在暂停状态
+        text_to_speech(PROMPT_PAUSED, cacheable=True)
+        return "paused"
+    if intent in ("stop", "next") and get_bot() is None:
+        text_to_speech(PROMPT_ASR_ERROR, cacheable=True) # 助手没初始化成功，调不了音乐工具
+        return None
+    if intent == "stop":
+        get_bot()._call_tool("music_player-stopplay", "{}")
+        text_to_speech(PROMPT_STOPPED, cacheable=True)
+        return "stopped"
+    if intent == "resume":
+        status = queryPlayerStatus()
+        if status != "paused": # 没有暂停的音乐时 unpauseplay 什么也不做，不能说"继续播放"
+            text_to_speech(PROMPT_NOT_PAUSED, cacheable=True)
+            return status if status in ("playing", "stopped") else None
+        text_to_speech(PROMPT_RESUMED, cacheable=True)
+        conv.wait_tts_idle() # 先说完确认语再恢复，避免和音乐叠在一起
+        unpauseplay()
+        return "playing"
+    if intent == "next":
+        result = json.loads(get_bot()._call_tool("music_player-next_music", "{}"))
+        if "error" in result or "空" in result.get("status", ""):
+            text_to_speech(PROMPT_NO_NEXT, cacheable=True)
+            return None
+        text_to_speech(PROMPT_NEXT, cacheable=True)
+        return "playing"
+    return None
 
 def generate_text(prompt):  
     """使用大模型生成文本，并调用TTS播放回复"""
-    global messages, is_tts_speaking # Declare both globals at the top
-    messages.append({"role": "user", "content": prompt})  
-
-    full_response_text = ""
+    if get_bot() is None:
+        text_to_speech(PROMPT_ASR_ERROR, cacheable=True) # 没有可用的助手
+        return ""
+    messages = history.begin_turn(prompt) # 摘要 + 最近几轮 + 本轮输入
+    turn_metrics.stamp("llm_start")
+    first_token_latency = None
+
+    full_response_text = "" # 当前这条助手消息的文本（工具调用前后是不同的消息）
+    segmenter = ReplySegmenter(TTS_SENTENCE_DELIMITERS) # 跟踪当前消息并切句，跳过工具调用标记
     print("AI: ", end='', flush=True) # 打印前缀
 
     # --- 添加：思考提示逻辑 ---
@@ -373,6 +607,7 @@ def generate_text(prompt):
     thinking_threshold = 5.5 # 超过多少秒提示（可调整）
     thinking_message_played = False # 是否已播放提示
     # ------------------------
+    tts_stream = StreamingTTS() if TTS_STREAMING else None
 
     try:
         # 使用bot.run生成文本
@@ -381,9 +616,10 @@ def generate_text(prompt):
             # --- 添加：检查是否需要播放思考提示 ---
             elapsed_time = time.time() - start_time
             # 检查条件：超过阈值 & 未播放过 & TTS当前空闲
-            if elapsed_time > thinking_threshold and not thinking_message_played and not is_tts_speaking:
+            if elapsed_time > thinking_threshold and not thinking_message_played and not conv.tts_speaking:
                 print("\n[AI思考中...] ", end='') # 控制台提示
-                text_to_speech("稍等片刻，正在思考哦") 
+                turn_metrics.stamp("thinking_prompt")
+                text_to_speech(PROMPT_THINKING, cacheable=True)
                 thinking_message_played = True
             # ---------------------------------
 
@@ -393,31 +629,36 @@ def generate_text(prompt):
             # --- 添加：如果正在播放思考提示，则等待 --- 
             # 避免思考提示和实际回复语音重叠
             # --- REMOVED BLOCK causing hang ---
-            # if is_tts_speaking and thinking_message_played:
+            # if conv.tts_speaking and thinking_message_played:
             #     continue # 跳过本次循环，等待TTS说完思考提示
             # ---------------------------------------
 
             # 检查响应格式是否符合预期，并确保我们处理的是 'assistant' 的最终回复
             if response and isinstance(response, list) and response[-1]:
                 last_message = response[-1]
-                if isinstance(last_message, dict) and last_message.get('role') == 'assistant' and "content" in last_message:
-                    chunk_content = last_message["content"]
-                    new_text = chunk_content[len(full_response_text):]
-                    if new_text:
-                        print(new_text, end='', flush=True) # 流式打印文本
-                        full_response_text = chunk_content # 更新完整文本
+                if first_token_latency is None and isinstance(last_message, dict) and last_message.get("content"):
+                    first_token_latency = time.time() - start_time
+                    turn_metrics.stamp("llm_first_token")
+                new_text, sentences = segmenter.update(response)
+                if new_text:
+                    print(new_text, end='', flush=True) # 流式打印文本
+                full_response_text = segmenter.text
+                if tts_stream:
+                    for sentence in sentences: # 凑够一句就送去合成
+                        tts_stream.send(sentence)
             # else: # 注释掉，避免打印不必要的格式异常
                 # 处理可能的错误或空响应
                 # print(f"[LLM响应格式异常: {response}]")
                 # break # 避免后续处理错误
 
         print() # 换行
+        turn_metrics.stamp("llm_done")
 
         # --- 添加：如果播放了思考提示，等待其完成 --- 
-        if thinking_message_played:
+        # 流式会话已开口时 tts_speaking 会一直保持到会话结束，不能在这里等待
+        if thinking_message_played and not (tts_stream and tts_stream.synthesizer):
             print("[等待思考提示TTS完成...]")
-            while is_tts_speaking:
-                time.sleep(0.1)
+            conv.wait_tts_idle()
             print("[思考提示TTS完成]")
         # ------------------------------------------
 
@@ -435,114 +676,121 @@ def generate_text(prompt):
         #         messages.append({"role": "assistant", "content": full_response_text})
         
         # 手动追加助手的最终回复到 history
-        if full_response_text:
-            messages.append({"role": "assistant", "content": full_response_text})
-        elif not asr_error_occurred: # 如果ASR没出错，但LLM没回复，也可能需要记录点什么？（可选）
+        history.end_turn(full_response_text, first_token_latency)
+        if not full_response_text and not conv.asr_error: # 如果ASR没出错，但LLM没回复，也可能需要记录点什么？（可选）
              print("[信息] LLM未生成回复内容。")
              # 可以选择不添加空消息，或者添加一个标记？目前选择不添加。
         # --------------------------
 
-        # 调用TTS播放完整回复
-        if full_response_text:
+        # 调用TTS播放完整回复（流式模式下只需送出剩余文本并等待播放结束）
+        if tts_stream:
+            for sentence in segmenter.finish():
+                tts_stream.send(sentence)
+            tts_stream.finish()
+        elif full_response_text:
             text_to_speech(full_response_text)
 
         return full_response_text
 
     except Exception as e:
         print(f"\n生成文本或TTS时出错: {e}")
-        # 确保TTS标志在出错时被重置
-        is_tts_speaking = False
+        if tts_stream:
+            tts_stream.cancel()
+        # 确保TTS状态在出错时被重置
+        conv.set_tts_speaking(False)
         error_message = f"抱歉，处理时遇到错误。" # 简化错误信息
         # 尝试记录错误到历史
-        if isinstance(messages, list):
-             messages.append({"role": "assistant", "content": error_message})
+        history.end_turn(error_message, first_token_latency)
         return error_message
 
 def run_asr_listener(listener_type="wake_word"):
     """运行一个语音识别监听器实例（唤醒词或指令）"""
-    global stop_recognition_flag, mic, stream, recognized_text_buffer, last_recognized_sentence, asr_error_occurred
+    global command_endpointer
 
     print(f"启动 {listener_type} 监听器...")
+    record_event("listen_start", listener=listener_type)
     callback = ASRCallback(listener_type)
     recognition = None # 初始化
+    cursor = None
+    gate = SpeechGate(vad) if ASR_UPSTREAM_GATE else None
 
     try:
+        capture = get_capture() # 设备只在第一次调用时打开
+        # 指令监听带一小段回溯，唤醒后紧接着说的话不会被截掉开头
+        cursor = capture.subscribe(preroll_ms=MIC_PREROLL_MS if listener_type == "command" else 0)
+        extra_params = {}
+        if listener_type == "command":
+            command_endpointer = Endpointer(
+                vad,
+                no_speech_timeout=COMMAND_NO_SPEECH_TIMEOUT,
+                end_silence_ms=COMMAND_END_SILENCE_MS,
+                sentence_end_silence_ms=COMMAND_SENTENCE_END_SILENCE_MS,
+                max_duration=COMMAND_MAX_DURATION)
+            extra_params["max_sentence_silence"] = ASR_MAX_SENTENCE_SILENCE_MS
         recognition = Recognition(
             model=ASR_MODEL,
             format='pcm',
             sample_rate=ASR_SAMPLE_RATE,
             semantic_punctuation_enabled=False, # 标点可能干扰唤醒词
-            callback=callback)
+            callback=callback,
+            **extra_params)
 
         recognition.start() # start 可能抛出异常，特别是网络或认证问题
-        stop_recognition_flag.clear() # 重置停止标志
-        recognized_text_buffer = "" # 清空缓冲区
-        last_recognized_sentence = ""
-        asr_error_occurred = False # 重置错误标志
-
-        silent_frames = 0
-        max_silent_time = 5 # 指令模式下5秒静音则停止 (原为3秒)
-        frame_size = 3200 # 与mic open一致
-        max_silent_frames = int(max_silent_time * ASR_SAMPLE_RATE / frame_size)
-        start_listen_time = time.time()
-        max_command_listen_time = 20 # 指令模式最长听15秒
+        stop_recognition_flag.clear() # 重置停止标志（识别结果和错误标志已在 ASRCallback 初始化时重置）
+
+        frame_size = 3200 # 每帧 100ms (16kHz 16bit)
 
         while not stop_recognition_flag.is_set():
-            if asr_error_occurred: # 如果回调报告错误，退出
+            if conv.asr_error: # 如果回调报告错误，退出
                  print(f"{listener_type} 监听器：检测到错误，退出。")
                  break
 
-            if stream and not stream.is_stopped(): # 检查流是否有效
+            if capture.running: # 检查采集是否有效
                 try:
-                    data = stream.read(frame_size, exception_on_overflow=False)
+                    data = cursor.read(frame_size, timeout=1.0) # 阻塞等待下一帧，无需额外 sleep
+                    if not data: continue # 暂时没有新数据（采集停止时由上面的 running 检查退出）
                     if stop_recognition_flag.is_set(): break # 再次检查停止标志
-                    recognition.send_audio_frame(data)
+                    speech = vad.is_speech(data) # 每帧只算一次，门控和端点检测共用
+                    if gate:
+                        for frame in gate.process(data, speech):
+                            recognition.send_audio_frame(frame)
+                    else:
+                        recognition.send_audio_frame(data)
 
-                    # 指令模式下的静音和超时检测
+                    # 指令模式下的端点检测（自适应噪声底 + 挂起平滑 + ASR句末标志）
                     if listener_type == "command":
-                        audio_data = np.frombuffer(data, dtype=np.int16)
-                        if np.abs(audio_data).mean() < 100: # 简单的能量检测
-                            silent_frames += 1
-                            if silent_frames > max_silent_frames:
-                                print("指令监听：检测到静音，停止。")
-                                stop_recognition_flag.set() # 发送停止信号
-                        else:
-                            silent_frames = 0
-                        if time.time() - start_listen_time > max_command_listen_time:
-                            print("指令监听：超时，停止。")
-                            stop_recognition_flag.set()
+                        reason = command_endpointer.update(data, speech)
+                        if reason:
+                            turn_metrics.stamp("endpoint")
+                            if command_endpointer.decision_latency_ms is not None:
+                                print(f"指令监听：结束本轮 (原因: {reason}, 最后一帧语音后 {command_endpointer.decision_latency_ms} ms 判定)")
+                            else:
+                                print(f"指令监听：结束本轮 (原因: {reason})")
+                            stop_recognition_flag.set() # 发送停止信号
 
                 except IOError as e:
                     print(f"音频流读取错误: {e}, 停止监听")
-                    asr_error_occurred = True
+                    conv.set_asr_error()
                     stop_recognition_flag.set()
                     break
-                except AttributeError as e:
-                     # 捕获 stream 可能为 None 的情况
-                     print(f"音频流属性错误（可能已关闭）: {e}")
-                     asr_error_occurred = True
-                     stop_recognition_flag.set()
-                     break
                 except Exception as e:
                     print(f"发送音频帧时未知错误: {e}")
-                    asr_error_occurred = True
+                    conv.set_asr_error()
                     stop_recognition_flag.set()
                     break
             else:
                 print(f"{listener_type} 监听器：音频流不可用或已停止，退出。")
-                asr_error_occurred = True # 标记错误状态
+                conv.set_asr_error() # 标记错误状态
                 stop_recognition_flag.set()
                 break # 退出循环
 
-            time.sleep(0.01) # 避免CPU过度占用
-
     except dashscope.common.error.AuthenticationError as e:
         print(f"阿里云认证错误: {e}")
-        asr_error_occurred = True
+        conv.set_asr_error()
         stop_recognition_flag.set()
     except Exception as e:
         print(f"启动或运行 {listener_type} 监听器时出错: {e}")
-        asr_error_occurred = True
+        conv.set_asr_error()
         stop_recognition_flag.set() # 确保出错时也尝试停止
     finally:
         print(f"--- 清理 {listener_type} 监听器资源 ---")
@@ -554,93 +802,205 @@ def run_asr_listener(listener_type="wake_word"):
             except Exception as e:
                 print(f"停止识别器 {listener_type} 时出错: {e}")
 
-        # 在这里关闭流和mic，因为回调的on_close可能不总被调用或有时序问题
-        if stream:
-            try:
-                stream.stop_stream()
-                stream.close()
-                print("音频流已关闭")
-            except Exception:
-                pass # 忽略关闭流时的错误
-            stream = None # 明确置为None
-        if mic:
-            try:
-                mic.terminate()
-            except Exception:
-                pass # 忽略终止mic时的错误
-            mic = None # 明确置为None
+        if listener_type == "command":
+            record_event("listen_stop", listener=listener_type,
+                         reason=command_endpointer.reason if command_endpointer else None)
+            command_endpointer = None
+        else:
+            record_event("listen_stop", listener=listener_type)
+        if gate:
+            gate.finish()
+            stats = gate.stats()
+            upstream_totals["bytes_sent"] += stats["bytes_sent"]
+            upstream_totals["bytes_suppressed"] += stats["bytes_suppressed"]
+            print(f"{listener_type} 上行音频: 发送 {stats['bytes_sent'] // 1024} KB, 抑制 {stats['bytes_suppressed'] // 1024} KB ({stats['suppressed_percent']}%)"
+                  f"；累计发送 {upstream_totals['bytes_sent'] // 1024} KB, 抑制 {upstream_totals['bytes_suppressed'] // 1024} KB")
+        # 只释放自己的游标，麦克风设备保持常开
+        if cursor:
+            cursor.close()
+            if cursor.dropped_samples or cursor.underruns:
+                print(f"{listener_type} 监听器: 丢弃 {cursor.dropped_samples} 个采样点, 等待超时 {cursor.underruns} 次")
         print(f"--- {listener_type} 监听器资源清理完毕 ---")
    
-def start_recognition():
-    global recognized_text_buffer, last_recognized_sentence, is_tts_speaking, asr_error_occurred
+def listen_for_cloud_wake_word():
+    """云端流式识别 + 唤醒词子串匹配（未加载本地唤醒词模型时使用）"""
+    listener_done = threading.Event()
+    def listen():
+        try:
+            run_asr_listener("wake_word")
+        finally:
+            listener_done.set()
+            conv.notify() # 唤醒下面等待结果的循环
+    listener_thread = threading.Thread(target=listen, daemon=True)
+    listener_thread.start()
+
+    wake_detected = False
+    while True:
+        # 阻塞到 ASR 回调送来完整句子、报错或监听线程退出，不再定时轮询
+        conv.wait_for(lambda: conv.sentence or conv.asr_error or listener_done.is_set())
+        if conv.asr_error: # 如果ASR线程内部出错，退出等待
+            print("唤醒词监听因错误停止。")
+            break
+        current_sentence = conv.take_sentence() # 取走完整句子，不是唤醒词就等待下一句
+        if current_sentence:
+            print(f"检查唤醒词: '{current_sentence}'") # 调试
+            lower_text = current_sentence.lower()
+            if any(word in lower_text for word in wake_word_list):
+                print(f"检测到唤醒词: {current_sentence}")
+                wake_detected = True
+                stop_recognition_flag.set() # 发送停止信号
+                break # 退出唤醒词检测循环
+        elif listener_done.is_set():
+            break
+
+    # 等待监听线程完全停止（join 本身是阻塞等待，线程一退出立即返回）
+    print("等待唤醒词监听线程停止...")
+    listener_thread.join(timeout=10)
+    if listener_thread.is_alive():
+         print("警告：唤醒词监听线程未能按时停止。")
+    return wake_detected
+
+def confirm_wake_word_with_cloud():
+    """本地模型命中后，把命中前后的一小段音频交给云端识别再确认一次"""
+    callback = ASRCallback("wake_word")
+    cursor = get_capture().subscribe(preroll_ms=KWS_CONFIRM_PREROLL_MS)
+    record_event("listen_start", listener="wake_confirm")
+    recognition = None
+    try:
+        recognition = Recognition(
+            model=ASR_MODEL,
+            format='pcm',
+            sample_rate=ASR_SAMPLE_RATE,
+            semantic_punctuation_enabled=False,
+            callback=callback)
+        recognition.start()
+        for _ in range(int((KWS_CONFIRM_PREROLL_MS + 500) / 100)): # 每帧100ms，多送0.5秒尾音
+            data = cursor.read(3200, timeout=1.0)
+            if not data: break
+            recognition.send_audio_frame(data)
+        recognition.stop() # 等待最终识别结果
+        recognition = None
+    except Exception as e:
+        print(f"云端确认唤醒词时出错: {e}，以本地检测结果为准")
+        conv.reset_recognition()
+        return True
+    finally:
+        if recognition:
+            try: recognition.stop()
+            except Exception: pass
+        cursor.close()
+        record_event("listen_stop", listener="wake_confirm")
+    sentence = conv.take_sentence()
+    confirmed = any(word in sentence.lower() for word in wake_word_list)
+    print(f"云端确认唤醒词: '{sentence}' -> {'通过' if confirmed else '未通过'}")
+    return confirmed
+
+def listen_for_local_wake_word():
+    """用本地关键词模型等待唤醒词，音频不离开本机"""
+    stop_recognition_flag.clear()
+    cursor = get_capture().subscribe()
+    record_event("listen_start", listener="local_wake_word")
+    try:
+        hit = keyword_spotter.wait_for_keyword(cursor, stop_event=stop_recognition_flag)
+    except Exception as e:
+        print(f"本地唤醒词检测出错: {e}")
+        hit = None
+    finally:
+        cursor.close()
+        record_event("listen_stop", listener="local_wake_word")
+    if hit is None:
+        return False
+    print(f"本地检测到唤醒词: {hit.text} (检测延迟 {hit.latency * 1000:.0f} ms)")
+    if KWS_CLOUD_CONFIRM:
+        return confirm_wake_word_with_cloud()
+    return True
+
+def calibrate_noise_floor(seconds=1.0):
+    """启动时录一小段环境音标定 VAD 噪声底"""
+    cursor = get_capture().subscribe()
+    try:
+        frames = [cursor.read(3200, timeout=1.0) for _ in range(int(seconds * 10))]
+    finally:
+        cursor.close()
+    floor = vad.calibrate(frames)
+    if floor is not None:
+        print(f"环境噪声底: {floor:.0f}，语音阈值: {vad.threshold:.0f}")
+    else:
+        print("噪声底标定失败，使用默认阈值")
+
+def record_event(name, **fields):
+    """会话录制开启时记录一个事件"""
+    if session_recorder is not None:
+        session_recorder.event(name, **fields)
+
+def start_session_recording():
+    global session_recorder
+    try:
+        os.makedirs(SESSION_RECORD_DIR, exist_ok=True)
+        path = os.path.join(SESSION_RECORD_DIR, time.strftime("session-%Y%m%d-%H%M%S.zip"))
+        recorder = SessionRecorder(path, max_seconds=SESSION_RECORD_MAX_MINUTES * 60,
+                                   meta={"asr_model": ASR_MODEL, "tts_model": TTS_MODEL, "tts_voice": TTS_VOICE,
+                                         "llm_model": os.environ.get("model"), "wake_words": wake_word_list})
+        recorder.attach(get_capture(), get_output_engine())
+    except Exception as e:
+        print(f"会话录制启动失败: {e}")
+        return
+    session_recorder = recorder
+    turn_metrics.stamp_hook = recorder.event
+    print(f"会话录制中: {path}")
 
+def start_recognition():
     print(f"当前工作目录: {os.getcwd()}")
     print(f"使用的唤醒词列表: {wake_word_list}") 
+    if SESSION_RECORD_DIR:
+        start_session_recording()
+    try:
+        calibrate_noise_floor()
+    except Exception as e:
+        print(f"噪声底标定时出错: {e}")
+    if tts_cache is not None:
+        threading.Thread(target=prewarm_tts_cache, daemon=True).start()
 
     # --- 启动时说欢迎语 ---
-    first = os.environ.get("welcome_" + lang, "你好！我是小川。") # 默认欢迎语
+    first = os.environ.get("welcome_" + lang, DEFAULT_WELCOME)
     display_text(first)
     initial_status = getPlayerStatus()
     print(f"初始播放器状态: {initial_status}")
     if initial_status != 'playing':
-        text_to_speech(first)
-        # 稍微等待TTS播放完毕，避免ASR立即启动冲突
-        time.sleep(0.5) # 稍微增加等待时间
-        while is_tts_speaking: time.sleep(0.1) # 确保TTS完全结束
-
-    # --- 主循环与状态管理 ---
-    current_mode = "WAKE_WORD" # 初始状态为等待唤醒词
-    music_was_playing_before_interaction = False # 新增状态变量，用于跟踪唤醒前音乐是否在播放
+        text_to_speech(first, cacheable=True)
+        conv.wait_tts_idle() # TTS结束时回调会直接唤醒这里，避免ASR立即启动冲突
+
+    # --- 主循环：由 ASR/TTS 回调事件驱动的状态机 ---
+    machine = ConversationStateMachine(ConversationStateMachine.WAKE_WORD) # 初始状态为等待唤醒词
+    music_was_playing_before_interaction = False # 用于跟踪唤醒前音乐是否在播放
+    retry_delay = 0 # 唤醒监听出错时的退避时间，正常未命中不等待
     
-    while True:
-        if current_mode == "WAKE_WORD":
+    while not shutdown_event.is_set():
+        if machine.state == ConversationStateMachine.WAKE_WORD:
             # --- 步骤1: 持续监听唤醒词 ---
             print("\n=== 开始监听唤醒词 ===")
-            # music_was_playing_before_interaction = False # 在这里重置会导致唤醒失败时丢失状态，移到后面更合适
-            asr_error_occurred = False # 重置错误标志
-            last_recognized_sentence = "" # 重置句子
-            listener_thread = threading.Thread(target=run_asr_listener, args=("wake_word",), daemon=True)
-            listener_thread.start()
-
-            wake_detected = False
-            while listener_thread.is_alive():
-                if asr_error_occurred: # 如果ASR线程内部出错，退出等待
-                    print("唤醒词监听因错误停止。")
-                    break
-
-                current_sentence = last_recognized_sentence # 使用完整的句子检查
-                if current_sentence:
-                    print(f"检查唤醒词: '{current_sentence}'") # 调试
-                    lower_text = current_sentence.lower()
-                    if any(word in lower_text for word in wake_word_list):
-                        print(f"检测到唤醒词: {current_sentence}")
-                        wake_detected = True
-                        stop_recognition_flag.set() # 发送停止信号
-                        break # 退出唤醒词检测循环
-                    else:
-                        # 不是唤醒词，重置等待下一句完整识别
-                        last_recognized_sentence = ""
-
-                time.sleep(0.2) # 避免CPU空转
-
-            # 等待监听线程完全停止
-            print("等待唤醒词监听线程停止...")
-            listener_thread.join(timeout=10) # 增加超时时间
-            if listener_thread.is_alive():
-                 print("警告：唤醒词监听线程未能按时停止。")
-                 # 可能需要更强的停止机制
+            conv.reset_recognition() # 重置识别结果和错误标志
+            if keyword_spotter is not None:
+                wake_detected = listen_for_local_wake_word()
+            else:
+                wake_detected = listen_for_cloud_wake_word()
 
-            if not wake_detected or asr_error_occurred:
+            if not wake_detected or conv.asr_error:
                  print("未检测到唤醒词或发生错误，重新开始监听...")
                  # 如果因为唤醒失败或错误而重新监听，检查之前是否暂停了音乐
                  if music_was_playing_before_interaction:
                      print("唤醒失败或错误，但之前音乐已暂停，尝试恢复...")
                      unpauseplay()
                  music_was_playing_before_interaction = False # 无论如何都重置状态
-                 time.sleep(2) # 暂停一下再重试
-                 continue # 循环回到开始
+                 if conv.asr_error: # 只有出错时才退避重试（1s 起，最多 8s），可被退出信号打断
+                     retry_delay = min(retry_delay * 2, 8) if retry_delay else 1
+                     shutdown_event.wait(retry_delay)
+                 continue # 留在 WAKE_WORD 状态
+            retry_delay = 0
 
             print("唤醒词监听已停止。")
+            turn_metrics.begin_turn()
+            turn_metrics.stamp("wake")
 
             # --- 步骤2: 交互提示 (成功唤醒后) --- 
             current_status = getPlayerStatus()
@@ -652,49 +1012,70 @@ def start_recognition():
             else:
                 music_was_playing_before_interaction = False # 确保如果音乐未播放，此标志为False
             
-            text_to_speech("请讲。")
-            while is_tts_speaking: time.sleep(0.1) # 等待"请讲"说完
-            
-            current_mode = "COMMAND" # 切换到指令模式
-            # 直接进入下一次循环的COMMAND分支
-            continue 
+            text_to_speech(PROMPT_LISTEN, cacheable=True)
+            conv.wait_tts_idle() # 等待"请讲"说完
+            machine.transition(ConversationStateMachine.COMMAND, "检测到唤醒词")
 
-        elif current_mode == "COMMAND":
+        elif machine.state == ConversationStateMachine.COMMAND:
             # --- 步骤3: 监听用户指令 (或后续指令) --- 
             print("\n=== 开始监听指令 ===")
-            recognized_text_buffer = "" # 清空缓冲区
-            last_recognized_sentence = ""
-            asr_error_occurred = False # 重置错误标志
+            turn_metrics.ensure_turn() # 连续对话的后续指令没有唤醒这一步
 
-            # 在主线程运行指令监听，简化状态管理
+            # 在主线程运行指令监听，端点检测结束后返回
             run_asr_listener("command") 
 
-            user_command = last_recognized_sentence # 获取最终结果
+            user_command = conv.take_sentence() # 获取最终结果
+            turn_metrics.stamp("asr_done")
             print(f"最终识别指令: '{user_command}'")
 
             # --- 步骤4: 处理指令并回复 --- 
-            if asr_error_occurred:
+            intent = None
+            if user_command and INTENT_FAST_PATH and not conv.asr_error:
+                intent = intent_router.match(user_command)
+            if conv.asr_error:
                  print("指令识别过程中发生错误。")
-                 text_to_speech("抱歉，识别时遇到问题。")
-                 while is_tts_speaking: time.sleep(0.1)
+                 finish_turn_metrics("asr_error")
+                 text_to_speech(PROMPT_ASR_ERROR, cacheable=True)
+                 conv.wait_tts_idle()
                  # 准备退下，检查是否需要恢复音乐
                  if music_was_playing_before_interaction:
                      print("因错误退出指令模式，尝试恢复之前播放的音乐...")
                      unpauseplay()
                      music_was_playing_before_interaction = False # 重置标志
-                 current_mode = "WAKE_WORD" # 出错返回唤醒模式
+                 machine.transition(ConversationStateMachine.WAKE_WORD, "指令识别出错")
+            elif intent:
+                # 本地快速通道：不走 LLM，直接调用工具/本地回答
+                intent_start = time.time()
+                try:
+                    music_state = handle_local_intent(intent)
+                    conv.wait_tts_idle()
+                    turn_metrics.stamp("tts_done")
+                except Exception as e:
+                    music_state = None
+                    print(f"本地处理意图 {intent} 时出错: {e}")
+                saved = intent_router.record_local(intent, time.time() - intent_start)
+                finish_turn_metrics(f"intent_{intent}")
+                print(f"[意图] '{user_command}' -> {intent}，本地处理 {(time.time() - intent_start) * 1000:.0f} ms"
+                      + (f"，比走 LLM 约节省 {saved:.0f} ms" if saved is not None else "")
+                      + f"，统计: {intent_router.stats()}")
+                if music_state is not None:
+                    # 用户已经明确决定了音乐状态，退下时不再自动恢复
+                    music_was_playing_before_interaction = False
+                machine.transition(ConversationStateMachine.COMMAND, f"本地意图 {intent} 处理完毕")
             elif user_command: # 确保有指令且ASR未出错
+                llm_start = time.time()
                 _full_response_text = generate_text(user_command) # 生成回复并用TTS播放
-                while is_tts_speaking: time.sleep(0.1) # 等待回复播放完毕
+                conv.wait_tts_idle() # 等待回复播放完毕
+                turn_metrics.stamp("tts_done")
+                intent_router.record_llm_turn(time.time() - llm_start)
+                finish_turn_metrics("llm")
 
                 # 在指令处理完毕后，检查播放器的实际状态
                 # 如果此时播放器已经是停止状态（比如用户指令是停止播放），
                 # 那么就不应该在后续超时后自动恢复播放。
                 try:
-                    # 直接调用 music_player-getPlaybackStatus 工具获取最新状态
-                    status_result_str = bot._call_tool("music_player-getPlaybackStatus", "{}") 
-                    status_data = json.loads(status_result_str)
-                    current_player_status_after_command = status_data.get("status", "unknown")
+                    # 读状态镜像（工具调用里的停止/播放已经推送过来），镜像不可用时才调用 getPlaybackStatus
+                    current_player_status_after_command = queryPlayerStatus()
                     print(f"[DEBUG] Player status after user command processing: {current_player_status_after_command}")
                     if current_player_status_after_command == "stopped":
                         print("[DEBUG] Music player is confirmed stopped after command. Resetting 'music_was_playing_before_interaction'.")
@@ -704,45 +1085,58 @@ def start_recognition():
 
                 print("--- 等待后续指令 (或静音超时) ---") 
                 # music_was_playing_before_interaction 状态在此保持，因为交互可能继续 (除非上面重置了)
-                current_mode = "COMMAND" 
+                machine.transition(ConversationStateMachine.COMMAND, "回复完毕，等待后续指令")
             else: # 未识别到有效指令 (静音超时)
                 print("未识别到有效指令或超时。")
-                text_to_speech("我先退下了。")
-                while is_tts_speaking: time.sleep(0.1)
+                finish_turn_metrics("no_command")
+                text_to_speech(PROMPT_BYE, cacheable=True)
+                conv.wait_tts_idle()
                 # 准备退下，检查是否需要恢复音乐
                 if music_was_playing_before_interaction:
                     print("超时退出指令模式，尝试恢复之前播放的音乐...")
                     unpauseplay()
                     music_was_playing_before_interaction = False # 重置标志
-                current_mode = "WAKE_WORD" # 超时返回唤醒模式
+                machine.transition(ConversationStateMachine.WAKE_WORD, "静音超时")
 
-        # --- 安全间隔 --- 
-        time.sleep(0.1) # 主循环间的短暂间隔
+def finish_turn_metrics(outcome):
+    """结算本轮延迟分解并打印一行摘要"""
+    stages = turn_metrics.end_turn(outcome)
+    record_event("turn_end", outcome=outcome, stages_ms=stages)
+    if stages:
+        print(f"[耗时] {outcome}: " + "，".join(f"{name} {ms} ms" for name, ms in stages.items()))
 
 # 处理Ctrl+C信号
 def signal_handler(sig, frame):
     print('\n程序被中断 (Ctrl+C)')
-    global stop_recognition_flag
+    shutdown_event.set()
     stop_recognition_flag.set() # 通知所有监听线程停止
     print("正在停止监听线程...")
     # 给线程一点时间停止
     time.sleep(2)
-    # 尝试清理 PyAudio 资源 (以防万一)
-    global mic, stream
+    # 关闭常开的麦克风采集和输出引擎
+    try: print(f"工具结果缓存统计: {bot.tool_cache_stats()}")
+    except Exception: pass
+    print(f"播放状态镜像: {player_state.stats()}")
+    print(f"每轮延迟统计: {turn_metrics.summary()}")
+    if tts_cache is not None:
+        try: tts_cache.flush()
+        except Exception: pass
+    if session_recorder is not None:
+        try: print(f"会话录制已保存: {session_recorder.close()}")
+        except Exception as e: print(f"保存会话录制失败: {e}")
     print("清理音频资源...")
-    if stream:
-        try: 
-            stream.stop_stream(); stream.close(); 
-        except: pass
-        stream = None
-    if mic:
-        try: 
-            mic.terminate(); 
-        except: pass
-        mic = None
+    try:
+        capture = get_capture()
+        print(f"麦克风采集统计: {capture.stats()}")
+        capture.stop()
+    except Exception: pass
+    try: get_output_engine().close()
+    except Exception: pass
     print("资源已清理，程序退出。")
     sys.exit(0)
 
 if __name__ == "__main__":
     signal.signal(signal.SIGINT, signal_handler) # 注册信号处理器
-    start_recognition()
\ No newline at end of file
+    threading.Thread(target=init_agent, name="agent-init", daemon=True).start()
+    turn_metrics.serve()
+    start_recognition()